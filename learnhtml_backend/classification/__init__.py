@@ -0,0 +1 @@
+default_app_config = 'learnhtml_backend.classification.apps.ClassificationConfig'
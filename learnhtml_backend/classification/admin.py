@@ -1,7 +1,10 @@
 from django.contrib import admin
-from .models import Classifier, ClassificationJob, PageDownload, ClassificationResult
+from .models import Classifier, ClassificationJob, PageDownload, ClassificationResult, ClassificationMemo, \
+    JobSweep
 
 admin.site.register(Classifier)
 admin.site.register(ClassificationJob)
 admin.site.register(PageDownload)
 admin.site.register(ClassificationResult)
+admin.site.register(ClassificationMemo)
+admin.site.register(JobSweep)
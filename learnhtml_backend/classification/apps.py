@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ClassificationConfig(AppConfig):
+    name = 'learnhtml_backend.classification'
+
+    def ready(self):
+        from learnhtml_backend.classification import caching  # noqa, connects the invalidation signals
@@ -0,0 +1,80 @@
+"""Content addressed store of the classifier artifacts. Models are dumped
+uncompressed with joblib so their arrays can be memory mapped, and all the
+processes loading a model share the same read only pages. Artifacts are
+kept in the default storage under the sha256 of the file, and cached in
+CLASSIFIER_ARTIFACT_DIR when that storage isn't local. A local storage is
+only seen by its own host, the models are then also kept pickled in the
+database for the other hosts, see `publish_classifier`."""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import joblib
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+ARTIFACT_NAME = 'classifiers/{}.joblib'
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as artifact_file:
+        for chunk in iter(lambda: artifact_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_storage_local():
+    """Whether the artifacts are stored on the local disk"""
+    try:
+        default_storage.path(ARTIFACT_NAME.format('local'))
+    except NotImplementedError:
+        return False
+    return True
+
+
+def save_artifact(model):
+    """Dump a model to the store. Returns the hash and size of the artifact"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.joblib')
+    os.close(fd)
+    try:
+        joblib.dump(model, tmp_path)  # uncompressed, memory mappable
+        artifact_hash = file_hash(tmp_path)
+        size = os.path.getsize(tmp_path)
+
+        name = ARTIFACT_NAME.format(artifact_hash)
+        if not default_storage.exists(name):
+            with open(tmp_path, 'rb') as artifact_file:
+                default_storage.save(name, File(artifact_file))
+    finally:
+        os.remove(tmp_path)
+    return artifact_hash, size
+
+
+def artifact_path(artifact_hash):
+    """Local path of an artifact, downloaded from the storage first if needed"""
+    name = ARTIFACT_NAME.format(artifact_hash)
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        pass  # remote storage
+
+    path = os.path.join(settings.CLASSIFIER_ARTIFACT_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        os.makedirs(settings.CLASSIFIER_ARTIFACT_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=settings.CLASSIFIER_ARTIFACT_DIR)
+        with os.fdopen(fd, 'wb') as local_file, default_storage.open(name, 'rb') as remote_file:
+            shutil.copyfileobj(remote_file, local_file)
+        if file_hash(tmp_path) != artifact_hash:
+            os.remove(tmp_path)
+            raise ValueError('Artifact {} is corrupted'.format(artifact_hash))
+        os.replace(tmp_path, path)  # atomic, concurrent downloads are harmless
+    return path
+
+
+def load_artifact(artifact_hash):
+    """Load a model with its arrays memory mapped read only"""
+    return joblib.load(artifact_path(artifact_hash), mmap_mode='r')
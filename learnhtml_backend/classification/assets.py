@@ -0,0 +1,216 @@
+"""Content addressed cache of the assets inlined in the pages. webpage2html
+looks every stylesheet, script, image and font up in its module level
+cache before fetching it, the cache is replaced by an `AssetCache` on
+disk so assets are shared by all the downloads and processes. Urls are
+mapped to the sha256 of their content, so identical assets served under
+many urls are stored once, and the least recently used contents are
+evicted past a size limit along with the urls mapped to them. Assets of
+the skipped types are never fetched nor inlined, their urls are kept in
+the page. Empty contents, which webpage2html stores for the failed
+fetches, are not cached so a transient error doesn't blank the asset for
+every page."""
+import hashlib
+import os
+import tempfile
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import webpage2html
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# extensions of the asset types that can be skipped
+ASSET_TYPES = {
+    'images': ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.ico', '.bmp'),
+    'fonts': ('.woff', '.woff2', '.ttf', '.otf', '.eot', '.sfnt'),
+}
+TEXT, BINARY = b't', b'b'  # prefix of the stored contents, webpage2html keeps text assets as str
+
+
+def url_digest(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class AssetCache(MutableMapping):
+    """Mapping of asset url -> content stored in `directory`, holding at most
+    about `max_size` bytes of contents. `skip_types` are the names of the
+    asset types looked up as empty contents. Pages being inlined are kept in
+    memory by thread, see `page`."""
+
+    def __init__(self, directory, max_size, skip_types=()):
+        self.directory = directory
+        self.max_size = max_size
+        self.skip_extensions = tuple(extension for name in skip_types for extension in ASSET_TYPES[name])
+        self.lock = threading.Lock()
+        self.local = threading.local()  # pages being inlined and last lookup of the thread
+        os.makedirs(os.path.join(directory, 'urls'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'contents'), exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self.content_entries())
+        self.url_count = sum(1 for _ in self.url_entries())  # approximate, see `__len__`
+
+    @property
+    def pages(self):
+        """Pages being inlined by the current thread, url -> html"""
+        if not hasattr(self.local, 'pages'):
+            self.local.pages = {}
+        return self.local.pages
+
+    def url_path(self, url):
+        return os.path.join(self.directory, 'urls', url_digest(url))
+
+    def content_path(self, content_hash):
+        return os.path.join(self.directory, 'contents', content_hash)
+
+    def content_entries(self):
+        return self.entries('contents')
+
+    def url_entries(self):
+        return self.entries('urls')
+
+    def entries(self, name):
+        """The stored files, not the ones still being written"""
+        return (entry for entry in os.scandir(os.path.join(self.directory, name)) if len(entry.name) == 64)
+
+    def is_skipped(self, url):
+        return bool(self.skip_extensions) and urlsplit(url).path.lower().endswith(self.skip_extensions)
+
+    def write(self, path, data):
+        """Write a file atomically, concurrent readers see it whole or not at all"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def page(self, url, html):
+        """Serve the html of a page being inlined by this thread from memory"""
+        self.pages[url] = html
+        try:
+            yield
+        finally:
+            self.pages.pop(url, None)
+
+    def lookup(self, url):
+        """The stored content of the url, None if missing. Contents may be
+        evicted by other processes at any time."""
+        try:
+            with open(self.url_path(url), 'rb') as url_file:
+                content_path = self.content_path(url_file.read().decode('ascii'))
+            with open(content_path, 'rb') as content_file:
+                data = content_file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(content_path)  # recently used
+        except FileNotFoundError:
+            pass  # evicted since it was read
+        return data[1:].decode('utf-8') if data[:1] == TEXT else data[1:]
+
+    def __getitem__(self, url):
+        if url in self.pages:
+            return self.pages[url]
+        if self.is_skipped(url):
+            return ''  # webpage2html keeps the url of empty assets
+
+        # webpage2html checks the url is in the cache first, the content may be gone since
+        last_url, content = getattr(self.local, 'last_lookup', (None, None))
+        self.local.last_lookup = (None, None)
+        if last_url != url:
+            content = self.lookup(url)
+        if content is None:
+            raise KeyError(url)
+        return content
+
+    def __contains__(self, url):
+        if url in self.pages or self.is_skipped(url):
+            return True
+        content = self.lookup(url)
+        self.local.last_lookup = (url, content)
+        return content is not None
+
+    def __setitem__(self, url, content):
+        if self.is_skipped(url) or not content:
+            return
+        data = TEXT + content.encode('utf-8') if isinstance(content, str) else BINARY + content
+        content_hash = hashlib.sha256(data).hexdigest()
+        content_path = self.content_path(content_hash)
+        if not os.path.exists(content_path):
+            self.write(content_path, data)
+            with self.lock:
+                self.size += len(data)
+        url_path = self.url_path(url)
+        if not os.path.exists(url_path):
+            with self.lock:
+                self.url_count += 1
+        self.write(url_path, content_hash.encode('ascii'))
+        if self.size > self.max_size:
+            self.evict()
+
+    def __delitem__(self, url):
+        try:
+            os.remove(self.url_path(url))
+        except FileNotFoundError:
+            raise KeyError(url)
+        with self.lock:
+            self.url_count -= 1
+
+    def __iter__(self):
+        return iter(())  # urls are stored hashed
+
+    def __len__(self):
+        """Number of urls stored, counted at the last eviction and kept up to
+        date with the changes of this process only"""
+        return self.url_count
+
+    def evict(self):
+        """Remove the least recently used contents until the cache is down to
+        90% of its size, then the urls mapped to the removed contents"""
+        with self.lock:
+            entries = sorted(self.content_entries(), key=lambda entry: entry.stat().st_mtime)
+            self.size = sum(entry.stat().st_size for entry in entries)  # other processes share the directory
+            removed = set()
+            for entry in entries:
+                if self.size <= self.max_size * 0.9:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                self.size -= size
+                removed.add(entry.name)
+            if removed:
+                self.url_count = self.remove_urls(removed)
+
+    def remove_urls(self, content_hashes):
+        """Remove the urls mapped to the contents, returns the number of urls left"""
+        left = 0
+        for entry in self.url_entries():
+            try:
+                with open(entry.path, 'rb') as url_file:
+                    content_hash = url_file.read().decode('ascii')
+                if content_hash in content_hashes and not os.path.exists(self.content_path(content_hash)):
+                    os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue  # removed by another process
+            left += 1
+        return left
+
+
+_cache = None
+
+
+def get_asset_cache():
+    """The asset cache of the process, installed as the cache of webpage2html"""
+    global _cache
+    if _cache is None:
+        skip_types = [name.strip() for name in settings.DOWNLOAD_SKIP_ASSETS.split(',') if name.strip()]
+        if not set(skip_types) <= set(ASSET_TYPES):
+            raise ImproperlyConfigured('DOWNLOAD_SKIP_ASSETS must list some of: {}'
+                                       .format(', '.join(sorted(ASSET_TYPES))))
+        _cache = AssetCache(settings.DOWNLOAD_ASSET_CACHE_DIR, settings.DOWNLOAD_ASSET_CACHE_SIZE, skip_types)
+        webpage2html.webpage2html_cache = _cache
+    return _cache
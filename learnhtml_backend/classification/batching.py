@@ -0,0 +1,103 @@
+"""Batched prediction over several pages. Every page is run through its own
+extractor in a separate thread, but the calls to `predict` are gathered and
+answered by a single prediction over the concatenated feature matrices."""
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def concatenate(matrices):
+    """Concatenate feature matrices row-wise, keeping their type"""
+    if isinstance(matrices[0], pd.DataFrame):
+        return pd.concat(matrices, ignore_index=True)
+    if sparse.issparse(matrices[0]):
+        return sparse.vstack(matrices, format='csr')
+    return np.concatenate([np.asarray(matrix) for matrix in matrices])
+
+
+class BatchPredictor(object):
+    """Gathers the predictions of `parties` extractions and runs them
+    through `model` at once. Each extraction must use its own participant."""
+
+    def __init__(self, model, parties):
+        self.model = model
+        self.batch_sizes = []  # number of rows of every batched prediction
+        self._condition = threading.Condition()
+        self._outstanding = parties  # participants that haven't predicted or left yet
+        self._inputs = {}
+        self._outputs = None
+        self._error = None
+
+    def participant(self):
+        """Return a model proxy for one extraction"""
+        return BatchParticipant(self)
+
+    def _arrive(self, participant, features):
+        """Register the features of a participant and wait for the batch"""
+        with self._condition:
+            self._inputs[participant] = features
+            self._outstanding -= 1
+            self._run_if_complete()
+            while self._outputs is None and self._error is None:
+                self._condition.wait()
+
+            if self._error is not None:
+                raise self._error
+            return self._outputs[participant]
+
+    def _leave(self, participant):
+        """A participant finished without predicting, don't wait for it"""
+        with self._condition:
+            self._outstanding -= 1
+            self._run_if_complete()
+
+    def _run_if_complete(self):
+        """Predict the whole batch once no one else is expected"""
+        if self._outstanding > 0 or self._outputs is not None or not self._inputs:
+            return
+
+        participants = list(self._inputs)
+        try:
+            predictions = self.model.predict(concatenate([self._inputs[p] for p in participants]))
+        except Exception as exce:
+            self._error = exce
+        else:
+            self.batch_sizes.append(len(predictions))
+            self._outputs, offset = {}, 0
+            for participant in participants:
+                rows = self._inputs[participant].shape[0]
+                self._outputs[participant] = predictions[offset:offset + rows]
+                offset += rows
+        self._condition.notify_all()
+
+
+class BatchParticipant(object):
+    """Stands in for the model inside a single extraction. The first
+    `predict` call joins the batch, anything else goes to the model."""
+
+    def __init__(self, predictor):
+        self._predictor = predictor
+        self._done = False
+
+    def predict(self, features):
+        with self._predictor._condition:
+            joining, self._done = not self._done, True
+        if not joining:
+            return self._predictor.model.predict(features)
+        return self._predictor._arrive(self, features)
+
+    def leave(self):
+        """Must be called once the extraction finished, successfully or not.
+        May be called from another thread to stop waiting for an extraction
+        past its deadline. Returns whether it left before predicting."""
+        with self._predictor._condition:
+            if self._done:
+                return False
+            self._done = True
+            self._predictor._leave(self)
+            return True
+
+    def __getattr__(self, item):
+        return getattr(self._predictor.model, item)
@@ -0,0 +1,88 @@
+"""Cache of the detail responses that never change once computed,
+done jobs and classifiers. They are served with an ETag and as
+immutable, and only invalidated when a job completes (again) or the
+object is deleted. The invalidations must reach every process, so the
+responses are only cached by a shared cache backend."""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from learnhtml_backend.classification.models import Classifier, ClassificationJob
+
+DETAIL_KEY = 'learnhtml:detail:{}:{}'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def is_cache_shared():
+    """Whether the cache is seen by all the processes"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def invalidate_details(name, pks):
+    """Drop the cached details of the objects with the given ids"""
+    cache.delete_many([DETAIL_KEY.format(name, pk) for pk in pks])
+
+
+def compute_etag(data):
+    """Strong ETag of the serialized data"""
+    encoded = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode('utf-8')
+    return quote_etag(hashlib.sha1(encoded).hexdigest())
+
+
+class CachedRetrieveMixin:
+    """Retrieve serving the immutable objects from the cache, without
+    touching the database, if the cache is shared. Answers conditional
+    requests with a 304."""
+    detail_cache_name = None
+
+    def is_immutable(self, instance):
+        """Whether the detail of an object can be cached"""
+        return True
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+
+        key = DETAIL_KEY.format(self.detail_cache_name, pk)
+        shared = is_cache_shared()
+        entry = cache.get(key) if shared else None
+        if entry is None:
+            instance = self.get_object()
+            data = self.get_serializer(instance).data
+            if not self.is_immutable(instance):
+                return Response(data)
+            entry = {'etag': compute_etag(data), 'data': dict(data)}
+            if shared:
+                cache.set(key, entry, settings.DETAIL_CACHE_TIMEOUT)
+
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if '*' in etags or entry['etag'] in etags or 'W/' + entry['etag'] in etags:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+@receiver(post_delete, sender=Classifier)
+def invalidate_classifier(sender, instance, **kwargs):
+    invalidate_details('classifier', [instance.id])
+
+
+@receiver(post_delete, sender=ClassificationJob)
+def invalidate_job(sender, instance, **kwargs):
+    # also sent for the jobs deleted along with their classifier or page
+    invalidate_details('job', [instance.id])
@@ -0,0 +1,183 @@
+"""Publishing and loading of persisted classifiers. Deserialized models are
+kept in a per-process LRU cache so workers don't unpickle them for every job."""
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from learnhtml_backend.classification.artifacts import save_artifact, load_artifact, is_storage_local
+from learnhtml_backend.classification.models import Classifier
+
+logger = logging.getLogger(__name__)
+
+
+class ClassifierCache(object):
+    """LRU cache of deserialized classifiers, keyed by id and training date.
+
+    The cache is bounded both by the number of entries and by the total
+    size of the serialized models it was built from. Only the metadata of
+    the classifier is needed for a lookup, the model is loaded from its
+    artifact, or the serialized column for older classifiers and artifacts
+    missing from a local storage, exclusively on a miss."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (model, size)
+        self._size = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_key(classifier):
+        """Cache key of a classifier instance"""
+        return classifier.id, classifier.date_trained
+
+    @property
+    def size(self):
+        """Total size in bytes of the cached serialized models"""
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, classifier):
+        return self.get_key(classifier) in self._entries
+
+    def get(self, classifier):
+        """Return the deserialized model of the given classifier. `classifier`
+        may be an instance with the `serialized` field deferred."""
+        key = self.get_key(classifier)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+
+        # load outside the lock, unpickling may be slow
+        try:
+            if classifier.artifact_hash is None:
+                raise FileNotFoundError('Classifier {} has no artifact'.format(classifier.id))
+            model = load_artifact(classifier.artifact_hash)
+            size = classifier.serialized_size or 0
+        except FileNotFoundError:
+            # published on another host with a local storage
+            serialized = Classifier.objects.values_list('serialized', flat=True).get(id=classifier.id)
+            if serialized is None:
+                raise
+            model = pickle.loads(bytes(serialized))
+            size = len(serialized)
+        self.put(classifier, model, size)
+        logger.info('Loaded classifier %d (hits: %d, misses: %d)', classifier.id, self.hits, self.misses)
+        return model
+
+    def put(self, classifier, model, size):
+        """Add a model to the cache, evicting the least recently used ones"""
+        key = self.get_key(classifier)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+
+            # drop older versions of the same classifier
+            for stale_key in [k for k in self._entries if k[0] == key[0]]:
+                self._size -= self._entries.pop(stale_key)[1]
+
+            self._entries[key] = (model, size)
+            self._size += size
+
+            # evict, but always keep the newest entry
+            over_limits = lambda: len(self._entries) > self.max_entries or self._size > self.max_bytes
+            while len(self._entries) > 1 and over_limits():
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Empty the cache and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return the counters of the cache"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'size': self._size}
+
+
+classifier_cache = ClassifierCache(max_entries=settings.CLASSIFIER_CACHE_MAX_ENTRIES,
+                                   max_bytes=settings.CLASSIFIER_CACHE_MAX_BYTES)
+
+
+def load_classifier(classifier):
+    """Return the deserialized model of a classifier using the process cache"""
+    return classifier_cache.get(classifier)
+
+
+def preload_classifiers(count):
+    """Load the `count` most recently trained classifiers into the cache"""
+    classifiers = Classifier.objects.defer('serialized').order_by('-date_trained')[:count]
+    for classifier in classifiers:
+        classifier_cache.get(classifier)
+    return classifier_cache.stats()
+
+
+def describe_model(model):
+    """Metadata of a model stored along with it: the params as strings,
+    the class and the number of features, if the model exposes them"""
+    params = model.get_params(deep=True) if hasattr(model, 'get_params') else {}
+    estimator = model.steps[0][1] if hasattr(model, 'steps') else model  # pipelines
+    n_features = getattr(estimator, 'n_features_in_', getattr(estimator, 'n_features_', None))
+    return {
+        'params': {param: str(val) for param, val in params.items()},
+        'estimator_type': '{}.{}'.format(type(model).__module__, type(model).__name__),
+        'n_features': int(n_features) if n_features is not None else None,
+    }
+
+
+def publish_classifier(name, model):
+    """Persist a model under a name along with its metadata. If the storage
+    is local the model is pickled in the database as well, the hosts of the
+    workers may not be the one publishing it."""
+    artifact_hash, size = save_artifact(model)
+    serialized = pickle.dumps(model) if is_storage_local() else None
+    return Classifier.objects.create(name=name, artifact_hash=artifact_hash, serialized_size=size,
+                                     serialized=serialized, **describe_model(model))
+
+
+def describe_classifiers():
+    """Store the metadata of the classifiers published without it. Models
+    are unpickled one at a time. Returns the number of classifiers updated."""
+    described = 0
+    classifiers = Classifier.objects.filter(params__isnull=True, serialized__isnull=False)
+    for classifier_id in list(classifiers.values_list('id', flat=True)):
+        serialized = bytes(Classifier.objects.values_list('serialized', flat=True).get(id=classifier_id))
+        metadata = describe_model(pickle.loads(serialized))
+        Classifier.objects.filter(id=classifier_id).update(serialized_size=len(serialized), **metadata)
+        described += 1
+    return described
+
+
+def store_artifacts(clear_serialized=False):
+    """Move the pickled classifiers to the artifact store, one at a time.
+    Returns the number of classifiers moved. The pickles can only be cleared
+    if the storage is shared by the hosts."""
+    if clear_serialized and is_storage_local():
+        raise ImproperlyConfigured('The artifacts are stored locally, the pickled classifiers must be kept')
+    stored = 0
+    classifiers = Classifier.objects.filter(artifact_hash__isnull=True, serialized__isnull=False)
+    for classifier_id in list(classifiers.values_list('id', flat=True)):
+        serialized = bytes(Classifier.objects.values_list('serialized', flat=True).get(id=classifier_id))
+        artifact_hash, size = save_artifact(pickle.loads(serialized))
+        updates = {'artifact_hash': artifact_hash, 'serialized_size': size}
+        if clear_serialized:
+            updates['serialized'] = None
+        Classifier.objects.filter(id=classifier_id).update(**updates)
+        stored += 1
+    return stored
@@ -0,0 +1,56 @@
+"""Deadlines enforced on the stages of a task. A stage running past its
+deadline is interrupted with SIGALRM, which only works in the main thread
+of the process; the worker runs tasks there (see `workers.py`), and so do
+the sync workers of the web server for `/api/v1/classify/`."""
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(BaseException):
+    """A stage ran past its deadline. Not an `Exception`, like
+    `KeyboardInterrupt`, so the libraries ignoring their failures, e.g.
+    webpage2html fetching the assets, don't swallow it."""
+
+    def __init__(self, stage, seconds):
+        super().__init__('{} exceeded its deadline of {}s'.format(stage, seconds))
+        self.stage = stage
+        self.seconds = seconds
+
+
+def time_left():
+    """Seconds before the alarm already set fires, like the timeout of rq,
+    None without one"""
+    remaining, _ = signal.getitimer(signal.ITIMER_REAL)
+    return remaining or None
+
+
+@contextmanager
+def deadline(stage, seconds):
+    """Interrupt the block with `DeadlineExceeded` after `seconds`. An alarm
+    already set, like the timeout of rq, is restored afterwards; if it would
+    fire first it is left alone. Does nothing outside the main thread."""
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    outer_remaining, _ = signal.getitimer(signal.ITIMER_REAL)
+    if outer_remaining and outer_remaining <= seconds:
+        yield  # the outer alarm fires first
+        return
+
+    def interrupt(signum, frame):
+        raise DeadlineExceeded(stage, seconds)
+
+    started = time.monotonic()
+    outer_handler = signal.signal(signal.SIGALRM, interrupt)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, outer_handler)
+        if outer_remaining:
+            elapsed = time.monotonic() - started
+            signal.setitimer(signal.ITIMER_REAL, max(outer_remaining - elapsed, 0.001))
@@ -0,0 +1,69 @@
+"""Deduplication of pages and of classification results. Urls are
+canonicalized before lookup and results are memoized by the hash of
+the classified content, so identical pages are classified only once."""
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from django.db import transaction, IntegrityError
+
+from learnhtml_backend.classification.models import ClassificationMemo
+
+# query parameters that don't change the content of a page
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|gclid|dclid|fbclid|msclkid|yclid|mc_cid|mc_eid|_ga|_hsenc|_hsmi)$')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """Normalize an url so that trivial variants of the same page match.
+    The scheme and host are lower cased, the default port, the fragment and
+    the tracking parameters are dropped and the query is sorted."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    netloc = parts.hostname or ''
+    if ':' in netloc:
+        netloc = '[{}]'.format(netloc)  # ipv6
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = '{}:{}'.format(netloc, parts.port)
+    if parts.username is not None:
+        netloc = '{}@{}'.format(parts.netloc.rpartition('@')[0], netloc)
+
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not TRACKING_PARAMS.match(key))
+    return urlunsplit((scheme, netloc, parts.path, urlencode(query), ''))
+
+
+def find_memos(content_hashes, classifier_id):
+    """Return a dict of content hash -> id of the job holding the results
+    of the classifier for that content"""
+    content_hashes = [content_hash for content_hash in content_hashes if content_hash is not None]
+    if not content_hashes:
+        return {}
+    return dict(ClassificationMemo.objects
+                .filter(classifier_id=classifier_id, content_hash__in=content_hashes)
+                .values_list('content_hash', 'job_id'))
+
+
+def remember_results(jobs):
+    """Memoize the results of finished jobs of the same classifier, given as
+    (job, content hash) pairs. Contents already memoized keep their job."""
+    jobs = [(job, content_hash) for job, content_hash in jobs if content_hash is not None]
+    if not jobs:
+        return
+
+    existing = find_memos({content_hash for _, content_hash in jobs}, jobs[0][0].classifier_used_id)
+    memos = {}
+    for job, content_hash in jobs:
+        if content_hash not in existing and content_hash not in memos:
+            memos[content_hash] = ClassificationMemo(content_hash=content_hash, job=job,
+                                                     classifier_id=job.classifier_used_id)
+
+    try:
+        with transaction.atomic():
+            ClassificationMemo.objects.bulk_create(memos.values())
+    except IntegrityError:
+        # memoized concurrently, fall back to one by one
+        for memo in memos.values():
+            ClassificationMemo.objects.get_or_create(content_hash=memo.content_hash,
+                                                     classifier_id=memo.classifier_id,
+                                                     defaults={'job': memo.job})
@@ -0,0 +1,172 @@
+"""Download stage of the pipeline. Pages are fetched concurrently with a
+pooled asynchronous http client, their assets are inlined in a thread pool
+and the pending jobs of every downloaded page are handed to the
+classification queue. Stale pages are revalidated with a conditional GET.
+Page ids are moved to a processing list of the stage while downloaded, the
+ones left there by a crash are downloaded again at the next start."""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import django_rq
+from django.utils import timezone
+
+from learnhtml_backend.classification import submission
+from learnhtml_backend.classification.freshness import USER_AGENT, FetchedPage, conditional_headers, \
+    inline_page, is_stale, save_fetched
+from learnhtml_backend.classification.models import PageDownload, ClassificationJob
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """The page could not be fetched"""
+
+
+class PageFetcher(object):
+    """Pooled asynchronous http client with a global and a per host
+    limit of concurrent connections, timeouts and retries."""
+
+    def __init__(self, max_connections=100, max_per_host=4, timeout=30, retries=2, backoff=0.5):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             headers={'User-Agent': USER_AGENT})
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def fetch(self, url, headers=None):
+        """Return the page, its content being the body. With conditional
+        `headers` the content is None if the page was not modified. Connection
+        errors, timeouts and server errors are retried with backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+                    if response.status == 304:
+                        return FetchedPage(str(response.url), None, etag, last_modified)
+                    if response.status < 400:
+                        return FetchedPage(str(response.url), await response.read(), etag, last_modified)
+                    error = FetchError('{} returned {}'.format(url, response.status))
+                    if response.status not in RETRY_STATUSES:
+                        raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exce:
+                error = FetchError('{} failed: {!r}'.format(url, exce))
+
+            if attempt < self.retries:
+                logger.info('Retrying %s after %s', url, error)
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+
+class DownloadStage(object):
+    """Consumes page ids from redis, downloads the pages and enqueues the
+    classification of their pending jobs. `name` must be unique among the
+    stages running at once and stable across restarts."""
+
+    def __init__(self, fetcher, concurrency, inline_threads, name='default'):
+        self.fetcher = fetcher
+        self.processing_key = submission.PROCESSING_KEY.format(name)
+        self.connection = None
+        self.concurrency = concurrency
+        self.loop = asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=inline_threads)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.downloaded = 0
+        self.failed = 0
+
+    def run_sync(self, func, *args):
+        """Run blocking code, database or inlining, in the thread pool"""
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def download(self, page_id):
+        """Download a single page and hand its jobs over"""
+        try:
+            page = await self.run_sync(self.get_page, page_id)
+            if page is not None:
+                fetched = await self.fetcher.fetch(page.url, conditional_headers(page))
+                if fetched.content is not None:
+                    content = await self.run_sync(inline_page, fetched.url, fetched.content)
+                    fetched = fetched._replace(content=content)
+                elif page.is_downloaded:
+                    # not modified, keep the validators sent if the response has none
+                    fetched = fetched._replace(etag=fetched.etag or page.etag,
+                                               last_modified=fetched.last_modified or page.last_modified)
+                await self.run_sync(save_fetched, page, fetched)
+                self.downloaded += 1
+            await self.run_sync(self.enqueue_jobs, page_id)
+        except Exception as exce:
+            logger.info('Failed downloading page %d: %s', page_id, exce)
+            self.failed += 1
+            await self.run_sync(self.fail_jobs, page_id, '{}: {}'.format(type(exce).__name__, exce))
+        finally:
+            if self.connection is not None:
+                await self.run_sync(self.finish, page_id)
+            self.slots.release()
+
+    def finish(self, page_id):
+        """Remove the page from the processing list, its jobs were handed over"""
+        with self.connection.pipeline() as pipeline:
+            pipeline.delete(submission.DOWNLOADING_KEY.format(page_id))
+            # raw command, the signature of lrem differs between redis-py versions
+            pipeline.execute_command('LREM', self.processing_key, 1, page_id)
+            pipeline.execute()
+
+    def recover(self):
+        """Put back the pages left in the processing list by a previous run.
+        Returns their number."""
+        recovered = 0
+        while self.connection.rpoplpush(self.processing_key, submission.DOWNLOADS_KEY) is not None:
+            recovered += 1
+        return recovered
+
+    async def run(self, queue_name='default', stop=None):
+        """Download pages as they are submitted until `stop` is set"""
+        self.connection = django_rq.get_queue(queue_name).connection
+        recovered = await self.run_sync(self.recover)
+        if recovered:
+            logger.warning('Downloading again %d pages left by the previous run', recovered)
+
+        while stop is None or not stop.is_set():
+            await self.slots.acquire()
+            page_id = await self.run_sync(self.connection.brpoplpush, submission.DOWNLOADS_KEY,
+                                          self.processing_key, 1)
+            if page_id is None:
+                self.slots.release()
+                continue
+            asyncio.ensure_future(self.download(int(page_id)))
+
+    async def drain(self):
+        """Wait for the downloads in progress"""
+        for _ in range(self.concurrency):
+            await self.slots.acquire()
+
+    @staticmethod
+    def get_page(page_id):
+        """The page without its content, None if it was fetched in the meantime"""
+        page = PageDownload.objects.defer('content').filter(id=page_id).first()
+        return page if page is not None and is_stale(page) else None
+
+    @staticmethod
+    def enqueue_jobs(page_id):
+        jobs = list(ClassificationJob.objects.filter(classified_page_id=page_id, date_ended__isnull=True)
+                    .only('id', 'classified_page', 'classifier_used', 'priority'))
+        submission.enqueue_jobs(jobs, download=False)
+
+    @staticmethod
+    def fail_jobs(page_id, reason):
+        ClassificationJob.objects.filter(classified_page_id=page_id, date_ended__isnull=True).update(
+            is_failed=True, date_ended=timezone.now(), state=ClassificationJob.FAILED, failure_reason=reason)
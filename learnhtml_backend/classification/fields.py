@@ -0,0 +1,113 @@
+"""Custom model fields"""
+import codecs
+import json
+import os
+import zlib
+
+from django.db import models
+from django.db.models import ExpressionWrapper, F, Case, When, Value
+from django.db.models.functions import Cast
+
+
+class CompressedTextField(models.BinaryField):
+    """Text stored deflate compressed in a binary column. Values are
+    compressed on save and decompressed transparently when loaded.
+    The compression level is not part of the schema and isn't deconstructed."""
+    description = 'Compressed text'
+
+    def __init__(self, *args, level=6, **kwargs):
+        self.level = level
+        super().__init__(*args, **kwargs)
+
+    def from_db_value(self, value, expression, connection, *args):
+        if value is None:
+            return None
+        return zlib.decompress(bytes(value)).decode('utf-8')
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return zlib.decompress(bytes(value)).decode('utf-8')
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = zlib.compress(value.encode('utf-8'), self.level)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+
+def pack_xpaths(xpaths, level=6):
+    """Front code a list of xpaths, each one stored as the length of the
+    prefix shared with the previous one and the rest, and compress it"""
+    packed = []
+    previous = ''
+    for xpath in xpaths:
+        shared = len(os.path.commonprefix((previous, xpath)))
+        packed.append((shared, xpath[shared:]))
+        previous = xpath
+    return zlib.compress(json.dumps(packed, separators=(',', ':')).encode('utf-8'), level)
+
+
+def unpack_xpaths(value):
+    """Inverse of `pack_xpaths`"""
+    xpaths = []
+    previous = ''
+    for shared, rest in json.loads(zlib.decompress(bytes(value)).decode('utf-8')):
+        previous = previous[:shared] + rest
+        xpaths.append(previous)
+    return xpaths
+
+
+class PackedXPathsField(models.BinaryField):
+    """List of xpaths stored front coded and compressed in a single
+    binary column, see `pack_xpaths`"""
+    description = 'Packed xpaths'
+
+    def from_db_value(self, value, expression, connection, *args):
+        if value is None:
+            return None
+        return unpack_xpaths(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return unpack_xpaths(value)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, (list, tuple)):
+            value = pack_xpaths(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
+
+
+def raw_column(field_name):
+    """Expression selecting the compressed bytes of a field as they are
+    stored, without decompressing them"""
+    return ExpressionWrapper(F(field_name), output_field=models.BinaryField())
+
+
+def values_case(values, output_field):
+    """Expression setting a different value on every row in a single
+    update, given a dict of id -> value. Cast as the untyped parameters
+    would make the whole expression text."""
+    return Cast(Case(*[When(id=pk, then=Value(value, output_field=output_field))
+                       for pk, value in values.items()], output_field=output_field), output_field)
+
+
+def iter_decompressed(value, chunk_size=64 * 1024):
+    """Decompress and decode the raw bytes of a CompressedTextField chunk by chunk"""
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    value = memoryview(value)
+    for start in range(0, len(value), chunk_size):
+        text = decoder.decode(decompressor.decompress(value[start:start + chunk_size]))
+        if text:
+            yield text
+
+    text = decoder.decode(decompressor.flush(), final=True)
+    if text:
+        yield text
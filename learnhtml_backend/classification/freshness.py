@@ -0,0 +1,82 @@
+"""Fetching and freshness of the pages. The content of a page is fetched
+again once older than `PAGE_MAX_AGE`, with a conditional GET on the
+validators stored with it, so an unchanged page costs a 304 instead of a
+full download with its assets inlined."""
+from collections import namedtuple
+from datetime import timedelta
+
+import requests
+import webpage2html
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from learnhtml_backend.classification.assets import get_asset_cache
+
+USER_AGENT = 'Mozilla/5.0 (learnhtml)'
+
+# content is None when the stored content is still valid
+FetchedPage = namedtuple('FetchedPage', ['url', 'content', 'etag', 'last_modified'])
+
+
+def is_stale(page, now=None):
+    """Whether the page must be fetched: it was never downloaded or its
+    content is older than the max age"""
+    if not page.is_downloaded:
+        return True
+    if not settings.PAGE_MAX_AGE or page.date_downloaded is None:
+        return False
+    return page.date_downloaded < (now or timezone.now()) - timedelta(seconds=settings.PAGE_MAX_AGE)
+
+
+def stale_pages(now=None):
+    """Filter of the pages that must be fetched, see `is_stale`"""
+    stale = Q(is_downloaded=False)
+    if settings.PAGE_MAX_AGE:
+        stale |= Q(date_downloaded__lt=(now or timezone.now()) - timedelta(seconds=settings.PAGE_MAX_AGE))
+    return stale
+
+
+def conditional_headers(page):
+    """Headers revalidating the stored content of the page"""
+    headers = {}
+    if page.is_downloaded:
+        if page.etag:
+            headers['If-None-Match'] = page.etag
+        if page.last_modified:
+            headers['If-Modified-Since'] = page.last_modified
+    return headers
+
+
+def inline_page(url, html):
+    """Inline the assets of an already fetched page, they are looked up in
+    the shared asset cache first"""
+    # webpage2html reads the page from its cache instead of fetching it
+    with get_asset_cache().page(url, html):
+        return webpage2html.generate(url, verbose=False)
+
+
+def download_page(page):
+    """Fetch the page and inline its assets. Pages already downloaded are
+    revalidated, the content is None if they didn't change."""
+    headers = dict(conditional_headers(page), **{'User-Agent': USER_AGENT})
+    response = requests.get(page.url, headers=headers, timeout=settings.DOWNLOAD_TIMEOUT)
+    if response.status_code == 304:
+        return FetchedPage(page.url, None, response.headers.get('ETag', page.etag),
+                           response.headers.get('Last-Modified', page.last_modified))
+    response.raise_for_status()
+    return FetchedPage(response.url, inline_page(response.url, response.content),
+                       response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+def save_fetched(page, fetched):
+    """Store the fetched content and validators of the page, or only the
+    time of the fetch if the content didn't change"""
+    page.date_downloaded = timezone.now()
+    page.etag = fetched.etag
+    page.last_modified = fetched.last_modified
+    if fetched.content is None:
+        page.save(update_fields=['date_downloaded', 'etag', 'last_modified'])
+    else:
+        page.content = fetched.content
+        page.save()
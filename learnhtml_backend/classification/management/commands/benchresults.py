@@ -0,0 +1,72 @@
+import pickle
+import random
+import time
+
+import djclick as click
+from django.db import connection, transaction
+
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob, \
+    ClassificationResult
+from learnhtml_backend.classification.results import packed_results_case
+
+
+def random_xpaths(count):
+    """Xpaths resembling the ones of a content heavy page, in document order"""
+    xpaths = []
+    for i in range(count):
+        section, block = divmod(i, 20)
+        xpaths.append('/html/body/div[{}]/div[@class="content"]/article[{}]/div[{}]/p[{}]'.format(
+            1 + random.randint(0, 2), 1 + section, 1 + block // 5, 1 + block % 5))
+    return xpaths
+
+
+def timed(function):
+    """Run a function and return its duration in milliseconds"""
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+@click.command()
+@click.option('--jobs', type=int, default=100, help='Number of jobs')
+@click.option('--paths', type=int, default=300, help='Number of positive xpaths per job')
+def command(jobs, paths):
+    """Compare the cost of storing results as rows and packed in the job.
+    Everything is done in a transaction that is rolled back."""
+    with transaction.atomic():
+        page = PageDownload.objects.create(url='https://benchmark.invalid/', content=None)
+        classifier = Classifier.objects.create(name='benchmark', serialized=pickle.dumps(None))
+        job_list = ClassificationJob.objects.bulk_create(
+            [ClassificationJob(classified_page=page, classifier_used=classifier) for _ in range(jobs)])
+        job_results = {job.id: random_xpaths(paths) for job in job_list}
+        job_ids = list(job_results)
+
+        insert_rows = timed(lambda: ClassificationResult.objects.bulk_create(
+            [ClassificationResult(job_id=job_id, xpath=xpath)
+             for job_id, xpaths in job_results.items() for xpath in xpaths]))
+        insert_packed = timed(lambda: ClassificationJob.objects.filter(id__in=job_ids).update(
+            packed_results=packed_results_case(job_results)))
+
+        # a detail request reads the results of one job
+        read_rows = timed(lambda: [
+            list(ClassificationResult.objects.filter(job_id=job_id).values_list('xpath'))
+            for job_id in job_ids])
+        read_packed = timed(lambda: [
+            ClassificationJob.objects.only('packed_results').get(id=job_id).packed_results
+            for job_id in job_ids])
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT SUM(pg_column_size(t.*)) FROM classification_classificationresult t '
+                           'WHERE job_id = ANY(%s)', [job_ids])
+            size_rows = cursor.fetchone()[0]
+            cursor.execute('SELECT SUM(pg_column_size(packed_results)) FROM classification_classificationjob '
+                           'WHERE id = ANY(%s)', [job_ids])
+            size_packed = cursor.fetchone()[0]
+
+        transaction.set_rollback(True)
+
+    click.echo('{} jobs with {} xpaths each'.format(jobs, paths))
+    click.echo('{:<8} {:>12} {:>16} {:>12}'.format('storage', 'insert (ms)', 'read/job (ms)', 'size (kB)'))
+    for name, insert, read, size in (('rows', insert_rows, read_rows, size_rows),
+                                     ('packed', insert_packed, read_packed, size_packed)):
+        click.echo('{:<8} {:>12.1f} {:>16.3f} {:>12.1f}'.format(name, insert, read / jobs, size / 1024))
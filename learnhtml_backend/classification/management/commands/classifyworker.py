@@ -0,0 +1,88 @@
+import logging
+import multiprocessing
+import os
+import signal
+from multiprocessing.connection import wait
+
+import django_rq
+import djclick as click
+from django import db
+from django.conf import settings
+
+from learnhtml_backend.classification import tasks  # noqa, import the heavy dependencies before forking
+from learnhtml_backend.classification.classifiers import preload_classifiers
+from learnhtml_backend.classification.sweeper import schedule_sweeps
+from learnhtml_backend.classification.workers import RecyclingWorker
+from learnhtml_backend.consts import JOB_QUEUES
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(queue_names, max_jobs, max_memory):
+    """Entry point of a forked worker process"""
+    # the worker installs its own handlers for a warm shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    queues = [django_rq.get_queue(name) for name in queue_names]
+    worker = RecyclingWorker(queues, connection=queues[0].connection, max_jobs=max_jobs,
+                             max_memory=max_memory, weights=settings.CLASSIFY_QUEUE_WEIGHTS)
+    worker.work()
+
+
+@click.command()
+@click.argument('queues', metavar='QUEUES', nargs=-1)
+@click.option('--concurrency', type=float, default=settings.CLASSIFY_WORKER_CONCURRENCY,
+              help='Worker processes per CPU core')
+@click.option('--max-jobs', type=int, default=settings.CLASSIFY_WORKER_MAX_JOBS,
+              help='Recycle a worker process after this many jobs')
+@click.option('--max-memory', type=int, default=settings.CLASSIFY_WORKER_MAX_MEMORY,
+              help='Recycle a worker process once its memory exceeds this many megabytes')
+@click.option('--preload', type=int, default=settings.CLASSIFY_WORKER_PRELOAD,
+              help='Number of recent classifiers to load before forking')
+def command(queues, concurrency, max_jobs, max_memory, preload):
+    """Run a pool of long lived classification workers consuming QUEUES,
+    by default the queues of every priority and the default one"""
+    queues = queues or JOB_QUEUES + ('default',)
+    schedule_sweeps()  # run by the scheduler process, every start replaces it
+    num_workers = max(1, int(round(concurrency * multiprocessing.cpu_count())))
+
+    # load the classifiers once, the forked workers share them
+    stats = preload_classifiers(preload)
+    logger.info('Preloaded %d classifiers', stats['entries'])
+    db.connections.close_all()  # every worker must open its own connection
+
+    context = multiprocessing.get_context('fork')
+    workers = []
+    stopping = []
+
+    def spawn():
+        process = context.Process(target=run_worker, args=(queues, max_jobs, max_memory))
+        process.start()
+        workers.append(process)
+
+    def stop(signum, frame):
+        # ask every worker for a warm shutdown
+        stopping.append(signum)
+        for process in workers:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(num_workers):
+        spawn()
+    click.echo('Started {} workers on {}'.format(num_workers, ', '.join(queues)))
+
+    while workers:
+        wait([process.sentinel for process in workers], timeout=1)
+        for process in [process for process in workers if not process.is_alive()]:
+            process.join()
+            workers.remove(process)
+            if not stopping:
+                # recycled or crashed, replace it
+                logger.info('Worker %d exited with %s, replacing it', process.pid, process.exitcode)
+                spawn()
+
+    click.echo('All workers stopped')
@@ -0,0 +1,24 @@
+import logging
+import time
+
+import djclick as click
+
+from learnhtml_backend.classification import submission
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('--interval', type=float, default=0.5, help='Seconds between two checks of the pending jobs')
+@click.option('--once', is_flag=True, default=False, help='Enqueue everything pending and exit')
+def command(interval, once):
+    """Group pending classification jobs into batch tasks"""
+    if once:
+        click.echo('Enqueued {} batches'.format(submission.coalesce_jobs(flush=True)))
+        return
+
+    while True:
+        batches = submission.coalesce_jobs()
+        if batches:
+            logger.info('Enqueued %d batches', batches)
+        time.sleep(interval)
@@ -0,0 +1,9 @@
+import djclick as click
+
+from learnhtml_backend.classification.classifiers import describe_classifiers
+
+
+@click.command()
+def command():
+    """Store the metadata of the classifiers published before it was extracted"""
+    click.echo('Described {} classifiers'.format(describe_classifiers()))
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+import djclick as click
+from django.conf import settings
+
+from learnhtml_backend.classification.downloader import PageFetcher, DownloadStage
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('--concurrency', type=int, default=settings.DOWNLOAD_CONCURRENCY,
+              help='Maximum number of pages downloaded at once')
+@click.option('--per-host', type=int, default=settings.DOWNLOAD_PER_HOST,
+              help='Maximum number of connections to the same host')
+@click.option('--timeout', type=float, default=settings.DOWNLOAD_TIMEOUT,
+              help='Timeout of a request in seconds')
+@click.option('--retries', type=int, default=settings.DOWNLOAD_RETRIES, help='Retries of a failed request')
+@click.option('--inline-threads', type=int, default=settings.DOWNLOAD_INLINE_THREADS,
+              help='Threads inlining the assets of the downloaded pages')
+@click.option('--name', default=os.getenv('DYNO') or socket.gethostname(),
+              help='Name of the stage, unique and kept across restarts to recover its downloads')
+def command(concurrency, per_host, timeout, retries, inline_threads, name):
+    """Run the download stage, requires DOWNLOAD_STAGE to be enabled"""
+    loop = asyncio.get_event_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+
+    async def run():
+        async with PageFetcher(max_connections=concurrency, max_per_host=per_host,
+                               timeout=timeout, retries=retries) as fetcher:
+            stage = DownloadStage(fetcher, concurrency=concurrency, inline_threads=inline_threads, name=name)
+            await stage.run(stop=stop)
+            await stage.drain()
+            return stage
+
+    click.echo('Downloading pages')
+    stage = loop.run_until_complete(run())
+    click.echo('Stopped after {} downloads, {} failed'.format(stage.downloaded, stage.failed))
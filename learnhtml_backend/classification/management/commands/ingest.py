@@ -0,0 +1,26 @@
+import djclick as click
+
+from learnhtml_backend.classification import submission
+from learnhtml_backend.classification.models import Classifier, ClassificationJob
+
+SUMMARY = 'Submitted {0.submitted} urls ({0.rate:.0f}/s), {0.reused} reused, {0.duplicates} duplicates, ' \
+          '{0.invalid} invalid'
+
+
+@click.command()
+@click.argument('classifier_id', metavar='CLASSIFIER_ID', type=int)
+@click.argument('url_file', metavar='URL_FILE', type=click.File('r'), default='-')
+@click.option('--chunk-size', type=int, default=5000, help='Urls created and enqueued at once')
+@click.option('--priority', type=click.Choice(dict(ClassificationJob.PRIORITY_CHOICES)),
+              default=ClassificationJob.BULK, help='Priority of the classification jobs')
+def command(classifier_id, url_file, chunk_size, priority):
+    """Submit a job with CLASSIFIER_ID for every url in URL_FILE, one per
+    line, or in the standard input"""
+    classifier = Classifier.objects.defer('serialized').get(id=classifier_id)
+
+    def progress(stats):
+        click.echo(SUMMARY.format(stats), err=True)
+
+    stats = submission.ingest_urls(url_file, classifier, chunk_size=chunk_size, priority=priority,
+                                   progress=progress)
+    click.echo(SUMMARY.format(stats))
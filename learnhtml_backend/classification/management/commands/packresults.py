@@ -0,0 +1,12 @@
+import djclick as click
+
+from learnhtml_backend.classification.results import pack_stored_results
+
+
+@click.command()
+@click.option('--batch-size', type=int, default=500, help='Jobs packed per transaction')
+@click.option('--delete-rows', is_flag=True, default=False, help='Delete the result rows once packed')
+def command(batch_size, delete_rows):
+    """Pack the results of the jobs still stored one row per xpath"""
+    packed = pack_stored_results(batch_size=batch_size, delete_rows=delete_rows)
+    click.echo('Packed the results of {} jobs'.format(packed))
@@ -3,7 +3,7 @@ import pickle
 
 import djclick as click
 
-from learnhtml_backend.classification.models import Classifier
+from learnhtml_backend.classification.classifiers import publish_classifier
 
 # configure the logger to use the click settings
 logger = logging.getLogger(__name__)
@@ -15,7 +15,7 @@ logger = logging.getLogger(__name__)
 @click.argument('name', metavar='NAME', type=str)
 def command(model_file, name):
     """Upload the classifier in MODEL_FILE with NAME"""
-    classifier = pickle.dumps(pickle.load(open(model_file, 'rb')))  # check proper file
-    Classifier.objects.create(name=name, serialized=classifier)  # upload the object
+    model = pickle.load(open(model_file, 'rb'))  # check proper file
+    publish_classifier(name, model)  # upload the object and its metadata
 
     logger.info('Finished uploading model')
@@ -0,0 +1,11 @@
+import djclick as click
+
+from learnhtml_backend.classification.classifiers import store_artifacts
+
+
+@click.command()
+@click.option('--clear-serialized', is_flag=True, default=False,
+              help='Remove the pickles from the database once stored')
+def command(clear_serialized):
+    """Move the classifiers pickled in the database to the artifact store"""
+    click.echo('Stored {} classifiers'.format(store_artifacts(clear_serialized=clear_serialized)))
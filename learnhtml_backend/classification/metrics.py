@@ -0,0 +1,122 @@
+"""Instrumentation of the classification jobs. Workers time the stages of
+every job, store the timings on the job and aggregate them in redis as
+histograms, which are exposed in the Prometheus text format."""
+import logging
+import time
+from contextlib import contextmanager
+
+import django_rq
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('load', 'download', 'extract', 'predict', 'save')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_KEY = 'learnhtml:metrics:stage:{}'  # hash of bucket -> count, plus sum and count
+JOBS_KEY = 'learnhtml:metrics:jobs'  # hash of final state -> count
+
+
+class StageTimer(object):
+    """Accumulates the time spent in every stage of a job, in seconds"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def exclude(self, stage, nested):
+        """Remove the time of a stage measured within another one"""
+        if stage in self.timings and nested in self.timings:
+            self.timings[stage] = max(0, self.timings[stage] - self.timings[nested])
+
+
+class TimedModel(object):
+    """Proxy of a model timing its `predict` calls"""
+
+    def __init__(self, model, timer):
+        self._model = model
+        self._timer = timer
+
+    def predict(self, features):
+        with self._timer.stage('predict'):
+            return self._model.predict(features)
+
+    def __getattr__(self, item):
+        return getattr(self._model, item)
+
+
+def get_connection():
+    """Redis connection holding the metrics, the one of the queues"""
+    return django_rq.get_connection()
+
+
+def record_jobs(outcomes):
+    """Aggregate the final states and stage timings of finished jobs, given
+    as (state, timings) pairs. Metrics are best effort, a failure is logged."""
+    try:
+        with get_connection().pipeline(transaction=False) as pipeline:
+            for state, timings in outcomes:
+                pipeline.hincrby(JOBS_KEY, state, 1)
+                for stage, seconds in (timings or {}).items():
+                    key = STAGE_KEY.format(stage)
+                    for bound in BUCKETS:
+                        if seconds <= bound:
+                            pipeline.hincrby(key, bound, 1)
+                    pipeline.hincrbyfloat(key, 'sum', seconds)
+                    pipeline.hincrby(key, 'count', 1)
+            pipeline.execute()
+    except RedisError:
+        logger.warning('Could not record the job metrics', exc_info=True)
+
+
+def read_metrics(connection):
+    """Return the job counts by state and the histograms of the stages"""
+    with connection.pipeline(transaction=False) as pipeline:
+        pipeline.hgetall(JOBS_KEY)
+        for stage in STAGES:
+            pipeline.hgetall(STAGE_KEY.format(stage))
+        job_counts, *stage_hashes = pipeline.execute()
+
+    def decoded(values):
+        return {key.decode(): value.decode() for key, value in values.items()}
+
+    job_counts = {state: int(count) for state, count in decoded(job_counts).items()}
+    histograms = {stage: decoded(values) for stage, values in zip(STAGES, stage_hashes) if values}
+    return job_counts, histograms
+
+
+def render_metrics(job_counts, histograms, gauges):
+    """Prometheus text exposition of the metrics. `gauges` is a dict of
+    name -> (help, list of (labels, value))"""
+    lines = ['# HELP learnhtml_jobs_total Finished classification jobs by state',
+             '# TYPE learnhtml_jobs_total counter']
+    lines.extend('learnhtml_jobs_total{{state="{}"}} {}'.format(state, count)
+                 for state, count in sorted(job_counts.items()))
+
+    lines.extend(['# HELP learnhtml_stage_seconds Time spent by the jobs in every stage',
+                  '# TYPE learnhtml_stage_seconds histogram'])
+    for stage, values in histograms.items():
+        for bound in BUCKETS:
+            lines.append('learnhtml_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(
+                stage, bound, int(values.get(str(bound), 0))))
+        count, total = int(values.get('count', 0)), float(values.get('sum', 0))
+        lines.append('learnhtml_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(stage, count))
+        lines.append('learnhtml_stage_seconds_sum{{stage="{}"}} {}'.format(stage, total))
+        lines.append('learnhtml_stage_seconds_count{{stage="{}"}} {}'.format(stage, count))
+
+    for name, (help_text, samples) in gauges.items():
+        lines.extend(['# HELP {} {}'.format(name, help_text), '# TYPE {} gauge'.format(name)])
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(label, label_value)
+                                  for label, label_value in labels.items())
+            lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,46 @@
+# Generated by Django 2.0.6 on 2026-10-18 14:33
+
+from django.db import migrations
+
+import learnhtml_backend.classification.fields
+
+
+def compress_content(apps, schema_editor):
+    """Copy the html of every page to the compressed column"""
+    PageDownload = apps.get_model('classification', 'PageDownload')
+    pages = PageDownload.objects.filter(content__isnull=False).only('id', 'content')
+    for page in pages.iterator():
+        PageDownload.objects.filter(id=page.id).update(content_compressed=page.content)
+
+
+def decompress_content(apps, schema_editor):
+    """Copy the html of every page back to the text column"""
+    PageDownload = apps.get_model('classification', 'PageDownload')
+    pages = PageDownload.objects.filter(content_compressed__isnull=False).only('id', 'content_compressed')
+    for page in pages.iterator():
+        PageDownload.objects.filter(id=page.id).update(content=page.content_compressed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0006_auto_20180706_1547'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagedownload',
+            name='content_compressed',
+            field=learnhtml_backend.classification.fields.CompressedTextField(help_text="Html content(if null it means it hasn't been downloaded yet", null=True),
+        ),
+        migrations.RunPython(compress_content, decompress_content),
+        migrations.RemoveField(
+            model_name='pagedownload',
+            name='content',
+        ),
+        migrations.RenameField(
+            model_name='pagedownload',
+            old_name='content_compressed',
+            new_name='content',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.6 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+def fill_content_metadata(apps, schema_editor):
+    """Set the download flag and the size of the downloaded pages"""
+    PageDownload = apps.get_model('classification', 'PageDownload')
+    pages = PageDownload.objects.filter(content__isnull=False).only('id', 'content')
+    for page in pages.iterator():
+        PageDownload.objects.filter(id=page.id).update(is_downloaded=True,
+                                                       content_size=len(page.content.encode('utf-8')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0007_compress_page_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagedownload',
+            name='content_size',
+            field=models.PositiveIntegerField(default=None, help_text='Size of the html content in bytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='pagedownload',
+            name='is_downloaded',
+            field=models.BooleanField(default=False, help_text='Whether the content was downloaded'),
+        ),
+        migrations.RunPython(fill_content_metadata, migrations.RunPython.noop),
+    ]
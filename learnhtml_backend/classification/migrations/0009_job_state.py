@@ -0,0 +1,36 @@
+# Generated by Django 2.0.6 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+def fill_job_state(apps, schema_editor):
+    """Derive the state of the existing jobs from their flags"""
+    ClassificationJob = apps.get_model('classification', 'ClassificationJob')
+    ClassificationJob.objects.filter(is_failed=False, date_ended__isnull=False).update(state='done')
+    ClassificationJob.objects.filter(is_failed=True, date_ended__isnull=False).update(state='failed')
+    # failed by the cleanup job without being ended
+    ClassificationJob.objects.filter(is_failed=True, date_ended__isnull=True).update(state='timed_out')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0008_page_content_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('timed_out', 'Timed out')], default='pending', help_text='State of the job', max_length=16),
+        ),
+        migrations.RunPython(fill_job_state, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='classificationjob',
+            index=models.Index(fields=['state', 'date_started'], name='job_state_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classificationjob',
+            index=models.Index(fields=['-date_started'], name='job_started_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.0.6 on 2026-10-18 14:37
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_content_hash(apps, schema_editor):
+    """Hash the content of the downloaded pages"""
+    PageDownload = apps.get_model('classification', 'PageDownload')
+    pages = PageDownload.objects.filter(content__isnull=False).only('id', 'content')
+    for page in pages.iterator():
+        content_hash = hashlib.sha256(page.content.encode('utf-8')).hexdigest()
+        PageDownload.objects.filter(id=page.id).update(content_hash=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0009_job_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationjob',
+            name='reused_from',
+            field=models.ForeignKey(default=None, help_text='Job of an identical page whose results are reused', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reused_by', to='classification.ClassificationJob'),
+        ),
+        migrations.AddField(
+            model_name='pagedownload',
+            name='content_hash',
+            field=models.CharField(db_index=True, default=None, help_text='SHA-256 of the html content', max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ClassificationMemo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 of the classified html content', max_length=64)),
+                ('classifier', models.ForeignKey(help_text='The classifier used', on_delete=django.db.models.deletion.CASCADE, related_name='memos', to='classification.Classifier')),
+                ('job', models.ForeignKey(help_text='The job holding the results', on_delete=django.db.models.deletion.CASCADE, related_name='memos', to='classification.ClassificationJob')),
+            ],
+            options={
+                'ordering': ('-id',),
+                'unique_together': {('content_hash', 'classifier')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.0.6 on 2026-10-18 14:41
+
+from django.db import migrations
+import learnhtml_backend.classification.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0010_content_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationjob',
+            name='packed_results',
+            field=learnhtml_backend.classification.fields.PackedXPathsField(default=None, help_text='The positive xpaths, front coded and compressed. Null for jobs whose results are stored as rows', null=True),
+        ),
+    ]
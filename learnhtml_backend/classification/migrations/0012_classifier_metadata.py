@@ -0,0 +1,34 @@
+# Generated by Django 2.0.6 on 2026-10-18 15:02
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0011_job_packed_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classifier',
+            name='estimator_type',
+            field=models.CharField(default=None, help_text='Class of the model', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='classifier',
+            name='n_features',
+            field=models.PositiveIntegerField(default=None, help_text='Number of features of the model', null=True),
+        ),
+        migrations.AddField(
+            model_name='classifier',
+            name='params',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=None, help_text='Parameters of the model, as strings', null=True),
+        ),
+        migrations.AddField(
+            model_name='classifier',
+            name='serialized_size',
+            field=models.PositiveIntegerField(default=None, help_text='Size of the pickle in bytes', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.6 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0012_classifier_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classifier',
+            name='artifact_hash',
+            field=models.CharField(default=None, help_text='SHA-256 of the joblib artifact of the model', max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='classifier',
+            name='serialized',
+            field=models.BinaryField(default=None, help_text='Pickle, for the classifiers published before the artifacts', null=True),
+        ),
+        migrations.AlterField(
+            model_name='classifier',
+            name='serialized_size',
+            field=models.PositiveIntegerField(default=None, help_text='Size of the serialized model in bytes', null=True),
+        ),
+    ]
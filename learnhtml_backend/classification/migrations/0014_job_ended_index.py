@@ -0,0 +1,17 @@
+# Generated by Django 2.0.6 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0013_classifier_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='classificationjob',
+            index=models.Index(fields=['state', 'date_ended'], name='job_state_ended_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.0.6 on 2026-10-18 16:05
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0014_job_ended_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationjob',
+            name='failure_reason',
+            field=models.TextField(default=None, help_text='Why the job failed', null=True),
+        ),
+        migrations.AddField(
+            model_name='classificationjob',
+            name='timings',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=None, help_text='Seconds spent in every stage of the job', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.6 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0015_job_timings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='classificationjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('timed_out', 'Timed out'), ('cancelled', 'Cancelled')], default='pending', help_text='State of the job', max_length=16),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.0.6 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0016_job_cancelled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobSweep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_swept', models.DateTimeField(auto_now_add=True, db_index=True, help_text='Date of the sweep')),
+                ('timed_out', models.PositiveIntegerField(default=0, help_text='Active jobs past the timeout set as timed out')),
+                ('requeued', models.PositiveIntegerField(default=0, help_text='Active jobs missing from redis enqueued again')),
+                ('duration', models.FloatField(default=0, help_text='Seconds spent sweeping')),
+            ],
+            options={
+                'ordering': ('-id',),
+            },
+        ),
+    ]
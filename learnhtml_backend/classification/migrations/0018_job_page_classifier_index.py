@@ -0,0 +1,17 @@
+# Generated by Django 2.0.6 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0017_job_sweep'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='classificationjob',
+            index=models.Index(fields=['classified_page', 'classifier_used', '-date_started'], name='job_page_classifier_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.0.6 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+def clear_date_downloaded(apps, schema_editor):
+    """The date was set on every save, it is only kept for downloaded pages"""
+    PageDownload = apps.get_model('classification', 'PageDownload')
+    PageDownload.objects.filter(is_downloaded=False).update(date_downloaded=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0018_job_page_classifier_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagedownload',
+            name='etag',
+            field=models.CharField(default=None, help_text='ETag header of the content', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='pagedownload',
+            name='last_modified',
+            field=models.CharField(default=None, help_text='Last-Modified header of the content', max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='pagedownload',
+            name='date_downloaded',
+            field=models.DateTimeField(default=None, help_text='Date when the content was last fetched', null=True),
+        ),
+        migrations.RunPython(clear_date_downloaded, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.0.6 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0019_page_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationjob',
+            name='client',
+            field=models.CharField(default=None, help_text='Client who submitted the job', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='classificationjob',
+            name='priority',
+            field=models.CharField(choices=[('interactive', 'Interactive'), ('refresh', 'Refresh'), ('bulk', 'Bulk')], default='interactive', help_text='Priority of the job', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='classificationjob',
+            index=models.Index(fields=['client', 'state'], name='job_client_state_idx'),
+        ),
+    ]
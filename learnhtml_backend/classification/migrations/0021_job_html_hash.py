@@ -0,0 +1,18 @@
+# Generated by Django 2.0.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classification', '0020_job_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationjob',
+            name='html_hash',
+            field=models.CharField(default=None, help_text='SHA-256 of the html classified, if not the content of the page', max_length=64, null=True),
+        ),
+    ]
@@ -1,7 +1,12 @@
-from datetime import datetime
+import hashlib
 
+from django.conf import settings
+from django.contrib.postgres.fields import JSONField
 from django.core import validators
 from django.db import models
+from django.utils import timezone
+
+from learnhtml_backend.classification.fields import CompressedTextField, PackedXPathsField
 
 
 class PageDownload(models.Model):
@@ -9,9 +14,40 @@ class PageDownload(models.Model):
     url = models.TextField(help_text='Url',
                            validators=[validators.URLValidator()],
                            null=False, unique=True)
-    content = models.TextField(help_text='Html content(if null it means it hasn\'t been downloaded yet',
-                               blank=False, null=True)
-    date_downloaded = models.DateTimeField(help_text='Date created', auto_now=True, null=True)
+    content = CompressedTextField(help_text='Html content(if null it means it hasn\'t been downloaded yet',
+                                  blank=False, null=True, level=settings.PAGE_CONTENT_COMPRESSION_LEVEL)
+    date_downloaded = models.DateTimeField(help_text='Date when the content was last fetched', null=True,
+                                           default=None)
+    is_downloaded = models.BooleanField(help_text='Whether the content was downloaded', default=False)
+    content_size = models.PositiveIntegerField(help_text='Size of the html content in bytes', null=True,
+                                               default=None)
+    content_hash = models.CharField(help_text='SHA-256 of the html content', max_length=64, null=True,
+                                    default=None, db_index=True)
+    # validators of the content, to revalidate it with a conditional request
+    etag = models.CharField(help_text='ETag header of the content', max_length=255, null=True, default=None)
+    last_modified = models.CharField(help_text='Last-Modified header of the content', max_length=64,
+                                     null=True, default=None)
+
+    def get_content(self):
+        """Return the html content, it is only fetched if it was deferred
+        and the page was downloaded"""
+        if 'content' in self.get_deferred_fields() and not self.is_downloaded:
+            return None
+        return self.content
+
+    def save(self, *args, **kwargs):
+        """Keep the content metadata in sync, unless the content wasn't loaded"""
+        if 'content' not in self.get_deferred_fields():
+            encoded = self.content.encode('utf-8') if self.content is not None else None
+            self.is_downloaded = encoded is not None
+            self.content_size = len(encoded) if encoded is not None else None
+            self.content_hash = hashlib.sha256(encoded).hexdigest() if encoded is not None else None
+
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'content' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'is_downloaded', 'content_size',
+                                                                'content_hash'}
+        super().save(*args, **kwargs)
 
     class Meta:
         ordering = ('-id',)
@@ -21,7 +57,17 @@ class Classifier(models.Model):
     """Persisted classifier"""
     name = models.CharField(help_text='Name', max_length=255, blank=False, null=False)
     date_trained = models.DateTimeField(help_text='Date trained', auto_now_add=True, null=False)
-    serialized = models.BinaryField(help_text='Pickle')
+    serialized = models.BinaryField(help_text='Pickle, for the classifiers published before the artifacts',
+                                    null=True, default=None)
+    artifact_hash = models.CharField(help_text='SHA-256 of the joblib artifact of the model', max_length=64,
+                                     null=True, default=None)
+    # metadata extracted when publishing, so the model is never unpickled to be described
+    params = JSONField(help_text='Parameters of the model, as strings', null=True, default=None)
+    estimator_type = models.CharField(help_text='Class of the model', max_length=255, null=True, default=None)
+    n_features = models.PositiveIntegerField(help_text='Number of features of the model', null=True,
+                                             default=None)
+    serialized_size = models.PositiveIntegerField(help_text='Size of the serialized model in bytes',
+                                                  null=True, default=None)
 
     class Meta:
         ordering = ('-id',)
@@ -29,39 +75,131 @@ class Classifier(models.Model):
 
 class ClassificationJob(models.Model):
     """Classification task"""
-    classified_page = models.ForeignKey(to=PageDownload, help_text='The classified page instance', related_name='jobs',
-                                        on_delete=models.CASCADE)
-    classifier_used = models.ForeignKey(to=Classifier, help_text='Which classifier was used', related_name='jobs',
-                                        on_delete=models.CASCADE)
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    TIMED_OUT = 'timed_out'
+    CANCELLED = 'cancelled'
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (TIMED_OUT, 'Timed out'),
+        (CANCELLED, 'Cancelled'),
+    )
+    ACTIVE_STATES = (PENDING, RUNNING)
+    FAILED_STATES = (FAILED, TIMED_OUT)
+    # the priority is the name of the queue of the job
+    INTERACTIVE = 'interactive'
+    REFRESH = 'refresh'
+    BULK = 'bulk'
+    PRIORITY_CHOICES = (
+        (INTERACTIVE, 'Interactive'),
+        (REFRESH, 'Refresh'),
+        (BULK, 'Bulk'),
+    )
+
+    classified_page = models.ForeignKey(to=PageDownload, help_text='The classified page instance',
+                                        related_name='jobs', on_delete=models.CASCADE)
+    classifier_used = models.ForeignKey(to=Classifier, help_text='Which classifier was used',
+                                        related_name='jobs', on_delete=models.CASCADE)
     date_started = models.DateTimeField(help_text='Date when job was created', auto_now_add=True, null=False)
     date_ended = models.DateTimeField(help_text='Date when the job ended', null=True, default=None)
     is_failed = models.BooleanField(help_text='Whether the job failed or not', default=False)
+    state = models.CharField(help_text='State of the job', max_length=16, choices=STATE_CHOICES,
+                             default=PENDING)
+    reused_from = models.ForeignKey(to='self', help_text='Job of an identical page whose results are reused',
+                                    related_name='reused_by', null=True, default=None,
+                                    on_delete=models.SET_NULL)
+    timings = JSONField(help_text='Seconds spent in every stage of the job', null=True, default=None)
+    failure_reason = models.TextField(help_text='Why the job failed', null=True, default=None)
+    priority = models.CharField(help_text='Priority of the job', max_length=16, choices=PRIORITY_CHOICES,
+                                default=INTERACTIVE)
+    client = models.CharField(help_text='Client who submitted the job', max_length=64, null=True,
+                              default=None)
+    html_hash = models.CharField(help_text='SHA-256 of the html classified, if not the content of the page',
+                                 max_length=64, null=True, default=None)
+    packed_results = PackedXPathsField(help_text='The positive xpaths, front coded and compressed. '
+                                                 'Null for jobs whose results are stored as rows',
+                                       null=True, default=None)
 
     @property
     def is_finished(self):
         """Whether the job finished"""
         return self.date_ended is None
 
+    def get_results(self):
+        """The positive xpaths, whether they are packed or stored as rows,
+        in the order they were stored"""
+        if self.packed_results is not None:
+            return self.packed_results
+        return [result.xpath for result in self.results.order_by('id')]
+
+    def set_running(self):
+        """Set the job as picked up by a worker"""
+        self.state = self.RUNNING
+
     def set_finished(self):
         """Set the job as finished in this moment"""
-        self.date_ended = datetime.now()
+        self.date_ended = timezone.now()
         self.is_failed = False
+        self.state = self.DONE
 
-    def set_failed(self):
+    def set_failed(self, state=FAILED):
         """Set ghe job as finished in this moment"""
-        self.date_ended = datetime.now()
+        self.date_ended = timezone.now()
         self.is_failed = True
+        self.state = state
 
     class Meta:
         ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['state', 'date_started'], name='job_state_started_idx'),
+            models.Index(fields=['-date_started'], name='job_started_idx'),
+            models.Index(fields=['state', 'date_ended'], name='job_state_ended_idx'),
+            models.Index(fields=['classified_page', 'classifier_used', '-date_started'],
+                         name='job_page_classifier_idx'),
+            models.Index(fields=['client', 'state'], name='job_client_state_idx'),
+        ]
 
 
 class ClassificationResult(models.Model):
     """Path and classification job. If present it means that the
-    xpath denotes a positive class."""
+    xpath denotes a positive class. New jobs store their results
+    packed in the job instead, see `ClassificationJob.packed_results`."""
     xpath = models.TextField(help_text='The xpath which contains a positive label')
-    job = models.ForeignKey(to=ClassificationJob, help_text='The classification job this result corresponds to',
+    job = models.ForeignKey(to=ClassificationJob,
+                            help_text='The classification job this result corresponds to',
                             related_name='results', on_delete=models.CASCADE)
 
     class Meta:
         ordering = ('-id',)
+
+
+class ClassificationMemo(models.Model):
+    """Job holding the results of a classifier over a given html
+    content. Jobs of pages with the same content reuse them."""
+    content_hash = models.CharField(help_text='SHA-256 of the classified html content', max_length=64)
+    classifier = models.ForeignKey(to=Classifier, help_text='The classifier used', related_name='memos',
+                                   on_delete=models.CASCADE)
+    job = models.ForeignKey(to=ClassificationJob, help_text='The job holding the results',
+                            related_name='memos', on_delete=models.CASCADE)
+
+    class Meta:
+        ordering = ('-id',)
+        unique_together = ('content_hash', 'classifier')
+
+
+class JobSweep(models.Model):
+    """Periodic sweep of the jobs and the number of rows it touched"""
+    date_swept = models.DateTimeField(help_text='Date of the sweep', auto_now_add=True, db_index=True)
+    timed_out = models.PositiveIntegerField(help_text='Active jobs past the timeout set as timed out',
+                                            default=0)
+    requeued = models.PositiveIntegerField(help_text='Active jobs missing from redis enqueued again',
+                                           default=0)
+    duration = models.FloatField(help_text='Seconds spent sweeping', default=0)
+
+    class Meta:
+        ordering = ('-id',)
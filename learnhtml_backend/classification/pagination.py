@@ -0,0 +1,58 @@
+"""Keyset pagination for the large listings. Pages are addressed by a
+cursor on the ordering column, so deep pages cost the same as the first
+one and no COUNT(*) is issued."""
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+
+
+def estimate_count(queryset):
+    """Estimated number of rows of a queryset. The table statistics are used
+    for a whole table and the planner estimate for a filtered queryset."""
+    queryset = queryset.order_by()
+    with connections[queryset.db].cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return max(0, int(row[0])) if row is not None else 0
+
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountCursorPagination(CursorPagination):
+    """Cursor pagination that adds an approximate `count` to the
+    response when requested with `?count=approximate`."""
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = OrderedDict([('count', self.count)] + list(response.data.items()))
+        return response
+
+
+class IdCursorPagination(EstimatedCountCursorPagination):
+    """Newest rows first, by id"""
+    ordering = '-id'
+
+
+class DateStartedCursorPagination(EstimatedCountCursorPagination):
+    """Most recently started jobs first. The cursor only holds the date,
+    ties are skipped by an offset, and the ordering must match the index."""
+    ordering = '-date_started'
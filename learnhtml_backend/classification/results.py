@@ -0,0 +1,67 @@
+"""Storage of the classification results. Jobs keep their positive
+xpaths packed in a single column (see `fields.pack_xpaths`) instead of
+one `ClassificationResult` row per xpath."""
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
+
+from learnhtml_backend.classification.fields import PackedXPathsField, values_case
+from learnhtml_backend.classification.models import ClassificationJob, ClassificationResult
+
+
+def packed_results_case(job_results):
+    """Expression setting the packed results of many jobs in a single
+    update, given a dict of job id -> xpaths"""
+    return values_case({job_id: list(xpaths) for job_id, xpaths in job_results.items()}, PackedXPathsField())
+
+
+def pack_stored_results(batch_size=500, delete_rows=False):
+    """Pack the results of the jobs that still have them stored as rows,
+    a batch of jobs per transaction. Returns the number of jobs packed."""
+    packed = 0
+    last_id = 0
+    while True:
+        job_ids = list(ClassificationJob.objects.filter(id__gt=last_id, packed_results__isnull=True,
+                                                        results__isnull=False)
+                       .order_by('id').values_list('id', flat=True).distinct()[:batch_size])
+        if not job_ids:
+            return packed
+
+        job_results = defaultdict(list)
+        results = ClassificationResult.objects.filter(job_id__in=job_ids).order_by('id')
+        for job_id, xpath in results.values_list('job_id', 'xpath'):
+            job_results[job_id].append(xpath)
+
+        with transaction.atomic():
+            ClassificationJob.objects.filter(id__in=job_ids) \
+                .update(packed_results=packed_results_case(job_results))
+            if delete_rows:
+                results.delete()
+
+        packed += len(job_ids)
+        last_id = job_ids[-1]
+
+
+def iter_job_results(queryset, chunk_size=1000):
+    """Iterate over the jobs of a queryset with their xpaths, reading them
+    from the database with a server side cursor. The results still stored
+    as rows are fetched with a query per chunk of jobs, in the order they
+    were stored like the packed ones. Jobs reusing results must have
+    `reused_from` selected."""
+    jobs = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(jobs, chunk_size))
+        if not chunk:
+            return
+
+        sources = [job.reused_from if job.reused_from_id is not None else job for job in chunk]
+        row_results = defaultdict(list)
+        row_job_ids = {source.id for source in sources if source.packed_results is None}
+        if row_job_ids:
+            results = ClassificationResult.objects.filter(job_id__in=row_job_ids).order_by('id')
+            for job_id, xpath in results.values_list('job_id', 'xpath'):
+                row_results[job_id].append(xpath)
+
+        for job, source in zip(chunk, sources):
+            yield job, source.packed_results if source.packed_results is not None else row_results[source.id]
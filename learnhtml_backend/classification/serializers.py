@@ -1,31 +1,27 @@
-import pickle
-
-import django_rq
+from django.conf import settings
 from rest_framework import serializers
 
-from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification import submission
 from learnhtml_backend.classification.models import ClassificationJob, PageDownload, Classifier
 
 
 class PageDetailSerializer(serializers.ModelSerializer):
-    """Serializer used for the detail view of a page.
-    Can be used to download content"""
+    """Serializer used for the detail view of a page. The
+    content is streamed separately by the view."""
 
     class Meta:
         model = PageDownload
-        fields = ('id', 'url', 'content', 'date_downloaded')
+        fields = ('id', 'url', 'date_downloaded')
 
 
 class PageListSerializer(serializers.ModelSerializer):
-    """List serializer for pages. Does not include content"""
-    is_failed = serializers.SerializerMethodField()
-
-    def get_is_failed(self, obj):
-        return obj.content is None
+    """List serializer for pages. Does not include content,
+    `is_failed` is annotated by the queryset."""
+    is_failed = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = PageDownload
-        fields = ('id', 'url', 'is_failed', 'date_downloaded')
+        fields = ('id', 'url', 'is_failed', 'content_size', 'date_downloaded')
 
 
 class JobListSerializer(serializers.ModelSerializer):
@@ -34,34 +30,86 @@ class JobListSerializer(serializers.ModelSerializer):
     classifier_used = serializers.PrimaryKeyRelatedField(many=False, queryset=Classifier.objects.all())
 
     def create(self, validated_data):
-        """Custom create"""
-        url = validated_data.pop('classified_page').pop('url')
-        classifier_used = validated_data.pop('classifier_used')
-        # if url is in database use the existing pagedownloaded
-        page = PageDownload.objects.filter(url=url).first()
-
-        if page is not None and page.content is None:
-            # this means it hans't been downloaded
-            # do the same as if it were None
-            page.delete()
-            page = None
-
-        if page is None:
-            # queue another download
-            page = PageDownload.objects.create(url=url, content=None)
-
-        # create classification job with this
-        job = ClassificationJob.objects.create(classifier_used=classifier_used,
-                                               classified_page=page)
-        django_rq.enqueue(tasks.do_classification_job, job.id)
-
-        # return the job
+        """Custom create, identical submissions share the same job.
+        `created` tells whether the job is a new one."""
+        job, self.created = submission.submit_job(
+            validated_data['classified_page']['url'], validated_data['classifier_used'],
+            priority=validated_data.get('priority', ClassificationJob.INTERACTIVE),
+            client=validated_data.get('client'))
         return job
 
     class Meta:
         model = ClassificationJob
-        fields = ('id', 'classifier_used', 'url', 'is_failed', 'date_started', 'date_ended')
-        read_only_fields = ('id', 'is_failed', 'date_started', 'date_ended')
+        fields = ('id', 'classifier_used', 'url', 'priority', 'is_failed', 'state', 'date_started',
+                  'date_ended')
+        read_only_fields = ('id', 'is_failed', 'state', 'date_started', 'date_ended')
+
+
+class JobBatchSerializer(serializers.Serializer):
+    """Serializer for submitting the same classifier over many urls. Only
+    staff can submit interactive batches."""
+    urls = serializers.ListField(child=serializers.URLField(), write_only=True)
+    classifier_used = serializers.PrimaryKeyRelatedField(many=False, write_only=True,
+                                                         queryset=Classifier.objects.defer('serialized'))
+    priority = serializers.ChoiceField(choices=ClassificationJob.PRIORITY_CHOICES, write_only=True,
+                                       default=ClassificationJob.BULK)
+    ids = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+
+    def validate_urls(self, value):
+        """Limit the size of a batch"""
+        if not value:
+            raise serializers.ValidationError('At least one url is required.')
+        if len(value) > settings.JOB_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                'At most {} urls can be submitted at once.'.format(settings.JOB_BATCH_MAX_SIZE))
+        return value
+
+    def validate_priority(self, value):
+        """Keep the interactive queue for the single submissions"""
+        request = self.context.get('request')
+        if value == ClassificationJob.INTERACTIVE and not (request and request.user.is_staff):
+            raise serializers.ValidationError('Batches can only be submitted as bulk or refresh.')
+        return value
+
+    def create(self, validated_data):
+        """Create all the jobs and enqueue them at once"""
+        jobs = submission.create_jobs(validated_data['urls'], validated_data['classifier_used'],
+                                      priority=validated_data['priority'],
+                                      client=validated_data.get('client'))
+        submission.enqueue_jobs([job for job in jobs if job.state == ClassificationJob.PENDING])
+
+        return {'ids': [job.id for job in jobs]}
+
+
+class ClassifySerializer(serializers.Serializer):
+    """Serializer for classifying html synchronously. With `persist` the
+    classification is saved afterwards as a job of `url`."""
+    html = serializers.CharField(trim_whitespace=False)
+    classifier_used = serializers.PrimaryKeyRelatedField(many=False,
+                                                         queryset=Classifier.objects.defer('serialized'))
+    url = serializers.URLField(required=False)
+    persist = serializers.BooleanField(default=False)
+
+    def validate_html(self, value):
+        """Limit the size of the html classified in the web process"""
+        if len(value.encode('utf-8')) > settings.CLASSIFY_SYNC_MAX_SIZE:
+            raise serializers.ValidationError(
+                'At most {} bytes can be classified at once, submit a job instead.'.format(
+                    settings.CLASSIFY_SYNC_MAX_SIZE))
+        return value
+
+    def validate(self, attrs):
+        if attrs['persist'] and 'url' not in attrs:
+            raise serializers.ValidationError({'url': 'A url is required to persist the classification.'})
+        return attrs
+
+
+class JobExportSerializer(serializers.Serializer):
+    """Query parameters of the export of finished jobs. The time
+    range applies to the date the jobs ended."""
+    classifier = serializers.IntegerField(required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
 
 
 class JobDetailSerializer(serializers.ModelSerializer):
@@ -71,26 +119,23 @@ class JobDetailSerializer(serializers.ModelSerializer):
     results = serializers.SerializerMethodField()
 
     def get_results(self, obj):
-        return obj.results.values_list('xpath', flat=True)
+        # the results of the reused job if any
+        source = obj.reused_from if obj.reused_from_id is not None else obj
+        return source.get_results()
 
     class Meta:
         model = ClassificationJob
-        fields = ('id', 'url', 'page_id', 'results', 'is_failed',
+        fields = ('id', 'url', 'page_id', 'results', 'is_failed', 'state', 'failure_reason', 'timings',
                   'date_started', 'date_ended')
 
 
 class ClassifierDetailSerializer(serializers.ModelSerializer):
-    """Serializer for classifiers"""
-    params = serializers.SerializerMethodField()
-
-    def get_params(self, obj):
-        """Return a representation of the params"""
-        return {param: str(val) for param, val in
-                pickle.loads(obj.serialized).get_params(deep=True).items()}
+    """Serializer for classifiers. The params are stored
+    when publishing, the model is not deserialized."""
 
     class Meta:
         model = Classifier
-        fields = ('id', 'name', 'date_trained', 'params')
+        fields = ('id', 'name', 'date_trained', 'params', 'estimator_type', 'n_features', 'serialized_size')
 
 
 class ClassifierListSerializer(serializers.ModelSerializer):
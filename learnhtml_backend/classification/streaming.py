@@ -0,0 +1,31 @@
+"""Helpers for streamed JSON responses"""
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def dumps(data):
+    """Serialize like the rest framework JSON renderer"""
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def stream_json_object(data, field, chunks):
+    """Yield the JSON encoding of `data` with an extra string `field` whose
+    value is given as an iterable of chunks, None for a null value."""
+    head = dumps(data)[:-1]  # without the closing brace
+    yield '{}{}{}:'.format(head, ',' if data else '', dumps(field)).encode('utf-8')
+
+    if chunks is None:
+        yield b'null'
+    else:
+        yield b'"'
+        for chunk in chunks:
+            yield dumps(chunk)[1:-1].encode('utf-8')  # escape the chunk, drop the quotes
+        yield b'"'
+    yield b'}'
+
+
+def stream_ndjson(objects):
+    """Yield each object as a line of newline delimited JSON"""
+    for data in objects:
+        yield (dumps(data) + '\n').encode('utf-8')
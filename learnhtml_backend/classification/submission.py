@@ -0,0 +1,346 @@
+"""Bulk creation and enqueueing of classification jobs"""
+import hashlib
+import time
+from datetime import timedelta
+from itertools import islice
+
+import django_rq
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from redis.exceptions import WatchError
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.dedup import canonicalize_url, find_memos
+from learnhtml_backend.classification.freshness import is_stale, stale_pages
+from learnhtml_backend.classification.models import PageDownload, ClassificationJob
+from learnhtml_backend.classification.throttling import check_active_jobs
+from learnhtml_backend.consts import CLASSIFY_TIMEOUT
+
+# sorted sets of job ids waiting to be batched by classifier and priority, scored by submission time
+PENDING_KEY = 'learnhtml:pending:{}:{}'
+# set of the classifier:priority pairs of the jobs waiting to be batched
+PENDING_CLASSIFIERS_KEY = 'learnhtml:pending'
+# list of page ids waiting for the download stage
+DOWNLOADS_KEY = 'learnhtml:downloads'
+# list of page ids being downloaded by a download stage, by name
+PROCESSING_KEY = 'learnhtml:downloads:processing:{}'
+# set while the page waits for the download stage, so the sweeper can tell its jobs aren't lost
+DOWNLOADING_KEY = 'learnhtml:downloading:{}'
+# id of the rq job classifying a single job, to find it when cancelling
+RQ_JOB_ID = 'classification-{}'
+# id of the rq job of the batch holding a job, so the sweeper can tell it isn't lost
+BATCHED_KEY = 'learnhtml:batched:{}'
+
+
+def get_or_create_pages(urls):
+    """Return a dict of url -> page for the given urls. Existing pages are
+    resolved with one query and the missing ones are bulk created."""
+    urls = list(dict.fromkeys(urls))  # dedupe, keep order
+    pages = {page.url: page for page in PageDownload.objects.filter(url__in=urls)
+             .only('id', 'url', 'is_downloaded', 'content_hash', 'date_downloaded')}
+    missing = [url for url in urls if url not in pages]
+
+    try:
+        with transaction.atomic():
+            created = PageDownload.objects.bulk_create([PageDownload(url=url, content=None)
+                                                        for url in missing])
+        pages.update((page.url, page) for page in created)
+    except IntegrityError:
+        # some pages were inserted concurrently, fall back to one by one
+        for url in missing:
+            pages[url], _ = PageDownload.objects.get_or_create(url=url, defaults={'content': None})
+
+    return pages
+
+
+def pending_key(job):
+    """Key of the jobs waiting to be batched with the job"""
+    return PENDING_KEY.format(job.classifier_used_id, job.priority)
+
+
+def is_higher_priority(priority, other):
+    """Whether `priority` comes before `other`, the choices are ordered from the highest"""
+    order = [choice for choice, _ in ClassificationJob.PRIORITY_CHOICES]
+    return order.index(priority) < order.index(other)
+
+
+def page_priority(page, priority):
+    """The priority of a job of the page. Bulk jobs of pages downloaded
+    before but stale only revalidate them, they go to the refresh queue."""
+    if priority == ClassificationJob.BULK and page.is_downloaded and is_stale(page):
+        return ClassificationJob.REFRESH
+    return priority
+
+
+def create_jobs(urls, classifier, priority=ClassificationJob.BULK, client=None):
+    """Create a classification job for every url. Returns the jobs in
+    the order of the urls. Jobs of fresh contents already classified reuse
+    those results and are created finished, see `page_priority` for the
+    priority of the others."""
+    urls = [canonicalize_url(url) for url in urls]
+    pages = get_or_create_pages(urls)
+    memos = find_memos({page.content_hash for page in pages.values() if not is_stale(page)}, classifier.id)
+
+    jobs = []
+    for url in urls:
+        job = ClassificationJob(classified_page=pages[url], classifier_used=classifier,
+                                priority=page_priority(pages[url], priority), client=client)
+        reused_job_id = memos.get(pages[url].content_hash)
+        if reused_job_id is not None:
+            job.reused_from_id = reused_job_id
+            job.set_finished()
+        jobs.append(job)
+    return ClassificationJob.objects.bulk_create(jobs)
+
+
+def submit_job(url, classifier, priority=ClassificationJob.INTERACTIVE, client=None):
+    """Submit a single url, coalescing identical submissions: if a job of the
+    same page and classifier is pending, or finished within the freshness
+    window, that job is returned instead of a new one, moved to the queue of
+    `priority` if it is higher. Concurrent submissions are serialized by an
+    advisory lock on the pair. Returns the job and whether it was created.
+    Raises `Throttled` if a new job would exceed the active jobs of `client`."""
+    url = canonicalize_url(url)
+    now = timezone.now()
+    with transaction.atomic():
+        page = get_or_create_pages([url])[url]
+        with connection.cursor() as cursor:
+            # released at the end of the transaction
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [page.id, classifier.id])
+
+        # the active jobs that didn't time out and the fresh finished ones
+        reusable = Q(state__in=ClassificationJob.ACTIVE_STATES, date_started__gte=now - CLASSIFY_TIMEOUT)
+        if settings.JOB_FRESHNESS_WINDOW:
+            # not the jobs of the html submitted by a client, it may not be the content of the page
+            reusable |= Q(state=ClassificationJob.DONE, html_hash__isnull=True,
+                          date_ended__gte=now - timedelta(seconds=settings.JOB_FRESHNESS_WINDOW))
+        existing = ClassificationJob.objects.defer('packed_results') \
+            .filter(reusable, classified_page=page, classifier_used=classifier) \
+            .order_by('-date_started').first()
+        if existing is not None:
+            previous_priority = existing.priority
+            # an interactive submission mustn't wait behind a backfill
+            if existing.state == ClassificationJob.PENDING and \
+                    is_higher_priority(priority, previous_priority):
+                existing.priority = priority
+                existing.save(update_fields=['priority'])
+        else:
+            if client is not None:
+                check_active_jobs(client)
+            job = ClassificationJob(classified_page=page, classifier_used=classifier,
+                                    priority=page_priority(page, priority), client=client)
+            # reuse the results if this content was classified already, unless it must be fetched again
+            if not is_stale(page):
+                job.reused_from_id = find_memos([page.content_hash], classifier.id).get(page.content_hash)
+            if job.reused_from_id is not None:
+                job.set_finished()
+            job.save()
+
+    if existing is not None:
+        if existing.priority != previous_priority:
+            requeue_job(existing, previous_priority)
+        return existing, False
+
+    if job.state == ClassificationJob.PENDING:
+        enqueue_jobs([job])
+    return job, True
+
+
+def requeue_job(job, previous_priority):
+    """Move a pending job from the queue of its previous priority to the
+    queue of its current one. Jobs already taken by a worker or a batch, or
+    waiting for the download of their page, are left alone; the latter are
+    enqueued with their current priority once downloaded."""
+    queue = django_rq.get_queue(previous_priority)
+    previous_key = PENDING_KEY.format(job.classifier_used_id, previous_priority)
+    with queue.connection.pipeline() as pipeline:
+        queue.remove(RQ_JOB_ID.format(job.id), pipeline=pipeline)
+        pipeline.execute_command('ZREM', previous_key, job.id)
+        removed = pipeline.execute()
+    if any(removed):
+        enqueue_jobs([job], download=False)
+
+
+def enqueue_jobs(jobs, queue_name=None, download=None):
+    """Enqueue the classification of many jobs in a single redis round trip,
+    each in the queue of its priority unless `queue_name` is given.
+    If batching is enabled the jobs wait to be coalesced instead. If the
+    download stage is enabled, pages not downloaded yet or stale are queued
+    for it and their jobs are enqueued once the download is done."""
+    download = settings.DOWNLOAD_STAGE if download is None else download
+    queues = {}
+
+    def get_queue(job):
+        name = queue_name or job.priority
+        if name not in queues:
+            queues[name] = django_rq.get_queue(name)
+        return queues[name]
+
+    queue = django_rq.get_queue(queue_name or 'default')  # all the queues share the connection
+
+    download_page_ids = set()
+    if download and jobs:
+        download_page_ids = set(PageDownload.objects.filter(stale_pages(),
+                                                            id__in={job.classified_page_id for job in jobs})
+                                .values_list('id', flat=True))
+        jobs = [job for job in jobs if job.classified_page_id not in download_page_ids]
+
+    with queue.connection.pipeline() as pipeline:
+        if download_page_ids:
+            pipeline.lpush(DOWNLOADS_KEY, *download_page_ids)
+            for page_id in download_page_ids:
+                # not setex, its arguments are in a different order in redis-py 2
+                pipeline.set(DOWNLOADING_KEY.format(page_id), 1, ex=int(CLASSIFY_TIMEOUT.total_seconds()))
+        if settings.CLASSIFY_BATCH_SIZE > 1:
+            now = time.time()
+            for job in jobs:
+                # raw command, the signature of zadd differs between redis-py versions
+                pipeline.execute_command('ZADD', pending_key(job), now, job.id)
+                pipeline.sadd(PENDING_CLASSIFIERS_KEY, '{}:{}'.format(job.classifier_used_id, job.priority))
+        else:
+            for job in jobs:
+                job_queue = get_queue(job)
+                rq_job = job_queue.job_class.create(tasks.do_classification_job, args=(job.id,),
+                                                    id=RQ_JOB_ID.format(job.id), connection=queue.connection)
+                job_queue.enqueue_job(rq_job, pipeline=pipeline)
+        pipeline.execute()
+
+
+def cancel_jobs(jobs):
+    """Cancel the jobs still pending or running and remove them from redis,
+    whether they wait in the queue or to be batched. Running jobs stop at
+    their next stage. Returns the ids of the jobs cancelled."""
+    with transaction.atomic():
+        cancelled = set(ClassificationJob.objects.select_for_update()
+                        .filter(id__in=[job.id for job in jobs], state__in=ClassificationJob.ACTIVE_STATES)
+                        .values_list('id', flat=True))
+        ClassificationJob.objects.filter(id__in=cancelled).update(
+            state=ClassificationJob.CANCELLED, is_failed=False, date_ended=timezone.now())
+
+    with django_rq.get_queue('default').connection.pipeline() as pipeline:
+        for job in jobs:
+            if job.id in cancelled:
+                queue = django_rq.get_queue(job.priority)
+                rq_job_id = RQ_JOB_ID.format(job.id)
+                queue.remove(rq_job_id, pipeline=pipeline)
+                pipeline.delete(queue.job_class.key_for(rq_job_id))
+                pipeline.execute_command('ZREM', pending_key(job), job.id)
+        pipeline.execute()
+    return cancelled
+
+
+def coalesce_jobs(queue_name=None, flush=False):
+    """Enqueue a batch task for every classifier and priority having enough
+    pending jobs or whose oldest pending job waited longer than the batching
+    window, in the queue of the priority unless `queue_name` is given.
+    With `flush` everything pending is enqueued. Returns the number of batches."""
+    connection = django_rq.get_queue('default').connection
+    batch_size = max(1, settings.CLASSIFY_BATCH_SIZE)
+    deadline = time.time() - settings.CLASSIFY_BATCH_WINDOW
+    batches = 0
+
+    for member in connection.smembers(PENDING_CLASSIFIERS_KEY):
+        classifier_id, _, priority = member.decode('ascii').partition(':')
+        key = PENDING_KEY.format(int(classifier_id), priority)
+        queue = django_rq.get_queue(queue_name or priority)
+        while True:
+            oldest = connection.zrange(key, 0, 0, withscores=True)
+            if not oldest:
+                break
+            if not flush and connection.zcard(key) < batch_size and oldest[0][1] > deadline:
+                break
+
+            # pop the batch and enqueue it atomically, other coalescers may be running
+            # and the sweeper must always find the jobs either pending or batched
+            with connection.pipeline() as pipeline:
+                try:
+                    pipeline.watch(key)
+                    job_ids = pipeline.zrange(key, 0, batch_size - 1)
+                    pipeline.multi()
+                    pipeline.zremrangebyrank(key, 0, batch_size - 1)
+                    if job_ids:
+                        enqueue_batch([int(job_id) for job_id in job_ids], queue, pipeline)
+                    pipeline.execute()
+                except WatchError:
+                    continue  # popped concurrently, look again
+            if job_ids:
+                batches += 1
+
+    return batches
+
+
+def enqueue_batch(job_ids, queue, pipeline):
+    """Enqueue a batch task of the jobs with `pipeline`, along with the keys
+    telling the sweeper which batch they belong to. Returns the rq job."""
+    rq_job = queue.job_class.create(tasks.do_classification_batch, args=(job_ids,),
+                                    connection=queue.connection)
+    queue.enqueue_job(rq_job, pipeline=pipeline)
+    for job_id in job_ids:
+        # the sweeper times the job out after this
+        pipeline.set(BATCHED_KEY.format(job_id), rq_job.id, ex=int(CLASSIFY_TIMEOUT.total_seconds()))
+    return rq_job
+
+
+class IngestStats(object):
+    """Counters of a bulk ingest"""
+
+    def __init__(self):
+        self.submitted = 0
+        self.reused = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.started = time.time()
+
+    @property
+    def rate(self):
+        """Submitted urls per second"""
+        return self.submitted / max(time.time() - self.started, 1e-6)
+
+
+def ingest_urls(lines, classifier, chunk_size=5000, priority=ClassificationJob.BULK, progress=None):
+    """Submit a job for every url of an iterable of lines, e.g. a file,
+    without holding them all in memory. Urls are canonicalized and
+    submitted once, invalid ones are skipped. Pages and jobs are bulk
+    created and enqueued a chunk at a time, `progress` is called with
+    the stats after each chunk."""
+    validate = URLValidator()
+    stats = IngestStats()
+    seen = set()  # short digests of the canonical urls, to keep the memory low
+
+    def valid_urls():
+        for line in lines:
+            url = line.strip()
+            if not url or url.startswith('#'):
+                continue
+            try:
+                validate(url)
+            except ValidationError:
+                stats.invalid += 1
+                continue
+
+            url = canonicalize_url(url)
+            digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+            if digest in seen:
+                stats.duplicates += 1
+                continue
+            seen.add(digest)
+            yield url
+
+    urls = valid_urls()
+    while True:
+        chunk = list(islice(urls, chunk_size))
+        if not chunk:
+            return stats
+
+        jobs = create_jobs(chunk, classifier, priority=priority)
+        pending_jobs = [job for job in jobs if job.state == ClassificationJob.PENDING]
+        enqueue_jobs(pending_jobs)
+
+        stats.submitted += len(jobs)
+        stats.reused += len(jobs) - len(pending_jobs)
+        if progress is not None:
+            progress(stats)
@@ -0,0 +1,135 @@
+"""Periodic sweep of the classification jobs, scheduled with rq-scheduler.
+Active jobs past the timeout are timed out in bounded batches and active
+jobs lost from redis, e.g. after redis or a worker crashed, are enqueued
+again. Every sweep is recorded with the number of rows it touched."""
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import django_rq
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django_rq import job
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.models import ClassificationJob, JobSweep
+from learnhtml_backend.classification.submission import RQ_JOB_ID, BATCHED_KEY, DOWNLOADING_KEY, \
+    enqueue_jobs, pending_key
+from learnhtml_backend.consts import CLASSIFY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SWEEP_JOB_ID = 'learnhtml-sweep-jobs'
+SWEEP_LOCK_KEY = 'learnhtml:sweep'
+# deletes the lock only if it is still held by the sweep, it may have expired and been taken since
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+SWEEP_HISTORY = timedelta(days=7)
+LOST_STATUSES = {None, b'failed', 'failed'}  # statuses of rq jobs that won't run anymore
+
+
+def find_lost_jobs(jobs, queue):
+    """Return the jobs that neither wait in the queue, to be batched or for
+    the download of their page nor belong to a batch still to run"""
+    connection = queue.connection
+    with connection.pipeline() as pipeline:
+        for classification_job in jobs:
+            pipeline.hget(queue.job_class.key_for(RQ_JOB_ID.format(classification_job.id)), 'status')
+            pipeline.execute_command('ZSCORE', pending_key(classification_job), classification_job.id)
+            pipeline.get(BATCHED_KEY.format(classification_job.id))
+            pipeline.exists(DOWNLOADING_KEY.format(classification_job.classified_page_id))
+        replies = pipeline.execute()
+
+    lost_jobs = []
+    batched_jobs = []
+    for classification_job, (status, score, batch_id, downloading) in zip(jobs, zip(*[iter(replies)] * 4)):
+        if status not in LOST_STATUSES or score is not None or downloading:
+            continue
+        if batch_id is None:
+            lost_jobs.append(classification_job)
+        else:
+            batched_jobs.append((classification_job, batch_id.decode()))
+
+    if batched_jobs:
+        # the job may belong to a batch that failed
+        with connection.pipeline() as pipeline:
+            for _, batch_id in batched_jobs:
+                pipeline.hget(queue.job_class.key_for(batch_id), 'status')
+            batch_statuses = pipeline.execute()
+        lost_jobs.extend(classification_job for (classification_job, _), status
+                         in zip(batched_jobs, batch_statuses) if status in LOST_STATUSES)
+    return lost_jobs
+
+
+def requeue_lost_jobs(queue_name='default', batch_size=None, max_batches=None):
+    """Enqueue again the active jobs missing from redis, in the queues of
+    their priorities. Only the jobs that waited longer than
+    `JOB_SWEEP_LOST_AFTER` and didn't time out yet are checked, at most
+    `max_batches` batches of them. Returns their number."""
+    batch_size = batch_size or settings.JOB_SWEEP_BATCH_SIZE
+    max_batches = max_batches or settings.JOB_SWEEP_MAX_BATCHES
+    queue = django_rq.get_queue(queue_name)
+    now = timezone.now()
+    # a range scan on the (state, date_started) index
+    queryset = ClassificationJob.objects.filter(
+        state__in=ClassificationJob.ACTIVE_STATES, date_started__gte=now - CLASSIFY_TIMEOUT,
+        date_started__lt=now - timedelta(seconds=settings.JOB_SWEEP_LOST_AFTER)) \
+        .only('id', 'classified_page', 'classifier_used', 'priority', 'date_started') \
+        .order_by('date_started', 'id')
+
+    requeued = 0
+    last = None
+    for _ in range(max_batches):
+        batch = queryset if last is None else queryset.filter(
+            Q(date_started__gt=last.date_started) | Q(date_started=last.date_started, id__gt=last.id))
+        jobs = list(batch[:batch_size])
+        if not jobs:
+            break
+        lost_jobs = find_lost_jobs(jobs, queue)
+        if lost_jobs:
+            logger.warning('Enqueueing %d jobs lost from redis', len(lost_jobs))
+            enqueue_jobs(lost_jobs)
+            requeued += len(lost_jobs)
+        if len(jobs) < batch_size:
+            break
+        last = jobs[-1]
+    return requeued
+
+
+@job
+def do_sweep_jobs(queue_name='default'):
+    """Time out the stale jobs and enqueue the lost ones again, then record
+    the sweep. Concurrent sweeps are skipped."""
+    connection = django_rq.get_queue(queue_name).connection
+    token = uuid.uuid4().hex
+    if not connection.set(SWEEP_LOCK_KEY, token, nx=True, ex=settings.JOB_SWEEP_INTERVAL):
+        logger.info('Another sweep is running, skipping')
+        return None
+
+    try:
+        start = time.perf_counter()
+        timed_out = tasks.do_clear_jobs(max_batches=settings.JOB_SWEEP_MAX_BATCHES)
+        requeued = requeue_lost_jobs(queue_name)
+        sweep = JobSweep.objects.create(timed_out=timed_out, requeued=requeued,
+                                        duration=time.perf_counter() - start)
+        JobSweep.objects.filter(date_swept__lt=timezone.now() - SWEEP_HISTORY).delete()
+        return sweep.id
+    finally:
+        connection.eval(RELEASE_LOCK_SCRIPT, 1, SWEEP_LOCK_KEY, token)
+
+
+def schedule_sweeps(queue_name='default'):
+    """Register the periodic sweep with the scheduler, replacing any previous
+    registration, so that every worker start keeps a single one"""
+    scheduler = django_rq.get_scheduler(queue_name)
+    if SWEEP_JOB_ID in scheduler:
+        scheduler.cancel(SWEEP_JOB_ID)
+    return scheduler.schedule(scheduled_time=datetime.utcnow(), func=do_sweep_jobs,
+                              kwargs={'queue_name': queue_name}, interval=settings.JOB_SWEEP_INTERVAL,
+                              repeat=None, id=SWEEP_JOB_ID)
@@ -1,76 +1,379 @@
 """Async worker task definition"""
+import hashlib
 import logging
-import pickle
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 
-import webpage2html
+import django_rq
+from django.conf import settings
+from django.contrib.postgres.fields import JSONField
 from django.db import transaction
-from django.db.models import ExpressionWrapper, F, DurationField, Q
+from django.db.models import CharField, TextField
 from django.utils import timezone
 from django_rq import job
 from learnhtml.extractor import HTMLExtractor
+from rq.timeouts import JobTimeoutException
 
-from learnhtml_backend.classification.models import ClassificationJob, ClassificationResult
+from learnhtml_backend.classification.batching import BatchPredictor
+from learnhtml_backend.classification.caching import invalidate_details
+from learnhtml_backend.classification.classifiers import load_classifier
+from learnhtml_backend.classification.deadlines import DeadlineExceeded, deadline, time_left
+from learnhtml_backend.classification.dedup import canonicalize_url, find_memos, remember_results
+from learnhtml_backend.classification.fields import values_case
+from learnhtml_backend.classification.freshness import download_page, is_stale, save_fetched
+from learnhtml_backend.classification.metrics import StageTimer, TimedModel, record_jobs
+from learnhtml_backend.classification.models import ClassificationJob, PageDownload
+from learnhtml_backend.classification.results import packed_results_case
+from learnhtml_backend.classification.workers import request_recycle
 from learnhtml_backend.consts import CLASSIFY_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
 
+class JobCancelled(Exception):
+    """The job was cancelled while running"""
+
+
+def check_cancelled(classification_job_id, lock=False):
+    """Raise `JobCancelled` if the job was cancelled. With `lock` the row is
+    locked until the end of the transaction, so it can't be cancelled meanwhile."""
+    queryset = ClassificationJob.objects.filter(id=classification_job_id)
+    if lock:
+        queryset = queryset.select_for_update()
+    if queryset.values_list('state', flat=True).get() == ClassificationJob.CANCELLED:
+        raise JobCancelled()
+
+
 @job
 def do_classification_job(classification_job_id):
     """Given a classification job object, download the
-    page in the background and classify the content."""
-    classification_job = ClassificationJob.objects.get(id=classification_job_id)
-    url = classification_job.classified_page.url
-    html_content = classification_job.classified_page.content  # load he content, may be None
-    classifier = pickle.loads(classification_job.classifier_used.serialized)  # load classifier
+    page in the background and classify the content.
+    The time spent in every stage is recorded on the job.
+    The download and the classification are bounded by
+    their deadlines and a cancelled job stops at the next stage."""
+    classification_job = ClassificationJob.objects.select_related('classified_page', 'classifier_used') \
+        .defer('classified_page__content', 'classifier_used__serialized').get(id=classification_job_id)
+    if classification_job.state not in ClassificationJob.ACTIVE_STATES:
+        logger.info('Classification job %d already ended as %s', classification_job.id,
+                    classification_job.state)
+        return
+    page = classification_job.classified_page
+    html_content = page.get_content()  # load he content, may be None
+    classification_job.set_running()
+    classification_job.save(update_fields=['state'])
+    timer = StageTimer()
 
     try:
-        if html_content is None:
-            # download page first if not in DB
+        if is_stale(page):
+            # download page first if not in DB, or revalidate it if too old
             logger.info('Downloading webpage')
-            html_content = webpage2html.generate(url)
+            with timer.stage('download'), deadline('download', settings.JOB_DOWNLOAD_DEADLINE):
+                fetched = download_page(page)
 
             # update the downloaded content
             # we at least want to keep the HTML
-            with transaction.atomic():
-                # save the content
-                logger.info('Webpage downloaded')
-                classification_job.classified_page.content = html_content
-                classification_job.classified_page.save()
+            with timer.stage('save'), transaction.atomic():
+                # save the content, or only the date if it didn't change
+                logger.info('Webpage downloaded' if fetched.content is not None else 'Webpage not modified')
+                save_fetched(page, fetched)
+                html_content = page.content
         else:
             logger.info('Webpage in DB. Skipping download')
+        check_cancelled(classification_job.id)
 
-        # try to classify the html content
-        extractor = HTMLExtractor(classifier)  # get the extractor
-        paths = extractor.extract_from_html(html_content)
-
-        # create a list to bulk create later
-        result_list = [ClassificationResult(job=classification_job, xpath=path) for path in paths]
+        # the same content may have been classified already
+        memos = find_memos([page.content_hash], classification_job.classifier_used_id)
+        reused_job_id = memos.get(page.content_hash)
+        if reused_job_id is not None:
+            logger.info('Reusing the results of job %d', reused_job_id)
+            classification_job.reused_from_id = reused_job_id
+            classification_job.set_finished()
+            classification_job.save()
+            return
 
-        with transaction.atomic():
-            # save the classification result
-            ClassificationResult.objects.bulk_create(result_list)
+        # try to classify the html content
+        with deadline('classification', settings.JOB_CLASSIFY_DEADLINE):
+            with timer.stage('load'):
+                model = load_classifier(classification_job.classifier_used)  # cached per worker
+            paths = classify_html(model, html_content, timer)
 
+        with timer.stage('save'), transaction.atomic():
+            # save the classification result, packed in the job row
             # and specify success if it reaches this point
             # we want to either set it all as a success or none
-            classification_job.is_failed = False
-            classification_job.date_ended = timezone.now()
+            check_cancelled(classification_job.id, lock=True)
+            classification_job.packed_results = list(paths)
+            classification_job.set_finished()
             classification_job.save()
+            remember_results([(classification_job, page.content_hash)])
+    except JobCancelled:
+        logger.info('Classification job %d was cancelled', classification_job.id)
+        classification_job.state = ClassificationJob.CANCELLED
+    except DeadlineExceeded as exce:
+        # the worker is free again, the job won't be retried
+        logger.warning('Classification job %d timed out: %s', classification_job.id, exce)
+        classification_job.failure_reason = str(exce)
+        classification_job.set_failed(state=ClassificationJob.TIMED_OUT)
+        end_active_job(classification_job)
     except Exception as exce:
-        # end the job as a failure
-        classification_job.is_failed = True
-        classification_job.date_ended = timezone.now()
+        # end the job as a failure, keeping the reason
+        logger.exception('Classification job %d failed', classification_job.id)
+        classification_job.failure_reason = '{}: {}'.format(type(exce).__name__, exce)
+        classification_job.set_failed()
+        end_active_job(classification_job)
+    finally:
+        ClassificationJob.objects.filter(id=classification_job.id).update(timings=timer.timings)
+        record_jobs([(classification_job.state, timer.timings)])
+        # the detail of the job may have been cached by a previous completion
+        invalidate_details('job', [classification_job.id])
+
+
+def classify_html(model, html_content, timer):
+    """Return the positive xpaths of the html, timing the extraction and
+    the predictions"""
+    with timer.stage('extract'):
+        extractor = HTMLExtractor(TimedModel(model, timer))  # get the extractor
+        paths = list(extractor.extract_from_html(html_content))
+    timer.exclude('extract', 'predict')
+    return paths
+
+
+@job
+def do_save_classification(url, classifier_id, html_content, paths, timings, client=None):
+    """Persist a classification done synchronously as a finished job of
+    the page, keyed by the hash of the classified html. The page is left
+    alone, the html may not be its content, and the results are memoized
+    for that html only."""
+    html_hash = hashlib.sha256(html_content.encode('utf-8')).hexdigest()
+    with transaction.atomic():
+        page, _ = PageDownload.objects.defer('content').get_or_create(url=canonicalize_url(url),
+                                                                      defaults={'content': None})
+        classification_job = ClassificationJob(classified_page=page, classifier_used_id=classifier_id,
+                                               packed_results=paths, timings=timings, client=client,
+                                               html_hash=html_hash)
+        classification_job.set_finished()
         classification_job.save()
+        remember_results([(classification_job, html_hash)])
+    record_jobs([(classification_job.state, timings)])
+    return classification_job.id
+
+
+def end_active_job(classification_job):
+    """Save the end of a failed job, unless it was cancelled meanwhile"""
+    ClassificationJob.objects.filter(id=classification_job.id,
+                                     state__in=ClassificationJob.ACTIVE_STATES).update(
+        is_failed=classification_job.is_failed, date_ended=classification_job.date_ended,
+        state=classification_job.state, failure_reason=classification_job.failure_reason)
+
+
+def defer_jobs(jobs):
+    """Hand jobs of a batch running out of time over to a new batch, in the
+    queue of their priority"""
+    from learnhtml_backend.classification import submission  # it imports the tasks
+
+    ClassificationJob.objects.filter(id__in=[job.id for job in jobs], state=ClassificationJob.RUNNING) \
+        .update(state=ClassificationJob.PENDING)
+    queue = django_rq.get_queue(jobs[0].priority)
+    with queue.connection.pipeline() as pipeline:
+        submission.enqueue_batch([job.id for job in jobs], queue, pipeline)
+        pipeline.execute()
+    logger.info('Deferred %d jobs to a new batch', len(jobs))
+
+
+@job
+def do_classification_batch(classification_job_ids):
+    """Classify a group of jobs sharing the same classifier. Pages are
+    downloaded if needed, their features are extracted in parallel and
+    the model predicts all of them in a single call. Downloads and the
+    classification are bounded by their deadlines, the jobs running past
+    them time out and jobs cancelled meanwhile are left untouched. The
+    pages that can't be downloaded before the timeout of rq are left to a
+    new batch."""
+    jobs = list(ClassificationJob.objects.select_related('classified_page', 'classifier_used')
+                .defer('classified_page__content', 'classifier_used__serialized')
+                .filter(id__in=classification_job_ids, date_ended__isnull=True))
+    if not jobs:
+        return
+
+    classifier_ids = {job.classifier_used_id for job in jobs}
+    if len(classifier_ids) > 1:
+        # not supposed to happen, split it by classifier
+        for classifier_id in classifier_ids:
+            do_classification_batch([job.id for job in jobs if job.classifier_used_id == classifier_id])
+        return
+
+    ClassificationJob.objects.filter(id__in=[job.id for job in jobs]).update(state=ClassificationJob.RUNNING)
+    contents = dict(PageDownload.objects.filter(id__in={job.classified_page_id for job in jobs},
+                                                is_downloaded=True).values_list('id', 'content'))
+    failed_jobs = []
+    failure_reasons = {}
+    failed_states = {}
+    ready_jobs = []
+    timers = {job.id: StageTimer() for job in jobs}
+
+    # every download must leave the time to classify before the timeout of rq
+    reserve = settings.JOB_DOWNLOAD_DEADLINE + settings.JOB_CLASSIFY_DEADLINE
+    deferred_jobs = []
+    fetched_page_ids = set()
+    for classification_job in jobs:
+        page = classification_job.classified_page
+        timer = timers[classification_job.id]
+        if is_stale(page) and page.id not in fetched_page_ids:
+            remaining = time_left()
+            if deferred_jobs or (remaining is not None and remaining < reserve):
+                deferred_jobs.append(classification_job)
+                continue
+            try:
+                logger.info('Downloading webpage')
+                with timer.stage('download'), deadline('download', settings.JOB_DOWNLOAD_DEADLINE):
+                    fetched = download_page(page)
+                with timer.stage('save'):
+                    save_fetched(page, fetched)
+                if fetched.content is not None:
+                    contents[page.id] = fetched.content  # otherwise the stored one is still valid
+                fetched_page_ids.add(page.id)
+            except DeadlineExceeded as exce:
+                failed_jobs.append(classification_job)
+                failure_reasons[classification_job.id] = str(exce)
+                failed_states[classification_job.id] = ClassificationJob.TIMED_OUT
+                continue
+            except JobTimeoutException:
+                raise  # the whole batch is out of time, not only this page
+            except Exception as exce:
+                failed_jobs.append(classification_job)
+                failure_reasons[classification_job.id] = '{}: {}'.format(type(exce).__name__, exce)
+                continue
+        ready_jobs.append(classification_job)
+
+    if deferred_jobs:
+        defer_jobs(deferred_jobs)
+        jobs = [job for job in jobs if job not in deferred_jobs]
+        for classification_job in deferred_jobs:
+            del timers[classification_job.id]
+
+    # jobs of contents classified already reuse those results
+    memos = find_memos({job.classified_page.content_hash for job in ready_jobs}, jobs[0].classifier_used_id)
+    reused_jobs = [job for job in ready_jobs if job.classified_page.content_hash in memos]
+    ready_jobs = [job for job in ready_jobs if job.classified_page.content_hash not in memos]
+
+    # every extraction runs in its own thread, predictions are batched
+    load_start = time.perf_counter()
+    classifier = load_classifier(jobs[0].classifier_used) if ready_jobs else None  # cached per worker
+    for classification_job in ready_jobs:
+        timers[classification_job.id].add('load', time.perf_counter() - load_start)
+    predictor = BatchPredictor(classifier, parties=len(ready_jobs))
+
+    def extract(html_content, participant, timer):
+        try:
+            with timer.stage('extract'):
+                return HTMLExtractor(TimedModel(participant, timer)).extract_from_html(html_content)
+        finally:
+            timer.exclude('extract', 'predict')
+            participant.leave()
+
+    packed_results = {}
+    done_jobs = []
+    if ready_jobs:
+        executor = ThreadPoolExecutor(max_workers=len(ready_jobs))
+        participants = [predictor.participant() for _ in ready_jobs]
+        futures = [executor.submit(extract, contents[classification_job.classified_page_id], participant,
+                                   timers[classification_job.id])
+                   for classification_job, participant in zip(ready_jobs, participants)]
+        _, not_done = wait(futures, timeout=settings.JOB_CLASSIFY_DEADLINE or None)
+        # the extractions past the deadline leave the batch, so the ones waiting for them are predicted
+        timed_out = {future for future, participant in zip(futures, participants)
+                     if future in not_done and participant.leave()}
+        wait(not_done - timed_out)
+        executor.shutdown(wait=False)
+        if timed_out:
+            # their threads can't be stopped, the process is replaced once they are abandoned
+            request_recycle('{} extractions past the deadline'.format(len(timed_out)))
+
+        for classification_job, future in zip(ready_jobs, futures):
+            if future in timed_out:
+                failed_jobs.append(classification_job)
+                failure_reasons[classification_job.id] = str(DeadlineExceeded('classification',
+                                                                              settings.JOB_CLASSIFY_DEADLINE))
+                failed_states[classification_job.id] = ClassificationJob.TIMED_OUT
+                continue
+            exce = future.exception()
+            if exce is not None:
+                failed_jobs.append(classification_job)
+                failure_reasons[classification_job.id] = '{}: {}'.format(type(exce).__name__, exce)
+                continue
+            done_jobs.append(classification_job)
+            packed_results[classification_job.id] = future.result()
+        logger.info('Classified %d pages in batches of %s rows', len(done_jobs), predictor.batch_sizes)
+
+    save_start = time.perf_counter()
+    with transaction.atomic():
+        # jobs cancelled meanwhile keep their state, the rest can't be cancelled anymore
+        cancelled = set(ClassificationJob.objects.select_for_update()
+                        .filter(id__in=[job.id for job in jobs], state=ClassificationJob.CANCELLED)
+                        .values_list('id', flat=True))
+        done_jobs = [job for job in done_jobs if job.id not in cancelled]
+        failed_jobs = [job for job in failed_jobs if job.id not in cancelled]
+        reused_jobs = [job for job in reused_jobs if job.id not in cancelled]
+
+        # save all the results and end the jobs at once
+        date_ended = timezone.now()
+        if done_jobs:
+            ClassificationJob.objects.filter(id__in=[job.id for job in done_jobs]).update(
+                is_failed=False, date_ended=date_ended, state=ClassificationJob.DONE,
+                packed_results=packed_results_case(packed_results))
+        if failed_jobs:
+            ClassificationJob.objects.filter(id__in=[job.id for job in failed_jobs]).update(
+                is_failed=True, date_ended=date_ended,
+                state=values_case({job.id: failed_states.get(job.id, ClassificationJob.FAILED)
+                                   for job in failed_jobs}, CharField()),
+                failure_reason=values_case(failure_reasons, TextField()))
+        # one update per reused job
+        reused_ids = defaultdict(list)
+        for reused_job in reused_jobs:
+            reused_ids[memos[reused_job.classified_page.content_hash]].append(reused_job.id)
+        for reused_job_id, job_ids in reused_ids.items():
+            ClassificationJob.objects.filter(id__in=job_ids).update(is_failed=False, date_ended=date_ended,
+                                                                    state=ClassificationJob.DONE,
+                                                                    reused_from_id=reused_job_id)
+        remember_results([(job, job.classified_page.content_hash) for job in done_jobs])
+
+    # the save is shared by all the jobs, as is the loading of the classifier
+    for classification_job in done_jobs:
+        timers[classification_job.id].add('save', time.perf_counter() - save_start)
+    ClassificationJob.objects.filter(id__in=[job.id for job in jobs]).update(
+        timings=values_case({job_id: timer.timings for job_id, timer in timers.items()}, JSONField()))
+    states = {job.id: ClassificationJob.DONE for job in done_jobs + reused_jobs}
+    states.update(failed_states)
+    states.update((job_id, ClassificationJob.CANCELLED) for job_id in cancelled)
+    record_jobs([(states.get(job_id, ClassificationJob.FAILED), timer.timings)
+                 for job_id, timer in timers.items()])
+    invalidate_details('job', [job.id for job in jobs])
 
 
 @job
-def do_clear_jobs():
-    """Sets all pending jobs that exceded a threshold to failed"""
-    # get teh filtered queryset - only pending jobs that haven't failed yet
-    queryset = ClassificationJob.objects.all()
-    queryset = queryset.annotate(elapsed_time=ExpressionWrapper(timezone.now() - F('date_started'),
-                                                                output_field=DurationField()))
-    queryset = queryset.filter(is_failed=False, date_ended__isnull=True, elapsed_time__gt=CLASSIFY_TIMEOUT)
-
-    # set to failed
-    queryset.update(is_failed=True)
+def do_clear_jobs(batch_size=None, max_batches=None):
+    """Sets the active jobs that exceeded the timeout to timed out, in
+    batches of `batch_size` rows, at most `max_batches` of them. Returns
+    the number of jobs timed out"""
+    batch_size = batch_size or settings.JOB_SWEEP_BATCH_SIZE
+    threshold = timezone.now() - CLASSIFY_TIMEOUT
+    cleared = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            # only the active jobs started before the threshold, an index range scan,
+            # jobs locked by a concurrent sweep are left to it
+            job_ids = list(ClassificationJob.objects.filter(state__in=ClassificationJob.ACTIVE_STATES,
+                                                            date_started__lt=threshold)
+                           .order_by().select_for_update(skip_locked=True)
+                           .values_list('id', flat=True)[:batch_size])
+            # set to failed
+            cleared += ClassificationJob.objects.filter(id__in=job_ids).update(
+                is_failed=True, date_ended=timezone.now(), state=ClassificationJob.TIMED_OUT,
+                failure_reason='Exceeded the timeout of {}'.format(CLASSIFY_TIMEOUT))
+        batches += 1
+        if len(job_ids) < batch_size:
+            return cleared
+    return cleared
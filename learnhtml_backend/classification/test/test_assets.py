@@ -0,0 +1,100 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from learnhtml_backend.classification.assets import AssetCache
+
+
+class TestAssetCache(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = AssetCache(self.directory, max_size=1000, skip_types=['images'])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def contents(self):
+        return os.listdir(os.path.join(self.directory, 'contents'))
+
+    def test_round_trip(self):
+        """Text and binary assets keep their type, identical contents are stored once"""
+        self.cache['https://cdn.com/a.css'] = 'body { color: red }'
+        self.cache['https://mirror.com/a.css'] = 'body { color: red }'
+        self.cache['https://cdn.com/font.woff'] = b'\x00\x01'
+        self.assertEqual(self.cache['https://mirror.com/a.css'], 'body { color: red }')
+        self.assertEqual(self.cache['https://cdn.com/font.woff'], b'\x00\x01')
+        self.assertEqual(len(self.contents()), 2)
+        self.assertNotIn('https://cdn.com/b.css', self.cache)
+
+        # shared with other processes
+        other = AssetCache(self.directory, max_size=1000)
+        self.assertEqual(other['https://cdn.com/a.css'], 'body { color: red }')
+
+    def test_skipped_types(self):
+        """Skipped assets are never stored and look empty, so their url is kept"""
+        self.cache['https://cdn.com/logo.PNG?v=1'] = b'\x89PNG'
+        self.assertIn('https://cdn.com/logo.png', self.cache)
+        self.assertEqual(self.cache['https://cdn.com/logo.PNG?v=1'], '')
+        self.assertEqual(self.contents(), [])
+
+    def test_failures_are_not_cached(self):
+        """webpage2html stores the failed fetches as empty contents"""
+        self.cache['https://cdn.com/a.css'] = ''
+        self.assertNotIn('https://cdn.com/a.css', self.cache)
+        self.assertEqual(self.contents(), [])
+
+    def test_evicted_after_lookup(self):
+        """A content evicted between the membership test and the read is still served"""
+        self.cache['https://cdn.com/a.js'] = 'alert(1)'
+        self.assertIn('https://cdn.com/a.js', self.cache)
+        AssetCache(self.directory, max_size=0).evict()  # by another process
+        self.assertEqual(self.contents(), [])
+        self.assertEqual(self.cache['https://cdn.com/a.js'], 'alert(1)')
+        self.assertNotIn('https://cdn.com/a.js', self.cache)
+
+    def test_evicted_while_read(self):
+        self.cache['https://cdn.com/a.js'] = 'alert(1)'
+        with mock.patch('os.utime', side_effect=FileNotFoundError):
+            self.assertEqual(self.cache['https://cdn.com/a.js'], 'alert(1)')
+
+    def test_eviction(self):
+        """The least recently used contents are evicted past the size, along
+        with their urls"""
+        for i in range(3):
+            content = str(i) * 400
+            self.cache['https://cdn.com/{}.js'.format(i)] = content
+            content_hash = hashlib.sha256(b't' + content.encode('utf-8')).hexdigest()
+            os.utime(os.path.join(self.directory, 'contents', content_hash), (i, i))  # older first
+        self.assertNotIn('https://cdn.com/0.js', self.cache)
+        self.assertIn('https://cdn.com/2.js', self.cache)
+        self.assertLessEqual(self.cache.size, 900)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'urls'))), 2)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_page(self):
+        """Pages being inlined are served from memory"""
+        with self.cache.page('https://google.com', '<html></html>'):
+            self.assertEqual(self.cache['https://google.com'], '<html></html>')
+        self.assertNotIn('https://google.com', self.cache)
+        self.assertEqual(self.contents(), [])
+
+    def test_page_threads(self):
+        """Threads inlining the same page don't remove each other's"""
+        entered, left = threading.Event(), threading.Event()
+
+        def inline_other():
+            with self.cache.page('https://google.com', '<html>other</html>'):
+                entered.set()
+            left.set()
+
+        with self.cache.page('https://google.com', '<html></html>'):
+            thread = threading.Thread(target=inline_other)
+            thread.start()
+            self.assertTrue(left.wait(5) and entered.is_set())
+            self.assertEqual(self.cache['https://google.com'], '<html></html>')
+        thread.join()
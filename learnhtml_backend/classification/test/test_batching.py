@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from redis.exceptions import WatchError
+
+from learnhtml_backend.classification import submission, tasks
+from learnhtml_backend.classification.batching import BatchPredictor
+
+
+class ThresholdModel(object):
+    """Predicts whether the first column is positive, counting the calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, features):
+        self.calls += 1
+        return features[:, 0] > 0
+
+
+class TestBatchPredictor(SimpleTestCase):
+    def run_extractions(self, predictor, extractions):
+        """Run every extraction with its own participant in a thread"""
+
+        def run(extraction):
+            participant = predictor.participant()
+            try:
+                return extraction(participant)
+            finally:
+                participant.leave()
+
+        with ThreadPoolExecutor(max_workers=len(extractions)) as executor:
+            futures = [executor.submit(run, extraction) for extraction in extractions]
+        return futures
+
+    def test_single_prediction(self):
+        """All the participants are answered by one call"""
+        model = ThresholdModel()
+        predictor = BatchPredictor(model, parties=3)
+        matrices = [np.array([[1], [-1]]), np.array([[-1]]), np.array([[1], [1], [-1]])]
+
+        futures = self.run_extractions(predictor, [lambda model, matrix=matrix: model.predict(matrix)
+                                                   for matrix in matrices])
+
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(predictor.batch_sizes, [6])
+        self.assertEqual([future.result().tolist() for future in futures],
+                         [[True, False], [False], [True, True, False]])
+
+    def test_failed_participant(self):
+        """A participant failing before predicting does not block the others"""
+
+        def fail(model):
+            raise ValueError('bad page')
+
+        model = ThresholdModel()
+        predictor = BatchPredictor(model, parties=2)
+        futures = self.run_extractions(predictor, [fail, lambda model: model.predict(np.array([[1]]))])
+
+        self.assertIsInstance(futures[0].exception(), ValueError)
+        self.assertEqual(futures[1].result().tolist(), [True])
+        self.assertEqual(model.calls, 1)
+
+    def test_leave_from_another_thread(self):
+        """An extraction past its deadline is left out, the others are predicted"""
+        model = ThresholdModel()
+        predictor = BatchPredictor(model, parties=2)
+        waiting, slow = predictor.participant(), predictor.participant()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(waiting.predict, np.array([[1]]))
+            self.assertTrue(slow.leave())
+            self.assertEqual(future.result(timeout=5).tolist(), [True])
+        self.assertFalse(waiting.leave())
+
+        # the slow extraction predicts on its own once done
+        self.assertEqual(slow.predict(np.array([[-1]])).tolist(), [False])
+        self.assertEqual(model.calls, 2)
+
+
+@override_settings(CLASSIFY_BATCH_SIZE=2, CLASSIFY_BATCH_WINDOW=0)
+@mock.patch('learnhtml_backend.classification.submission.django_rq.get_queue')
+class TestCoalesceJobs(SimpleTestCase):
+    def fake_redis(self, get_queue, pending):
+        """Serve the pending job ids of a single classifier, return the pipeline"""
+        connection = get_queue.return_value.connection
+        connection.smembers.return_value = [b'1:bulk']
+        connection.zrange.side_effect = lambda *args, **kwargs: [(job_id, 0.0) for job_id in pending[:1]]
+        connection.zcard.side_effect = lambda key: len(pending)
+        pipeline = connection.pipeline.return_value.__enter__.return_value
+        pipeline.zrange.side_effect = lambda key, start, end: pending[:2]
+        pipeline.execute.side_effect = lambda: pending.__delitem__(slice(0, 2))
+        return pipeline
+
+    def test_batch_is_enqueued_with_the_pop(self, get_queue):
+        """The jobs are popped, enqueued and marked as batched in one transaction"""
+        pipeline = self.fake_redis(get_queue, [b'1', b'2', b'3'])
+        queue = get_queue.return_value
+        rq_job = queue.job_class.create.return_value
+        rq_job.id = 'batch-1'
+
+        self.assertEqual(submission.coalesce_jobs(), 2)
+        queue.job_class.create.assert_any_call(tasks.do_classification_batch, args=([1, 2],),
+                                               connection=queue.connection)
+        queue.enqueue_job.assert_any_call(rq_job, pipeline=pipeline)
+        pipeline.set.assert_any_call(submission.BATCHED_KEY.format(1), 'batch-1', ex=600)
+
+        calls = [call[0] for call in pipeline.mock_calls]
+        self.assertEqual(calls[:4], ['watch', 'zrange', 'multi', 'zremrangebyrank'])
+        self.assertLess(calls.index('set'), calls.index('execute'))
+
+    def test_concurrent_pop(self, get_queue):
+        """A batch popped by another coalescer meanwhile is looked at again"""
+        pending = [b'1']
+        pipeline = self.fake_redis(get_queue, pending)
+
+        def popped_concurrently():
+            pending.clear()
+            raise WatchError()
+        pipeline.execute.side_effect = popped_concurrently
+
+        self.assertEqual(submission.coalesce_jobs(), 0)
+        self.assertEqual(pipeline.execute.call_count, 1)
@@ -0,0 +1,86 @@
+import pickle
+import shutil
+import tempfile
+
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+
+
+class FakeModel:
+    def get_params(self, deep=True):
+        return {'C': 1.0}
+
+
+class TestDetailCache(APITestCase):
+    def setUp(self):
+        """Create a classifier, a finished and a pending job, cached in a shared backend"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        self.classifier = Classifier.objects.create(name='some classifier',
+                                                    serialized=pickle.dumps(FakeModel()))
+        self.done_job = ClassificationJob(classified_page=page, classifier_used=self.classifier,
+                                          packed_results=['/html'])
+        self.done_job.set_finished()
+        self.done_job.save()
+        self.pending_job = ClassificationJob.objects.create(classified_page=page,
+                                                            classifier_used=self.classifier)
+
+    def test_finished_job_is_cached(self):
+        """The second request doesn't touch the database"""
+        url = '/api/v1/jobs/{}/'.format(self.done_job.id)
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn('ETag', response)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_conditional_get(self):
+        url = '/api/v1/classifiers/{}/'.format(self.classifier.id)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_pending_job_is_not_cached(self):
+        response = self.client.get('/api/v1/jobs/{}/'.format(self.pending_job.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Cache-Control', response)
+
+    def test_failed_job_is_not_cached(self):
+        """Failed jobs may still complete"""
+        self.pending_job.set_failed(state=ClassificationJob.TIMED_OUT)
+        self.pending_job.save()
+        response = self.client.get('/api/v1/jobs/{}/'.format(self.pending_job.id))
+        self.assertNotIn('Cache-Control', response)
+
+    def test_local_cache_is_not_used(self):
+        """Invalidations wouldn't reach the other processes, the headers are still sent"""
+        url = '/api/v1/jobs/{}/'.format(self.done_job.id)
+        local_cache = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local_cache):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_classifier_deletion(self):
+        """Deleting a classifier invalidates it and its jobs"""
+        urls = ['/api/v1/classifiers/{}/'.format(self.classifier.id),
+                '/api/v1/jobs/{}/'.format(self.done_job.id)]
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.classifier.delete()
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 404)
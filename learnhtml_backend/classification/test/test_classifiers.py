@@ -0,0 +1,159 @@
+import pickle
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification.artifacts import ARTIFACT_NAME
+from learnhtml_backend.classification.classifiers import ClassifierCache, publish_classifier, \
+    describe_classifiers, store_artifacts
+from learnhtml_backend.classification.models import Classifier
+
+
+class FakeModel:
+    """Mimics the interface of a fitted estimator"""
+    n_features_ = 12
+
+    def __init__(self):
+        self.coef_ = np.arange(1000, dtype=np.float64)
+
+    def get_params(self, deep=True):
+        return {'C': 1.0, 'kernel': 'rbf'}
+
+
+class TestClassifierCache(TestCase):
+    def setUp(self):
+        """Create a few small classifiers"""
+        self.classifiers = [
+            Classifier.objects.create(name='classifier {}'.format(i),
+                                      serialized=pickle.dumps({'index': i}))
+            for i in range(3)
+        ]
+
+    def get_deferred(self, classifier):
+        """Return the classifier without the serialized blob"""
+        return Classifier.objects.defer('serialized').get(id=classifier.id)
+
+    def test_hits_do_not_load_blob(self):
+        """A hit must not query the serialized column"""
+        cache = ClassifierCache(max_entries=2, max_bytes=1024 * 1024)
+        classifier = self.get_deferred(self.classifiers[0])
+
+        self.assertEqual(cache.get(classifier), {'index': 0})
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(classifier), {'index': 0})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        """The least recently used classifier is evicted first"""
+        cache = ClassifierCache(max_entries=2, max_bytes=1024 * 1024)
+        first, second, third = [self.get_deferred(classifier) for classifier in self.classifiers]
+
+        cache.get(first)
+        cache.get(second)
+        cache.get(first)  # second is now the oldest
+        cache.get(third)
+
+        self.assertIn(first, cache)
+        self.assertNotIn(second, cache)
+        self.assertIn(third, cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_size_bound(self):
+        """The total size of the blobs bounds the cache"""
+        size = len(self.classifiers[0].serialized)
+        cache = ClassifierCache(max_entries=10, max_bytes=size)
+        for classifier in self.classifiers:
+            cache.get(self.get_deferred(classifier))
+
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.size, size)
+
+    def test_retrained_classifier_is_reloaded(self):
+        """A new training date invalidates the cached model"""
+        cache = ClassifierCache(max_entries=2, max_bytes=1024 * 1024)
+        classifier = self.get_deferred(self.classifiers[0])
+        cache.get(classifier)
+
+        Classifier.objects.filter(id=classifier.id).update(serialized=pickle.dumps({'index': 'new'}))
+        classifier.date_trained = classifier.date_trained.replace(year=classifier.date_trained.year + 1)
+        self.assertEqual(cache.get(classifier), {'index': 'new'})
+        self.assertEqual(len(cache), 1)
+
+
+class TestClassifierMetadata(APITestCase):
+    def setUp(self):
+        """Publish to a temporary storage"""
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_publish(self):
+        """The metadata is extracted when publishing"""
+        classifier = publish_classifier('some classifier', FakeModel())
+        self.assertEqual(classifier.params, {'C': '1.0', 'kernel': 'rbf'})
+        self.assertEqual(classifier.n_features, 12)
+        self.assertTrue(classifier.estimator_type.endswith('.FakeModel'))
+        self.assertGreater(classifier.serialized_size, 8000)
+
+    def test_artifact_is_memory_mapped(self):
+        """Models are stored once per content and loaded memory mapped"""
+        with mock.patch('learnhtml_backend.classification.classifiers.is_storage_local', return_value=False):
+            first = publish_classifier('some classifier', FakeModel())
+        second = publish_classifier('same classifier', FakeModel())
+        self.assertIsNone(first.serialized)
+        self.assertEqual(first.artifact_hash, second.artifact_hash)
+
+        model = ClassifierCache(max_entries=2, max_bytes=1024 * 1024).get(
+            Classifier.objects.defer('serialized').get(id=first.id))
+        self.assertIsInstance(model.coef_, np.memmap)
+        self.assertFalse(model.coef_.flags.writeable)
+        self.assertEqual(model.coef_.sum(), np.arange(1000).sum())
+
+    def test_missing_local_artifact(self):
+        """Models published on another host with a local storage are unpickled"""
+        classifier = publish_classifier('some classifier', FakeModel())
+        self.assertIsNotNone(classifier.serialized)
+        default_storage.delete(ARTIFACT_NAME.format(classifier.artifact_hash))
+
+        model = ClassifierCache(max_entries=2, max_bytes=1024 * 1024).get(
+            Classifier.objects.defer('serialized').get(id=classifier.id))
+        self.assertEqual(model.coef_.sum(), np.arange(1000).sum())
+
+    def test_store_artifacts(self):
+        """Pickled classifiers are moved to the store, and only cleared if it is shared"""
+        classifier = Classifier.objects.create(name='old classifier', serialized=pickle.dumps(FakeModel()))
+        with self.assertRaises(ImproperlyConfigured):
+            store_artifacts(clear_serialized=True)
+        with mock.patch('learnhtml_backend.classification.classifiers.is_storage_local', return_value=False):
+            self.assertEqual(store_artifacts(clear_serialized=True), 1)
+        self.assertEqual(store_artifacts(), 0)
+
+        classifier = Classifier.objects.get(id=classifier.id)
+        self.assertIsNone(classifier.serialized)
+        self.assertIsNotNone(classifier.artifact_hash)
+
+    def test_detail_does_not_unpickle(self):
+        """The detail is served from the stored metadata"""
+        classifier = publish_classifier('some classifier', FakeModel())
+        Classifier.objects.filter(id=classifier.id).update(serialized=b'not a pickle')
+
+        response = self.client.get('/api/v1/classifiers/{}/'.format(classifier.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['params'], {'C': '1.0', 'kernel': 'rbf'})
+
+    def test_backfill(self):
+        """Classifiers published without metadata are described once"""
+        classifier = Classifier.objects.create(name='old classifier', serialized=pickle.dumps(FakeModel()))
+        self.assertEqual(describe_classifiers(), 1)
+        self.assertEqual(describe_classifiers(), 0)
+        self.assertEqual(Classifier.objects.get(id=classifier.id).n_features, 12)
@@ -0,0 +1,92 @@
+import pickle
+import time
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.dedup import find_memos
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+from learnhtml_backend.classification.test.test_deadlines import SlowExtractor
+from learnhtml_backend.classification.test.test_metrics import FakeExtractor, FakeModel
+
+
+@mock.patch('learnhtml_backend.classification.views.django_rq.get_queue')
+@mock.patch('learnhtml_backend.classification.tasks.record_jobs')
+@mock.patch('learnhtml_backend.classification.views.load_classifier', return_value=FakeModel())
+@mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', FakeExtractor)
+class TestClassify(APITestCase):
+    def setUp(self):
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+
+    def classify(self, **data):
+        return self.client.post('/api/v1/classify/', dict({'classifier_used': self.classifier.id}, **data),
+                                format='json')
+
+    def test_classify(self, load_classifier, record_jobs, get_queue):
+        """The results are returned right away, nothing is stored"""
+        with self.assertNumQueries(1):  # the classifier
+            response = self.classify(html='<html><p>a</p></html>')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], ['/html/body/p[0]', '/html/body/p[1]', '/html/body/p[2]'])
+        self.assertEqual(set(response.data['timings']), {'load', 'extract', 'predict'})
+        get_queue.assert_not_called()
+        self.assertFalse(ClassificationJob.objects.exists())
+
+    def test_validation(self, load_classifier, record_jobs, get_queue):
+        """Large documents and persisting without a url are rejected, failures are reported"""
+        with override_settings(CLASSIFY_SYNC_MAX_SIZE=10):
+            self.assertEqual(self.classify(html='<html>ü</html>').status_code, 400)
+        self.assertEqual(self.classify(html='<html></html>', persist=True).status_code, 400)
+
+        response = self.classify(html='<html>broken</html>')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['detail'], 'ValueError: unparsable html')
+
+        # server faults are not the fault of the html
+        load_classifier.side_effect = FileNotFoundError('missing artifact')
+        with self.assertRaises(FileNotFoundError):
+            self.classify(html='<html></html>')
+
+    @override_settings(CLASSIFY_SYNC_DEADLINE=0.1)
+    def test_time_budget(self, load_classifier, record_jobs, get_queue):
+        with mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', SlowExtractor):
+            response = self.classify(html='<html></html>')
+        self.assertEqual(response.status_code, 503)
+
+        # loading the classifier isn't part of the budget
+        load_classifier.side_effect = lambda classifier: time.sleep(0.2) or FakeModel()
+        self.assertEqual(self.classify(html='<html></html>').status_code, 200)
+
+    def test_persist(self, load_classifier, record_jobs, get_queue):
+        """The classification is saved afterwards as a finished job, the page is left alone"""
+        html = '<html><p>a</p></html>'
+        response = self.classify(html=html, url='https://google.com/', persist=True)
+        self.assertEqual(response.status_code, 200)
+
+        # run the enqueued task
+        args, kwargs = get_queue.return_value.enqueue.call_args
+        self.assertEqual(args[0], tasks.do_save_classification)
+        job_id = args[0](*args[1:], **kwargs)
+
+        job = ClassificationJob.objects.select_related('classified_page').get(id=job_id)
+        self.assertEqual(job.state, ClassificationJob.DONE)
+        self.assertEqual(job.get_results(), response.data['results'])
+        self.assertEqual(job.client, 'ip:127.0.0.1')
+        self.assertFalse(job.classified_page.is_downloaded)
+        self.assertEqual(find_memos([job.html_hash], self.classifier.id), {job.html_hash: job.id})
+
+        # the job isn't reused by the submissions of the page
+        with mock.patch('learnhtml_backend.classification.submission.enqueue_jobs'):
+            response = self.client.post('/api/v1/jobs/',
+                                        {'url': 'https://google.com/', 'classifier_used': self.classifier.id},
+                                        format='json')
+        self.assertNotEqual(response.data['id'], job_id)
+
+        # downloaded contents are kept
+        page = PageDownload.objects.create(url='https://google.com/other', content='<html></html>')
+        job_id = tasks.do_save_classification(page.url, self.classifier.id, html, [], {})
+        page.refresh_from_db()
+        self.assertEqual(page.content, '<html></html>')
+        self.assertEqual(ClassificationJob.objects.get(id=job_id).classified_page_id, page.id)
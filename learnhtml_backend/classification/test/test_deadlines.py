@@ -0,0 +1,192 @@
+import pickle
+import signal
+import time
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.test import APITestCase
+from rq.timeouts import JobTimeoutException
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.deadlines import DeadlineExceeded, deadline, time_left
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+from learnhtml_backend.classification.test.test_metrics import FakeExtractor, FakeModel
+
+
+class SlowExtractor:
+    """Takes longer than any deadline of the tests"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def extract_from_html(self, html):
+        time.sleep(5)
+        return []
+
+
+class SlowPageExtractor(FakeExtractor):
+    """Only the slow pages take longer than the deadlines of the tests"""
+
+    def extract_from_html(self, html):
+        if 'slow' in html:
+            time.sleep(1)
+        return super().extract_from_html(html)
+
+
+def swallowing_generate(url, verbose=False):
+    """Inlines like webpage2html, whose asset fetches ignore every failure"""
+    for _ in range(3):
+        try:
+            time.sleep(5)
+        except Exception:
+            pass
+    return '<html></html>'
+
+
+class CancellingExtractor:
+    """The job is cancelled while its page is being classified"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def extract_from_html(self, html):
+        ClassificationJob.objects.update(state=ClassificationJob.CANCELLED)
+        return ['/html/body']
+
+
+class TestDeadline(APITestCase):
+    def test_interrupts(self):
+        with self.assertRaises(DeadlineExceeded) as raised:
+            with deadline('download', 0.1):
+                time.sleep(5)
+        self.assertEqual(str(raised.exception), 'download exceeded its deadline of 0.1s')
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    def test_restores_outer_alarm(self):
+        handler = mock.Mock()
+        previous = signal.signal(signal.SIGALRM, handler)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 10)
+            with deadline('download', 1):
+                pass
+            remaining, _ = signal.getitimer(signal.ITIMER_REAL)
+            self.assertGreater(remaining, 9)
+            self.assertIs(signal.getsignal(signal.SIGALRM), handler)
+            self.assertGreater(time_left(), 9)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+@mock.patch('learnhtml_backend.classification.tasks.record_jobs')
+@mock.patch('learnhtml_backend.classification.tasks.load_classifier')
+class TestCancellation(APITestCase):
+    def setUp(self):
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.job = ClassificationJob.objects.create(classified_page=page, classifier_used=classifier)
+
+    @mock.patch('learnhtml_backend.classification.submission.django_rq.get_queue')
+    def test_cancel(self, get_queue, load_classifier, record_jobs):
+        """Cancelled jobs are removed from the queue and can't be cancelled again"""
+        url = '/api/v1/jobs/{}/cancel/'.format(self.job.id)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], ClassificationJob.CANCELLED)
+        get_queue.return_value.remove.assert_called_once_with('classification-{}'.format(self.job.id),
+                                                              pipeline=mock.ANY)
+
+        job = ClassificationJob.objects.get(id=self.job.id)
+        self.assertFalse(job.is_failed)
+        self.assertIsNotNone(job.date_ended)
+        self.assertEqual(self.client.post(url).status_code, 409)
+
+        # a worker picking it up afterwards skips it
+        tasks.do_classification_job(self.job.id)
+        load_classifier.assert_not_called()
+
+    @mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', CancellingExtractor)
+    def test_cancel_running(self, load_classifier, record_jobs):
+        """The results of a job cancelled while running are dropped"""
+        tasks.do_classification_job(self.job.id)
+        job = ClassificationJob.objects.get(id=self.job.id)
+        self.assertEqual(job.state, ClassificationJob.CANCELLED)
+        self.assertIsNone(job.packed_results)
+        self.assertFalse(job.memos.exists())
+
+    @override_settings(JOB_CLASSIFY_DEADLINE=0.1)
+    @mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', SlowExtractor)
+    def test_classification_deadline(self, load_classifier, record_jobs):
+        tasks.do_classification_job(self.job.id)
+        job = ClassificationJob.objects.get(id=self.job.id)
+        self.assertEqual(job.state, ClassificationJob.TIMED_OUT)
+        self.assertTrue(job.is_failed)
+        self.assertEqual(job.failure_reason, 'classification exceeded its deadline of 0.1s')
+
+    @override_settings(JOB_DOWNLOAD_DEADLINE=0.1)
+    @mock.patch('learnhtml_backend.classification.freshness.webpage2html.generate', swallowing_generate)
+    @mock.patch('learnhtml_backend.classification.freshness.requests.get')
+    def test_download_deadline_in_assets(self, get, load_classifier, record_jobs):
+        """The deadline isn't swallowed by the fetch of the assets"""
+        get.return_value = mock.Mock(status_code=200, url='https://google.com', content=b'<html></html>',
+                                     headers={})
+        PageDownload.objects.update(content=None, is_downloaded=False)
+        start = time.monotonic()
+        tasks.do_classification_job(self.job.id)
+        self.assertLess(time.monotonic() - start, 5)
+
+        job = ClassificationJob.objects.select_related('classified_page').get(id=self.job.id)
+        self.assertEqual(job.state, ClassificationJob.TIMED_OUT)
+        self.assertEqual(job.failure_reason, 'download exceeded its deadline of 0.1s')
+        self.assertFalse(job.classified_page.is_downloaded)
+
+    @override_settings(JOB_CLASSIFY_DEADLINE=0.1)
+    @mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', SlowExtractor)
+    def test_batch_deadline(self, load_classifier, record_jobs):
+        tasks.do_classification_batch([self.job.id])
+        job = ClassificationJob.objects.get(id=self.job.id)
+        self.assertEqual(job.state, ClassificationJob.TIMED_OUT)
+        self.assertEqual(job.failure_reason, 'classification exceeded its deadline of 0.1s')
+        record_jobs.assert_called_once_with([(ClassificationJob.TIMED_OUT, mock.ANY)])
+
+    @override_settings(JOB_CLASSIFY_DEADLINE=0.3)
+    @mock.patch('learnhtml_backend.classification.tasks.request_recycle')
+    @mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', SlowPageExtractor)
+    def test_batch_deadline_releases_the_others(self, request_recycle, load_classifier, record_jobs):
+        """A slow page doesn't hold back the prediction of the others, the worker is recycled"""
+        load_classifier.return_value = FakeModel()
+        slow_page = PageDownload.objects.create(url='https://google.com/slow', content='<html>slow</html>')
+        slow_job = ClassificationJob.objects.create(classified_page=slow_page,
+                                                    classifier_used=self.job.classifier_used)
+        tasks.do_classification_batch([self.job.id, slow_job.id])
+
+        states = dict(ClassificationJob.objects.values_list('id', 'state'))
+        self.assertEqual(states, {self.job.id: ClassificationJob.DONE,
+                                  slow_job.id: ClassificationJob.TIMED_OUT})
+        request_recycle.assert_called_once_with('1 extractions past the deadline')
+
+    @mock.patch('learnhtml_backend.classification.submission.enqueue_batch')
+    @mock.patch('learnhtml_backend.classification.tasks.django_rq.get_queue')
+    @mock.patch('learnhtml_backend.classification.tasks.download_page')
+    @mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', FakeExtractor)
+    def test_batch_downloads_before_rq_timeout(self, download_page, get_queue, enqueue_batch, load_classifier,
+                                               record_jobs):
+        """Pages that can't be downloaded before the timeout of rq go to a new batch"""
+        load_classifier.return_value = FakeModel()
+        stale_page = PageDownload.objects.create(url='https://google.com/new', content=None)
+        stale_job = ClassificationJob.objects.create(classified_page=stale_page,
+                                                     classifier_used=self.job.classifier_used)
+        with mock.patch('learnhtml_backend.classification.tasks.time_left', return_value=10):
+            tasks.do_classification_batch([self.job.id, stale_job.id])
+
+        download_page.assert_not_called()
+        states = dict(ClassificationJob.objects.values_list('id', 'state'))
+        self.assertEqual(states, {self.job.id: ClassificationJob.DONE,
+                                  stale_job.id: ClassificationJob.PENDING})
+        enqueue_batch.assert_called_once_with([stale_job.id], get_queue.return_value, mock.ANY)
+        record_jobs.assert_called_once_with([(ClassificationJob.DONE, mock.ANY)])
+
+        # the timeout of rq isn't taken for the failure of a single page
+        download_page.side_effect = JobTimeoutException('out of time')
+        with self.assertRaises(JobTimeoutException):
+            tasks.do_classification_batch([stale_job.id])
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from learnhtml_backend.classification import submission
+from learnhtml_backend.classification.downloader import PageFetcher, FetchError, DownloadStage
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients giving up on slow responses
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves a few canned responses"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+
+        try:
+            if self.path == '/flaky' and server.requests.count('/flaky') <= 2:
+                self.respond(503, b'busy')
+            elif self.path == '/cached':
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.send_header('ETag', '"v1"')
+                    self.end_headers()
+                else:
+                    self.respond(200, b'<html>cached</html>', {'ETag': '"v1"'})
+            elif self.path == '/missing':
+                self.respond(404, b'missing')
+            elif self.path == '/slow':
+                time.sleep(0.5)
+                self.respond(200, b'<html>slow</html>')
+            elif self.path == '/redirect':
+                self.send_response(302)
+                self.send_header('Location', '/page')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                time.sleep(0.05)
+                self.respond(200, b'<html><body>page</body></html>')
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPageFetcher(SimpleTestCase):
+    def setUp(self):
+        """Start the stub server in a thread"""
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.active = self.server.max_active = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.loop.close()
+
+    def fetch(self, paths, headers=None, **kwargs):
+        """Fetch the paths concurrently, return the results or exceptions"""
+        kwargs.setdefault('backoff', 0.01)
+
+        async def run():
+            async with PageFetcher(**kwargs) as fetcher:
+                return await asyncio.gather(*[fetcher.fetch(self.base_url + path, headers) for path in paths],
+                                            return_exceptions=True)
+
+        return self.loop.run_until_complete(run())
+
+    def test_fetch(self):
+        """The body and the final url are returned"""
+        [page] = self.fetch(['/redirect'])
+        self.assertEqual(page.url, self.base_url + '/page')
+        self.assertEqual(page.content, b'<html><body>page</body></html>')
+
+    def test_not_modified(self):
+        """A page revalidated with its etag has no content"""
+        [page] = self.fetch(['/cached'])
+        self.assertEqual((page.content, page.etag), (b'<html>cached</html>', '"v1"'))
+        [page] = self.fetch(['/cached'], headers={'If-None-Match': '"v1"'})
+        self.assertEqual((page.content, page.etag), (None, '"v1"'))
+
+    def test_retries(self):
+        """Server errors are retried, client errors are not"""
+        flaky, missing = self.fetch(['/flaky', '/missing'], retries=2)
+        self.assertEqual(flaky.content, b'<html><body>page</body></html>')
+        self.assertIsInstance(missing, FetchError)
+        self.assertEqual(self.server.requests.count('/flaky'), 3)
+        self.assertEqual(self.server.requests.count('/missing'), 1)
+
+    def test_timeout(self):
+        """Slow pages fail after the retries"""
+        [result] = self.fetch(['/slow'], timeout=0.1, retries=1)
+        self.assertIsInstance(result, FetchError)
+        self.assertEqual(self.server.requests.count('/slow'), 2)
+
+    def test_per_host_limit(self):
+        """No more than the allowed connections are opened to a host"""
+        results = self.fetch(['/page?{}'.format(i) for i in range(10)], max_per_host=2)
+        self.assertTrue(all(not isinstance(result, Exception) for result in results))
+        self.assertLessEqual(self.server.max_active, 2)
+
+
+class FakeConnection(object):
+    """The redis list commands used by the download stage"""
+
+    def __init__(self):
+        self.lists = {}
+
+    def rpoplpush(self, source, destination):
+        items = self.lists.get(source)
+        if not items:
+            return None
+        item = items.pop()
+        self.lists.setdefault(destination, []).insert(0, item)
+        return item
+
+    def brpoplpush(self, source, destination, timeout):
+        return self.rpoplpush(source, destination)
+
+    def execute_command(self, command, key, count, value):
+        assert (command, count) == ('LREM', 1)
+        self.lists[key].remove(str(value).encode('ascii'))
+
+    def delete(self, key):
+        self.lists.pop(key, None)
+
+    @contextmanager
+    def pipeline(self):
+        yield self  # applied right away
+
+    def execute(self):
+        return []
+
+
+@mock.patch.object(DownloadStage, 'fail_jobs')
+@mock.patch.object(DownloadStage, 'enqueue_jobs')
+@mock.patch.object(DownloadStage, 'get_page', return_value=None)
+class TestDownloadStage(SimpleTestCase):
+    def run_stage(self, connection, stage, until):
+        """Run the stage until the condition holds"""
+        async def run():
+            stop = asyncio.Event()
+            task = asyncio.ensure_future(stage.run(stop=stop))
+            while not until():
+                await asyncio.sleep(0.01)
+            stop.set()
+            await task
+            await stage.drain()
+
+        with mock.patch('django_rq.get_queue') as get_queue:
+            get_queue.return_value.connection = connection
+            asyncio.get_event_loop().run_until_complete(run())
+
+    def test_processing(self, get_page, enqueue_jobs, fail_jobs):
+        """Pages are kept in the processing list of the stage while downloaded"""
+        connection = FakeConnection()
+        connection.lists[submission.DOWNLOADS_KEY] = [b'2', b'1']
+        connection.lists[submission.DOWNLOADING_KEY.format(1)] = [b'1']
+        stage = DownloadStage(PageFetcher(), concurrency=2, inline_threads=1, name='worker.1')
+        enqueue_jobs.side_effect = lambda page_id: self.assertIn(
+            str(page_id).encode('ascii'), connection.lists[submission.PROCESSING_KEY.format('worker.1')])
+
+        self.run_stage(connection, stage, lambda: enqueue_jobs.call_count == 2)
+        self.assertEqual(sorted(call[0][0] for call in enqueue_jobs.call_args_list), [1, 2])
+        self.assertEqual(connection.lists[submission.PROCESSING_KEY.format('worker.1')], [])
+        self.assertNotIn(submission.DOWNLOADING_KEY.format(1), connection.lists)
+
+    def test_recovery(self, get_page, enqueue_jobs, fail_jobs):
+        """The pages left by a crashed stage of the same name are downloaded again"""
+        connection = FakeConnection()
+        connection.lists[submission.PROCESSING_KEY.format('worker.1')] = [b'3']
+        connection.lists[submission.PROCESSING_KEY.format('worker.2')] = [b'4']
+        stage = DownloadStage(PageFetcher(), concurrency=2, inline_threads=1, name='worker.1')
+
+        self.run_stage(connection, stage, lambda: enqueue_jobs.called)
+        enqueue_jobs.assert_called_once_with(3)
+        self.assertEqual(connection.lists[submission.PROCESSING_KEY.format('worker.2')], [b'4'])
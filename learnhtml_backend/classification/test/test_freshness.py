@@ -0,0 +1,72 @@
+import pickle
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.freshness import FetchedPage, conditional_headers, download_page, \
+    is_stale, stale_pages
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+from learnhtml_backend.classification.test.test_metrics import FakeExtractor, FakeModel
+
+
+@override_settings(PAGE_MAX_AGE=60)
+class TestFreshness(TestCase):
+    def setUp(self):
+        self.page = PageDownload.objects.create(url='https://google.com', content='<html></html>',
+                                                etag='"v1"', last_modified='Sat, 17 Oct 2026 10:00:00 GMT',
+                                                date_downloaded=timezone.now())
+        self.empty_page = PageDownload.objects.create(url='https://google2.com', content=None)
+
+    def stale_ids(self):
+        return set(PageDownload.objects.filter(stale_pages()).values_list('id', flat=True))
+
+    def test_max_age(self):
+        self.assertFalse(is_stale(self.page))
+        self.assertTrue(is_stale(self.empty_page))
+        self.assertEqual(self.stale_ids(), {self.empty_page.id})
+
+        stale_date = timezone.now() - timedelta(minutes=2)
+        PageDownload.objects.filter(id=self.page.id).update(date_downloaded=stale_date)
+        self.assertTrue(is_stale(PageDownload.objects.get(id=self.page.id)))
+        self.assertEqual(self.stale_ids(), {self.page.id, self.empty_page.id})
+        with self.settings(PAGE_MAX_AGE=0):
+            self.assertFalse(is_stale(PageDownload.objects.get(id=self.page.id)))
+
+    def test_conditional_headers(self):
+        self.assertEqual(conditional_headers(self.page),
+                         {'If-None-Match': '"v1"', 'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT'})
+        self.assertEqual(conditional_headers(self.empty_page), {})
+
+    @mock.patch('learnhtml_backend.classification.freshness.inline_page', return_value='<html>inlined</html>')
+    @mock.patch('learnhtml_backend.classification.freshness.requests.get')
+    def test_download_page(self, get, inline_page):
+        get.return_value = mock.Mock(status_code=304, headers={})
+        self.assertEqual(download_page(self.page), FetchedPage(self.page.url, None, '"v1"',
+                                                               'Sat, 17 Oct 2026 10:00:00 GMT'))
+        self.assertEqual(get.call_args[1]['headers']['If-None-Match'], '"v1"')
+
+        get.return_value = mock.Mock(status_code=200, url=self.page.url, content=b'<html>new</html>',
+                                     headers={'ETag': '"v2"'})
+        self.assertEqual(download_page(self.page),
+                         FetchedPage(self.page.url, '<html>inlined</html>', '"v2"', None))
+
+    @mock.patch('learnhtml_backend.classification.tasks.record_jobs')
+    @mock.patch('learnhtml_backend.classification.tasks.load_classifier', return_value=FakeModel())
+    @mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', FakeExtractor)
+    @mock.patch('learnhtml_backend.classification.tasks.download_page')
+    def test_revalidation(self, download_page, *mocks):
+        """A stale page that didn't change keeps its content and only its fetch date is updated"""
+        fetched = timezone.now() - timedelta(minutes=2)
+        PageDownload.objects.filter(id=self.page.id).update(date_downloaded=fetched)
+        download_page.return_value = FetchedPage(self.page.url, None, '"v1"', None)
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        job = ClassificationJob.objects.create(classified_page=self.page, classifier_used=classifier)
+
+        tasks.do_classification_job(job.id)
+        page = PageDownload.objects.get(id=self.page.id)
+        self.assertEqual(page.content, '<html></html>')
+        self.assertGreater(page.date_downloaded, fetched)
+        self.assertEqual(ClassificationJob.objects.get(id=job.id).state, ClassificationJob.DONE)
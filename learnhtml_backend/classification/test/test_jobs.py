@@ -0,0 +1,79 @@
+import pickle
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+from learnhtml_backend.consts import CLASSIFY_TIMEOUT
+
+
+class TestJobStates(APITestCase):
+    def setUp(self):
+        """Create a job in every state, plus a stale pending one"""
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+
+        self.jobs = {}
+        for state in ('pending', 'running', 'done', 'failed', 'timed_out', 'stale'):
+            self.jobs[state] = ClassificationJob.objects.create(
+                classified_page=page, classifier_used=classifier,
+                state=ClassificationJob.PENDING if state == 'stale' else state,
+                is_failed=state in ClassificationJob.FAILED_STATES)
+
+        stale_date = timezone.now() - CLASSIFY_TIMEOUT - timedelta(minutes=1)
+        ClassificationJob.objects.filter(id=self.jobs['stale'].id).update(date_started=stale_date)
+
+    def get_ids(self, action):
+        """Ids of the jobs listed by an action"""
+        response = self.client.get('/api/v1/jobs/{}/'.format(action))
+        self.assertEqual(response.status_code, 200)
+        return {job['id'] for job in response.data['results']}
+
+    def test_listings(self):
+        """Stale active jobs are listed as failed"""
+        self.assertEqual(self.get_ids('pending'), {self.jobs['pending'].id, self.jobs['running'].id})
+        self.assertEqual(self.get_ids('failed'), {self.jobs['failed'].id, self.jobs['timed_out'].id,
+                                                  self.jobs['stale'].id})
+        self.assertEqual(self.get_ids('done'), {self.jobs['done'].id})
+
+    def test_clear_jobs(self):
+        """Only the stale active jobs time out"""
+        self.assertEqual(tasks.do_clear_jobs(), 1)
+
+        stale_job = ClassificationJob.objects.get(id=self.jobs['stale'].id)
+        self.assertEqual(stale_job.state, ClassificationJob.TIMED_OUT)
+        self.assertTrue(stale_job.is_failed)
+        self.assertIsNotNone(stale_job.date_ended)
+        self.assertEqual(ClassificationJob.objects.get(id=self.jobs['pending'].id).state,
+                         ClassificationJob.PENDING)
+
+
+class TestJobPagination(APITestCase):
+    def setUp(self):
+        """Create enough jobs for a few pages"""
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.jobs = [ClassificationJob.objects.create(classified_page=page, classifier_used=classifier)
+                     for _ in range(7)]
+
+    def test_cursor_traversal(self):
+        """Following the cursors lists every job once, newest first"""
+        ids = []
+        url = '/api/v1/jobs/?page_size=3'
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(job['id'] for job in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(ids, [job.id for job in reversed(self.jobs)])
+
+    def test_approximate_count(self):
+        """The count is only estimated on demand"""
+        response = self.client.get('/api/v1/jobs/pending/?count=approximate')
+        self.assertIsInstance(response.data['count'], int)
+        response = self.client.get('/api/v1/jobs/?count=approximate')
+        self.assertIsInstance(response.data['count'], int)
@@ -0,0 +1,86 @@
+import pickle
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+
+from learnhtml_backend.classification import tasks
+from learnhtml_backend.classification.metrics import StageTimer, render_metrics
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+
+
+class FakeExtractor:
+    """Predicts once over a few features, like the real extractor"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def extract_from_html(self, html):
+        if 'broken' in html:
+            raise ValueError('unparsable html')
+        predictions = self.model.predict(np.ones((3, 2)))
+        return ['/html/body/p[{}]'.format(i) for i, label in enumerate(predictions) if label]
+
+
+class FakeModel:
+    def predict(self, features):
+        return np.ones(len(features))
+
+
+@mock.patch('learnhtml_backend.classification.tasks.record_jobs')
+@mock.patch('learnhtml_backend.classification.tasks.load_classifier', return_value=FakeModel())
+@mock.patch('learnhtml_backend.classification.tasks.HTMLExtractor', FakeExtractor)
+class TestJobInstrumentation(TestCase):
+    def setUp(self):
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.jobs = []
+        for i, content in enumerate(['<html>a</html>', '<html>b</html>', '<html>broken</html>']):
+            page = PageDownload.objects.create(url='https://google.com/{}'.format(i), content=content)
+            self.jobs.append(ClassificationJob.objects.create(classified_page=page,
+                                                              classifier_used=classifier))
+
+    def test_job_timings(self, load_classifier, record_jobs):
+        tasks.do_classification_job(self.jobs[0].id)
+        job = ClassificationJob.objects.get(id=self.jobs[0].id)
+        self.assertEqual(job.state, ClassificationJob.DONE)
+        self.assertEqual(set(job.timings), {'load', 'extract', 'predict', 'save'})
+        record_jobs.assert_called_once_with([(ClassificationJob.DONE, job.timings)])
+
+    def test_failure_reason(self, load_classifier, record_jobs):
+        tasks.do_classification_job(self.jobs[2].id)
+        job = ClassificationJob.objects.get(id=self.jobs[2].id)
+        self.assertEqual(job.state, ClassificationJob.FAILED)
+        self.assertEqual(job.failure_reason, 'ValueError: unparsable html')
+        self.assertIn('extract', job.timings)
+
+    def test_batch(self, load_classifier, record_jobs):
+        tasks.do_classification_batch([job.id for job in self.jobs])
+        jobs = {job.id: job for job in ClassificationJob.objects.filter(id__in=[job.id for job in self.jobs])}
+
+        done_job, failed_job = jobs[self.jobs[0].id], jobs[self.jobs[2].id]
+        self.assertEqual(done_job.packed_results, ['/html/body/p[0]', '/html/body/p[1]', '/html/body/p[2]'])
+        self.assertEqual(set(done_job.timings), {'load', 'extract', 'predict', 'save'})
+        self.assertEqual(failed_job.failure_reason, 'ValueError: unparsable html')
+        self.assertEqual(sorted(state for state, _ in record_jobs.call_args[0][0]),
+                         [ClassificationJob.DONE, ClassificationJob.DONE, ClassificationJob.FAILED])
+
+
+class TestMetrics(TestCase):
+    def test_stage_timer(self):
+        timer = StageTimer()
+        with timer.stage('extract'):
+            with timer.stage('predict'):
+                pass
+        timer.exclude('extract', 'predict')
+        self.assertGreaterEqual(timer.timings['extract'], 0)
+        self.assertGreaterEqual(timer.timings['predict'], 0)
+
+    def test_render(self):
+        text = render_metrics({'done': 3, 'failed': 1}, {'predict': {'0.1': '2', 'count': '3', 'sum': '0.5'}},
+                              {'learnhtml_queue_depth': ('Tasks', [({'queue': 'default'}, 4)])})
+        lines = text.splitlines()
+        self.assertIn('learnhtml_jobs_total{state="done"} 3', lines)
+        self.assertIn('learnhtml_stage_seconds_bucket{stage="predict",le="0.1"} 2', lines)
+        self.assertIn('learnhtml_stage_seconds_bucket{stage="predict",le="+Inf"} 3', lines)
+        self.assertIn('learnhtml_stage_seconds_sum{stage="predict"} 0.5', lines)
+        self.assertIn('learnhtml_queue_depth{queue="default"} 4', lines)
@@ -0,0 +1,65 @@
+import json
+import zlib
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification.fields import raw_column
+from learnhtml_backend.classification.models import PageDownload
+
+
+class TestPageContent(APITestCase):
+    def setUp(self):
+        """Create a large page and one not downloaded yet"""
+        self.content = '<html><body>{}</body></html>'.format('<p class="x">é中 "q"</p>\n' * 20000)
+        self.page = PageDownload.objects.create(url='https://google.com', content=self.content)
+        self.empty_page = PageDownload.objects.create(url='https://google2.com', content=None)
+
+    def test_content_is_compressed(self):
+        """The column holds the compressed html, the model the text"""
+        raw = PageDownload.objects.annotate(raw=raw_column('content')).get(id=self.page.id).raw
+        self.assertLess(len(raw), len(self.content) / 10)
+        self.assertEqual(zlib.decompress(bytes(raw)).decode('utf-8'), self.content)
+        self.assertEqual(PageDownload.objects.get(id=self.page.id).content, self.content)
+
+    def test_detail_is_streamed(self):
+        """The detail view streams the decompressed content"""
+        response = self.client.get('/api/v1/pages/{}/'.format(self.page.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(data['id'], self.page.id)
+        self.assertEqual(data['url'], 'https://google.com')
+        self.assertEqual(data['content'], self.content)
+
+    def test_detail_without_content(self):
+        """Pages not downloaded have a null content"""
+        response = self.client.get('/api/v1/pages/{}/'.format(self.empty_page.id))
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertIsNone(data['content'])
+
+    def test_list_does_not_load_content(self):
+        """The list is computed from the metadata columns only"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/pages/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+
+        pages = {page['url']: page for page in response.data['results']}
+        self.assertFalse(pages['https://google.com']['is_failed'])
+        self.assertEqual(pages['https://google.com']['content_size'], len(self.content.encode('utf-8')))
+        self.assertTrue(pages['https://google2.com']['is_failed'])
+        self.assertIsNone(pages['https://google2.com']['content_size'])
+
+    def test_content_metadata_on_save(self):
+        """Saving a downloaded page updates its metadata"""
+        page = PageDownload.objects.defer('content').get(id=self.empty_page.id)
+        self.assertIsNone(page.get_content())
+
+        page.content = '<html></html>'
+        page.save()
+        page = PageDownload.objects.get(id=self.empty_page.id)
+        self.assertTrue(page.is_downloaded)
+        self.assertEqual(page.content_size, 13)
@@ -0,0 +1,177 @@
+import pickle
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework.throttling import ScopedRateThrottle
+
+from learnhtml_backend.classification import submission
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+from learnhtml_backend.classification.throttling import get_client
+from learnhtml_backend.classification.workers import weighted_order
+
+
+class FakeQueue(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class TestWeightedOrder(SimpleTestCase):
+    def test_weights(self):
+        """Queues come first in proportion to their weights, the ones weighted 0 last"""
+        queues = [FakeQueue('bulk'), FakeQueue('interactive'), FakeQueue('default')]
+        weights = {'interactive': 8, 'bulk': 2, 'default': 0}
+        firsts = Counter(weighted_order(queues, weights)[0].name for _ in range(2000))
+
+        self.assertEqual(set(firsts), {'interactive', 'bulk'})
+        self.assertAlmostEqual(firsts['interactive'] / 2000, 0.8, delta=0.05)
+        self.assertEqual(weighted_order(queues, weights)[-1].name, 'default')
+
+
+class TestClients(SimpleTestCase):
+    def test_forwarded_address(self):
+        """Only the address added by the trusted proxies is used, clients can't change it"""
+        request = Request(APIRequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.1',
+                                                  REMOTE_ADDR='10.0.0.2'))
+        self.assertEqual(get_client(request), 'ip:10.0.0.2')
+        with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            self.assertEqual(get_client(request), 'ip:10.0.0.1')
+
+
+@override_settings(CLASSIFY_BATCH_SIZE=1, DOWNLOAD_STAGE=False)
+class TestPriorityQueues(APITestCase):
+    def setUp(self):
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        PageDownload.objects.create(url='https://google.com/', content='<html></html>')
+        cache.clear()  # the throttling history
+
+    @mock.patch('learnhtml_backend.classification.submission.django_rq.get_queue')
+    def test_jobs_are_routed_by_priority(self, get_queue):
+        """Single jobs default to interactive and batches to bulk"""
+        response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/',
+                                                      'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.data['priority'], ClassificationJob.INTERACTIVE)
+        response = self.client.post('/api/v1/jobs/batch/', {'urls': ['https://google.com/a'],
+                                                            'classifier_used': self.classifier.id},
+                                    format='json')
+        self.assertEqual(ClassificationJob.objects.get(id=response.data['ids'][0]).priority,
+                         ClassificationJob.BULK)
+        response = self.client.post('/api/v1/jobs/batch/', {'urls': ['https://google.com/b'],
+                                                            'classifier_used': self.classifier.id,
+                                                            'priority': 'refresh'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        # the interactive queue is kept for the single submissions, except for the staff
+        batch = {'urls': ['https://google.com/d'], 'classifier_used': self.classifier.id,
+                 'priority': 'interactive'}
+        response = self.client.post('/api/v1/jobs/batch/', batch, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        response = self.client.post('/api/v1/jobs/batch/', batch, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        queue_names = [call[0][0] for call in get_queue.call_args_list]
+        self.assertIn('interactive', queue_names)
+        self.assertIn('bulk', queue_names)
+        self.assertIn('refresh', queue_names)
+
+        response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/c', 'priority': 'urgent',
+                                                      'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('learnhtml_backend.classification.submission.django_rq.get_queue')
+    @mock.patch.object(submission, 'enqueue_jobs')
+    def test_promotion(self, enqueue_jobs, get_queue):
+        """An interactive submission of a job pending in bulk moves it to the interactive queue"""
+        response = self.client.post('/api/v1/jobs/batch/', {'urls': ['https://google.com/'],
+                                                            'classifier_used': self.classifier.id},
+                                    format='json')
+        [job_id] = response.data['ids']
+        pipeline = get_queue.return_value.connection.pipeline.return_value.__enter__.return_value
+        pipeline.execute.return_value = [1, 0]  # removed from the bulk queue
+
+        response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/',
+                                                      'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual((response.data['id'], response.data['priority']),
+                         (job_id, ClassificationJob.INTERACTIVE))
+        get_queue.assert_called_with(ClassificationJob.BULK)
+        [job], = enqueue_jobs.call_args[0]
+        self.assertEqual((job.id, job.priority), (job_id, ClassificationJob.INTERACTIVE))
+
+        # lower priorities don't demote it
+        enqueue_jobs.reset_mock()
+        job, created = submission.submit_job('https://google.com/', self.classifier,
+                                             priority=ClassificationJob.BULK)
+        self.assertEqual((job.id, created, job.priority), (job_id, False, ClassificationJob.INTERACTIVE))
+
+        # jobs already taken from the queue aren't enqueued again
+        ClassificationJob.objects.filter(id=job_id).update(priority=ClassificationJob.REFRESH)
+        pipeline.execute.return_value = [0, 0]
+        submission.submit_job('https://google.com/', self.classifier)
+        self.assertEqual(ClassificationJob.objects.get(id=job_id).priority, ClassificationJob.INTERACTIVE)
+        enqueue_jobs.assert_not_called()
+
+    @override_settings(PAGE_MAX_AGE=60)
+    @mock.patch.object(submission, 'enqueue_jobs')
+    def test_refresh(self, enqueue_jobs):
+        """Bulk jobs of stale pages only revalidate them"""
+        PageDownload.objects.update(date_downloaded=timezone.now() - timedelta(minutes=2))
+        urls = ['https://google.com/', 'https://google.com/a']
+        response = self.client.post('/api/v1/jobs/batch/',
+                                    {'urls': urls, 'classifier_used': self.classifier.id}, format='json')
+        priorities = [ClassificationJob.objects.get(id=job_id).priority for job_id in response.data['ids']]
+        self.assertEqual(priorities, [ClassificationJob.REFRESH, ClassificationJob.BULK])
+
+    @mock.patch.object(submission, 'enqueue_jobs')
+    @mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', {'jobs': '2/min', 'job_batches': '1/min'})
+    def test_submission_rate(self, enqueue_jobs):
+        """Submissions are throttled by client"""
+        for i in range(2):
+            response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/{}'.format(i),
+                                                          'classifier_used': self.classifier.id},
+                                        format='json')
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/2',
+                                                      'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # the batches have their own rate
+        response = self.client.post('/api/v1/jobs/batch/', {'urls': ['https://google.com/3'],
+                                                            'classifier_used': self.classifier.id},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        # reading is not throttled
+        self.assertEqual(self.client.get('/api/v1/jobs/').status_code, 200)
+
+    @mock.patch.object(submission, 'enqueue_jobs')
+    @mock.patch.object(submission, 'requeue_job')
+    @override_settings(JOB_CLIENT_MAX_ACTIVE=3)
+    def test_active_jobs_cap(self, requeue_job, enqueue_jobs):
+        """A client can't have more active jobs than the cap, finished ones don't count"""
+        urls = ['https://google.com/{}'.format(i) for i in range(3)]
+        response = self.client.post('/api/v1/jobs/batch/',
+                                    {'urls': urls, 'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        job_ids = response.data['ids']
+        self.assertEqual(ClassificationJob.objects.filter(client='ip:127.0.0.1').count(), 3)
+
+        response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/3',
+                                                      'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 429)
+        # the submissions reusing an active job don't count
+        response = self.client.post('/api/v1/jobs/', {'url': urls[1], 'classifier_used': self.classifier.id},
+                                    format='json')
+        self.assertEqual((response.status_code, response.data['id']), (200, job_ids[1]))
+
+        ClassificationJob.objects.filter(id=job_ids[0]).update(state=ClassificationJob.DONE)
+        response = self.client.post('/api/v1/jobs/', {'url': 'https://google.com/3',
+                                                      'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 201)
@@ -0,0 +1,53 @@
+import pickle
+
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob, \
+    ClassificationResult
+
+
+class TestJobQueryCount(APITestCase):
+    """The number of queries of the job endpoints must not depend
+    on the number of jobs or results returned"""
+
+    def setUp(self):
+        """Create jobs on distinct pages, each with a few results"""
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.jobs = []
+        for i in range(10):
+            page = PageDownload.objects.create(url='https://google.com/{}'.format(i), content='<html></html>')
+            job = ClassificationJob.objects.create(classified_page=page, classifier_used=classifier,
+                                                   state=ClassificationJob.DONE)
+            ClassificationResult.objects.bulk_create(
+                [ClassificationResult(job=job, xpath='/html/body/p[{}]'.format(j)) for j in range(i)])
+            self.jobs.append(job)
+
+    def assert_list_queries(self, url, num):
+        """Lists with 1 and 10 jobs issue the same number of queries"""
+        for page_size in (1, 10):
+            with self.assertNumQueries(num):
+                response = self.client.get('{}?page_size={}'.format(url, page_size))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_list(self):
+        self.assert_list_queries('/api/v1/jobs/', 1)
+
+    def test_done(self):
+        self.assert_list_queries('/api/v1/jobs/done/', 1)
+
+    def test_detail(self):
+        """Job with the page joined, results prefetched"""
+        for job in (self.jobs[0], self.jobs[-1]):
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/v1/jobs/{}/'.format(job.id))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), len(self.jobs) - 1 if job is self.jobs[-1] else 0)
+            self.assertEqual(response.data['url'], job.classified_page.url)
+
+    def test_pages(self):
+        """Page list without content"""
+        for page_size in (1, 10):
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/v1/pages/?page_size={}'.format(page_size))
+            self.assertEqual(len(response.data['results']), page_size)
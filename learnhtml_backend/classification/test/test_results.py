@@ -0,0 +1,112 @@
+import json
+import pickle
+
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification.fields import pack_xpaths, unpack_xpaths
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob, \
+    ClassificationResult
+from learnhtml_backend.classification.results import pack_stored_results, iter_job_results
+
+
+class TestPacking(TestCase):
+    def test_roundtrip(self):
+        xpaths = ['/html/body/div[1]/p[1]', '/html/body/div[1]/p[2]', '/html/body/div[2]',
+                  '/html/head', '//p[text()="é中\n"]', '/html/body/div[1]/p[1]']
+        self.assertEqual(unpack_xpaths(pack_xpaths(xpaths)), xpaths)
+        self.assertEqual(unpack_xpaths(pack_xpaths([])), [])
+
+    def test_shared_prefixes(self):
+        """Shared prefixes are stored once"""
+        xpaths = ['/html/body/div[@class="content"]/article/p[{}]'.format(i) for i in range(500)]
+        self.assertLess(len(pack_xpaths(xpaths)), sum(len(xpath) for xpath in xpaths) / 20)
+
+
+class TestPackedResults(APITestCase):
+    def setUp(self):
+        """Create a job with packed results and one with rows"""
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.xpaths = ['/html/body/p[{}]'.format(i) for i in range(1, 4)]
+
+        self.packed_job = ClassificationJob.objects.create(classified_page=page, classifier_used=classifier,
+                                                           state=ClassificationJob.DONE,
+                                                           packed_results=self.xpaths)
+        self.rows_job = ClassificationJob.objects.create(classified_page=page, classifier_used=classifier,
+                                                         state=ClassificationJob.DONE)
+        ClassificationResult.objects.bulk_create([ClassificationResult(job=self.rows_job, xpath=xpath)
+                                                  for xpath in self.xpaths])
+
+    def test_detail_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/jobs/{}/'.format(self.packed_job.id))
+        self.assertEqual(response.data['results'], self.xpaths)
+
+    def test_rows_order(self):
+        """Rows are read in the order they were stored, like the packed results"""
+        response = self.client.get('/api/v1/jobs/{}/'.format(self.rows_job.id))
+        self.assertEqual(response.data['results'], self.xpaths)
+
+        queryset = ClassificationJob.objects.filter(id=self.rows_job.id).select_related('reused_from')
+        self.assertEqual([results for _, results in iter_job_results(queryset)], [self.xpaths])
+
+    def test_pack_stored_results(self):
+        """Rows are packed in their order, and deleted on demand"""
+        self.assertEqual(pack_stored_results(delete_rows=True), 1)
+        self.assertEqual(pack_stored_results(), 0)
+        self.assertFalse(ClassificationResult.objects.exists())
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/jobs/{}/'.format(self.rows_job.id))
+        self.assertEqual(response.data['results'], self.xpaths)
+
+
+class TestExport(APITestCase):
+    def setUp(self):
+        """Create finished jobs of two classifiers, with packed, row and
+        reused results, and a pending job"""
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        other_classifier = Classifier.objects.create(name='other classifier', serialized=pickle.dumps({}))
+
+        self.jobs = []
+        for i in range(6):
+            job = ClassificationJob(classified_page=page, classifier_used=self.classifier,
+                                    packed_results=['/html/body/p[{}]'.format(i)] if i % 2 else None)
+            job.set_finished()
+            job.save()
+            if not i % 2:
+                ClassificationResult.objects.create(job=job, xpath='/html/body/div[{}]'.format(i))
+            self.jobs.append(job)
+
+        self.reused_job = ClassificationJob(classified_page=page, classifier_used=other_classifier,
+                                            reused_from=self.jobs[0])
+        self.reused_job.set_finished()
+        self.reused_job.save()
+        ClassificationJob.objects.create(classified_page=page, classifier_used=self.classifier)
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/jobs/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_export(self):
+        """Every finished job, oldest first, with its results"""
+        with self.assertNumQueries(2):
+            rows = self.export()
+        self.assertEqual([row['id'] for row in rows], [job.id for job in self.jobs] + [self.reused_job.id])
+        self.assertEqual(rows[0]['results'], ['/html/body/div[0]'])
+        self.assertEqual(rows[1]['results'], ['/html/body/p[1]'])
+        self.assertEqual(rows[-1]['results'], ['/html/body/div[0]'])
+        self.assertEqual(rows[0]['url'], 'https://google.com')
+
+    def test_filters(self):
+        rows = self.export(classifier=self.classifier.id, since=self.jobs[1].date_ended.isoformat(),
+                           until=self.jobs[4].date_ended.isoformat())
+        self.assertEqual([row['id'] for row in rows], [job.id for job in self.jobs[1:4]])
+
+        response = self.client.get('/api/v1/jobs/export/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,152 @@
+import pickle
+from datetime import timedelta
+from unittest import mock
+
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from learnhtml_backend.classification import submission
+from learnhtml_backend.classification.dedup import canonicalize_url, remember_results
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob, \
+    ClassificationResult
+
+
+@mock.patch('learnhtml_backend.classification.submission.enqueue_jobs')
+class TestBatchSubmission(APITestCase):
+    def setUp(self):
+        """Create a classifier and an already downloaded page"""
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+
+    def test_batch_creates_jobs(self, enqueue_jobs):
+        """Every url gets a job, existing pages are reused"""
+        urls = ['https://google.com', 'https://google2.com', 'https://google3.com']
+        response = self.client.post('/api/v1/jobs/batch/',
+                                    {'urls': urls, 'classifier_used': self.classifier.id}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        job_ids = response.data['ids']
+        self.assertEqual(len(job_ids), 3)
+        enqueue_jobs.assert_called_once()
+        self.assertEqual([job.id for job in enqueue_jobs.call_args[0][0]], job_ids)
+
+        jobs = ClassificationJob.objects.filter(id__in=job_ids).select_related('classified_page')
+        self.assertEqual(sorted(job.classified_page.url for job in jobs), urls)
+        self.assertEqual(ClassificationJob.objects.get(id=job_ids[0]).classified_page_id, self.page.id)
+        self.assertEqual(PageDownload.objects.count(), 3)
+
+    def test_batch_query_count(self, enqueue_jobs):
+        """The number of queries does not depend on the number of urls"""
+        urls = ['https://example.com/{}'.format(i) for i in range(50)]
+        # classifier, active jobs and page lookups, the page insert inside a savepoint and the job insert
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/v1/jobs/batch/',
+                                        {'urls': urls, 'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_batch_validation(self, enqueue_jobs):
+        """Empty batches and invalid urls are rejected"""
+        response = self.client.post('/api/v1/jobs/batch/',
+                                    {'urls': [], 'classifier_used': self.classifier.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/v1/jobs/batch/', {'urls': ['not an url'],
+                                                            'classifier_used': self.classifier.id},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        enqueue_jobs.assert_not_called()
+
+
+@mock.patch('learnhtml_backend.classification.submission.enqueue_jobs')
+class TestDeduplication(APITestCase):
+    def setUp(self):
+        """Create a classified page and a copy of it under another url"""
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        self.copy = PageDownload.objects.create(url='https://mirror.google.com', content='<html></html>')
+
+        self.job = ClassificationJob.objects.create(classified_page=page, classifier_used=self.classifier,
+                                                    state=ClassificationJob.DONE)
+        ClassificationResult.objects.create(job=self.job, xpath='/html')
+        remember_results([(self.job, page.content_hash)])
+
+    def test_canonicalize_url(self, enqueue_jobs):
+        self.assertEqual(canonicalize_url('HTTPS://Google.com:443/a?utm_source=x&b=2&a=1#top'),
+                         'https://google.com/a?a=1&b=2')
+        self.assertEqual(canonicalize_url('http://google.com:8080/'), 'http://google.com:8080/')
+
+    def test_same_content_is_reused(self, enqueue_jobs):
+        """Jobs of a content already classified finish without being enqueued"""
+        response = self.client.post('/api/v1/jobs/',
+                                    {'url': self.copy.url, 'classifier_used': self.classifier.id},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        enqueue_jobs.assert_not_called()
+
+        job = ClassificationJob.objects.get(id=response.data['id'])
+        self.assertEqual(job.state, ClassificationJob.DONE)
+        self.assertEqual(job.reused_from_id, self.job.id)
+
+        response = self.client.get('/api/v1/jobs/{}/'.format(job.id))
+        self.assertEqual(response.data['results'], ['/html'])
+
+    def test_batch_reuses_content(self, enqueue_jobs):
+        """Only the jobs of new contents are enqueued"""
+        urls = [self.copy.url, 'https://google3.com']
+        response = self.client.post('/api/v1/jobs/batch/',
+                                    {'urls': urls, 'classifier_used': self.classifier.id}, format='json')
+        reused_id, new_id = response.data['ids']
+
+        self.assertEqual([job.id for job in enqueue_jobs.call_args[0][0]], [new_id])
+        self.assertEqual(ClassificationJob.objects.get(id=reused_id).reused_from_id, self.job.id)
+
+
+@mock.patch('learnhtml_backend.classification.submission.enqueue_jobs')
+class TestIngest(APITestCase):
+    def test_ingest(self, enqueue_jobs):
+        """Urls are canonicalized, deduplicated and submitted a chunk at a time"""
+        classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        lines = ['https://example.com/{}\n'.format(i) for i in range(7)] + [
+            'HTTPS://EXAMPLE.COM/1#top\n', '\n', '# comment\n', 'not an url\n',
+            'https://example.com/2?utm_source=x\n']
+        progress = mock.Mock()
+
+        stats = submission.ingest_urls(iter(lines), classifier, chunk_size=3, progress=progress)
+        self.assertEqual((stats.submitted, stats.duplicates, stats.invalid), (7, 2, 1))
+        self.assertEqual(progress.call_count, 3)
+        self.assertEqual(enqueue_jobs.call_count, 3)
+        self.assertEqual(ClassificationJob.objects.count(), 7)
+        self.assertEqual(PageDownload.objects.count(), 7)
+
+
+@mock.patch('learnhtml_backend.classification.submission.enqueue_jobs')
+class TestCoalescing(APITestCase):
+    def setUp(self):
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.page = PageDownload.objects.create(url='https://google.com/', content=None)
+
+    def submit(self, url='https://google.com/', status_code=201):
+        response = self.client.post('/api/v1/jobs/', {'url': url, 'classifier_used': self.classifier.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status_code)
+        return response.data['id']
+
+    def test_pending_job_is_shared(self, enqueue_jobs):
+        """Identical submissions attach to the pending job, the page waiting for its download is kept"""
+        job_id = self.submit()
+        self.assertEqual(self.submit('HTTPS://google.com/#top', status_code=200), job_id)
+        enqueue_jobs.assert_called_once()
+        self.assertEqual(ClassificationJob.objects.get(id=job_id).classified_page_id, self.page.id)
+
+    @override_settings(JOB_FRESHNESS_WINDOW=60)
+    def test_freshness_window(self, enqueue_jobs):
+        """Finished jobs are returned while they are fresh"""
+        job_id = self.submit()
+        ClassificationJob.objects.filter(id=job_id).update(state=ClassificationJob.DONE,
+                                                           date_ended=timezone.now())
+        self.assertEqual(self.submit(status_code=200), job_id)
+
+        ClassificationJob.objects.filter(id=job_id).update(date_ended=timezone.now() - timedelta(minutes=2))
+        self.assertNotEqual(self.submit(), job_id)
+        self.assertEqual(enqueue_jobs.call_count, 2)
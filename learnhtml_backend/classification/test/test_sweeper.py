@@ -0,0 +1,79 @@
+import pickle
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from learnhtml_backend.classification import submission, sweeper, tasks
+from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob, JobSweep
+from learnhtml_backend.consts import CLASSIFY_TIMEOUT
+
+
+class TestSweeper(TestCase):
+    def setUp(self):
+        page = PageDownload.objects.create(url='https://google.com', content='<html></html>')
+        self.classifier = Classifier.objects.create(name='some classifier', serialized=pickle.dumps({}))
+        self.jobs = ClassificationJob.objects.bulk_create(
+            ClassificationJob(classified_page=page, classifier_used=self.classifier) for _ in range(5))
+
+    def age_jobs(self, jobs, age):
+        ClassificationJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            date_started=timezone.now() - age)
+
+    def test_clear_in_batches(self):
+        self.age_jobs(self.jobs, CLASSIFY_TIMEOUT + timedelta(minutes=1))
+        self.assertEqual(tasks.do_clear_jobs(batch_size=2, max_batches=1), 2)
+        self.assertEqual(tasks.do_clear_jobs(batch_size=2), 3)
+        self.assertFalse(ClassificationJob.objects.filter(state__in=ClassificationJob.ACTIVE_STATES).exists())
+
+    def test_find_lost_jobs(self):
+        """Jobs missing from the queue, the batches and the downloads, or whose batch failed, are lost"""
+        queue = mock.MagicMock()
+        pipeline = queue.connection.pipeline.return_value.__enter__.return_value
+        pipeline.execute.side_effect = [
+            [b'queued', None, None, False,  # still queued
+             None, None, None, False,  # lost
+             None, 1.5, None, False,  # waiting to be batched
+             None, None, b'batch-1', False,  # in a failed batch
+             None, None, b'batch-2', False],  # in a batch still queued
+            [b'failed', b'queued'],
+        ]
+        self.assertEqual(sweeper.find_lost_jobs(self.jobs, queue), [self.jobs[1], self.jobs[3]])
+
+    def test_downloading_jobs_are_not_lost(self):
+        """Jobs wait for the download of their page outside of the queues"""
+        queue = mock.MagicMock()
+        pipeline = queue.connection.pipeline.return_value.__enter__.return_value
+        pipeline.execute.return_value = [None, None, None, True] * len(self.jobs)
+        self.assertEqual(sweeper.find_lost_jobs(self.jobs, queue), [])
+        pipeline.exists.assert_called_with(submission.DOWNLOADING_KEY.format(self.jobs[0].classified_page_id))
+
+    @mock.patch('learnhtml_backend.classification.sweeper.enqueue_jobs')
+    @mock.patch('learnhtml_backend.classification.sweeper.find_lost_jobs',
+                side_effect=lambda jobs, queue: jobs)
+    @mock.patch('learnhtml_backend.classification.sweeper.django_rq.get_queue')
+    def test_sweep(self, get_queue, find_lost_jobs, enqueue_jobs):
+        """Stale jobs time out, the ones waiting for a while are checked and the fresh ones ignored"""
+        self.age_jobs(self.jobs[:2], CLASSIFY_TIMEOUT + timedelta(minutes=1))
+        self.age_jobs(self.jobs[2:4], timedelta(minutes=5))
+
+        sweep = JobSweep.objects.get(id=sweeper.do_sweep_jobs())
+        self.assertEqual((sweep.timed_out, sweep.requeued), (2, 2))
+        self.assertEqual({job.id for job in enqueue_jobs.call_args[0][0]}, {job.id for job in self.jobs[2:4]})
+        # the lock is released only if still held by the sweep
+        connection = get_queue.return_value.connection
+        token = connection.set.call_args[0][1]
+        connection.eval.assert_called_once_with(sweeper.RELEASE_LOCK_SCRIPT, 1, sweeper.SWEEP_LOCK_KEY, token)
+
+        # a sweep already running
+        get_queue.return_value.connection.set.return_value = False
+        self.assertIsNone(sweeper.do_sweep_jobs())
+
+    @mock.patch('learnhtml_backend.classification.sweeper.django_rq.get_scheduler')
+    def test_schedule(self, get_scheduler):
+        scheduler = get_scheduler.return_value
+        scheduler.__contains__.return_value = True
+        sweeper.schedule_sweeps()
+        scheduler.cancel.assert_called_once_with(sweeper.SWEEP_JOB_ID)
+        self.assertEqual(scheduler.schedule.call_args[1]['id'], sweeper.SWEEP_JOB_ID)
@@ -0,0 +1,100 @@
+import functools
+import os
+import signal
+import tempfile
+import time
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from rq import Queue, SimpleWorker
+
+from learnhtml_backend.classification import workers
+from learnhtml_backend.classification.workers import RecyclingWorker
+
+
+class TestRecyclingWorker(SimpleTestCase):
+    def setUp(self):
+        """Run the worker loop on a fake connection, dequeuing from a list
+        of jobs and recording the executed ones"""
+        self.queue = Queue('default', connection=mock.MagicMock())
+        self.jobs = ['job {}'.format(i) for i in range(5)]
+        self.executed = []
+
+        def dequeue(worker, timeout):
+            return (self.jobs.pop(0), self.queue) if self.jobs else None
+
+        def execute(worker, job, queue):
+            self.executed.append(job)
+
+        patches = [mock.patch.object(SimpleWorker, 'register_birth'),
+                   mock.patch.object(SimpleWorker, 'register_death'),
+                   mock.patch.object(SimpleWorker, 'check_for_suspension'),
+                   mock.patch.object(SimpleWorker, 'dequeue_job_and_maintain_ttl', dequeue),
+                   mock.patch.object(SimpleWorker, 'execute_job', execute),
+                   mock.patch.object(workers, '_recycle_reason', None)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def work(self, **kwargs):
+        worker = RecyclingWorker([self.queue], connection=self.queue.connection, **kwargs)
+        worker.work(burst=True)
+        return worker
+
+    def test_max_jobs(self):
+        """The worker stops after its jobs, leaving the others queued"""
+        worker = self.work(max_jobs=2)
+        self.assertEqual(self.executed, ['job 0', 'job 1'])
+        self.assertEqual(worker.jobs_done, 2)
+        self.assertEqual(len(self.jobs), 3)
+
+    def test_max_memory(self):
+        """The worker stops after the job that took it past the ceiling"""
+        with mock.patch.object(workers, 'get_max_rss', side_effect=[100, 300, 300]):
+            self.work(max_memory=200)
+        self.assertEqual(self.executed, ['job 0', 'job 1'])
+
+    def test_recycle_request(self):
+        """A job may ask for the worker to be recycled once it ended"""
+        def execute(worker, job, queue):
+            self.executed.append(job)
+            workers.request_recycle('threads left running')
+
+        with mock.patch.object(SimpleWorker, 'execute_job', execute):
+            self.work()
+        self.assertEqual(self.executed, ['job 0'])
+
+    def test_no_limits(self):
+        """Without limits the worker drains the queue"""
+        self.work()
+        self.assertEqual(len(self.executed), 5)
+
+
+def recycled_worker(queue_names, max_jobs, max_memory, runs_dir):
+    """Worker process exiting right away the first time, as if recycled,
+    and stopping the pool the second time"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    runs = len(os.listdir(runs_dir))
+    open(os.path.join(runs_dir, str(runs)), 'w').close()
+    if runs:
+        os.kill(os.getppid(), signal.SIGTERM)
+        time.sleep(10)  # until the pool stops it
+
+
+class TestWorkerPool(SimpleTestCase):
+    def setUp(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+
+    @mock.patch('learnhtml_backend.classification.management.commands.classifyworker.schedule_sweeps')
+    @mock.patch('learnhtml_backend.classification.management.commands.classifyworker.preload_classifiers',
+                return_value={'entries': 0})
+    def test_replaced_until_stopped(self, *mocks):
+        """Recycled workers are replaced, the pool exits once stopped"""
+        with tempfile.TemporaryDirectory() as runs_dir:
+            worker = functools.partial(recycled_worker, runs_dir=runs_dir)
+            with mock.patch('learnhtml_backend.classification.management.commands.classifyworker.run_worker',
+                            worker):
+                call_command('classifyworker', 'default', '--concurrency', '0.01')
+            self.assertEqual(len(os.listdir(runs_dir)), 2)
@@ -0,0 +1,40 @@
+"""Per client limits on the job submissions. Clients are the authenticated
+users or else the remote addresses. The submission rates are throttled by
+scope and the number of active jobs of a client is capped, so a single
+client can't fill the queues."""
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle, ScopedRateThrottle
+
+from learnhtml_backend.classification.models import ClassificationJob
+from learnhtml_backend.consts import CLASSIFY_TIMEOUT
+
+
+def get_client(request):
+    """Identifier of the client who made the request"""
+    if request.user and request.user.is_authenticated:
+        return 'user:{}'.format(request.user.pk)
+    return 'ip:{}'.format(BaseThrottle().get_ident(request))[:64]
+
+
+def check_active_jobs(client, new_jobs=1):
+    """Raise `Throttled` if the client would exceed its active jobs"""
+    max_active = settings.JOB_CLIENT_MAX_ACTIVE
+    if not max_active:
+        return
+    # bounded count on the (client, state) index
+    active = ClassificationJob.objects.filter(client=client, state__in=ClassificationJob.ACTIVE_STATES,
+                                              date_started__gte=timezone.now() - CLASSIFY_TIMEOUT) \
+        .order_by().values('id')[:max_active].count()
+    if active + new_jobs > max_active:
+        raise Throttled(detail='At most {} jobs can be pending at once, {} are.'.format(max_active, active))
+
+
+class SubmissionThrottle(ScopedRateThrottle):
+    """Rate of the submissions by the scope of the action, see `scopes`"""
+    scopes = {'create': 'jobs', 'batch': 'job_batches'}
+
+    def allow_request(self, request, view):
+        view.throttle_scope = self.scopes.get(view.action)
+        return super().allow_request(request, view)
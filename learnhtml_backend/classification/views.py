@@ -1,18 +1,40 @@
-from django.db.models import Q, ExpressionWrapper, F, DurationField
+import logging
+
+import django_rq
+from django.conf import settings
+from django.db.models import Q, Case, When, Value, BooleanField
+from django.http import StreamingHttpResponse, HttpResponse
 from django.utils import timezone
-from rest_framework import viewsets, mixins
+from lxml import etree
+from rest_framework import viewsets, mixins, generics, status, serializers
 from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 
+from learnhtml_backend.classification import submission, tasks
+from learnhtml_backend.classification.caching import CachedRetrieveMixin
+from learnhtml_backend.classification.classifiers import load_classifier
+from learnhtml_backend.classification.deadlines import DeadlineExceeded, deadline
+from learnhtml_backend.classification.fields import raw_column, iter_decompressed
+from learnhtml_backend.classification.metrics import StageTimer, get_connection, read_metrics, render_metrics
 from learnhtml_backend.classification.models import PageDownload, Classifier, ClassificationJob
+from learnhtml_backend.classification.pagination import IdCursorPagination, DateStartedCursorPagination
 from learnhtml_backend.classification.serializers import PageListSerializer, PageDetailSerializer, \
-    JobDetailSerializer, JobListSerializer, ClassifierListSerializer, ClassifierDetailSerializer
+    JobDetailSerializer, JobListSerializer, ClassifierListSerializer, ClassifierDetailSerializer, \
+    JobBatchSerializer, JobExportSerializer, ClassifySerializer
+from learnhtml_backend.classification.results import iter_job_results
+from learnhtml_backend.classification.streaming import stream_json_object, stream_ndjson
+from learnhtml_backend.classification.throttling import SubmissionThrottle, get_client, check_active_jobs
 from learnhtml_backend.consts import CLASSIFY_TIMEOUT
 
+logger = logging.getLogger(__name__)
+
 
 class PageViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for downloaded pages. Ony the detail view exposes
     the html content."""
     queryset = PageDownload.objects.all()
+    pagination_class = IdCursorPagination
 
     def get_serializer_class(self):
         """Conditional serializer based on action"""
@@ -22,10 +44,28 @@ class PageViewSet(viewsets.ReadOnlyModelViewSet):
             return PageDetailSerializer
         return PageListSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset().defer('content')  # never load the html
+        if self.action == 'retrieve':
+            # the content is streamed from the compressed bytes
+            return queryset.annotate(raw_content=raw_column('content'))
+        return queryset.annotate(is_failed=Case(When(is_downloaded=True, then=Value(False)),
+                                                default=Value(True), output_field=BooleanField()))
 
-class ClassifierViewSet(viewsets.ReadOnlyModelViewSet):
-    """ViewSet for classifiers, just for viewing."""
+    def retrieve(self, request, *args, **kwargs):
+        """Stream the page, decompressing the content on the fly"""
+        page = self.get_object()
+        data = self.get_serializer(page).data
+        chunks = iter_decompressed(page.raw_content) if page.raw_content is not None else None
+        return StreamingHttpResponse(stream_json_object(data, 'content', chunks),
+                                     content_type='application/json')
+
+
+class ClassifierViewSet(CachedRetrieveMixin, viewsets.ReadOnlyModelViewSet):
+    """ViewSet for classifiers, just for viewing. Classifiers
+    never change, their details are cached."""
     queryset = Classifier.objects.all()
+    detail_cache_name = 'classifier'
 
     def get_serializer_class(self):
         """Conditional serializer based on action"""
@@ -36,13 +76,12 @@ class ClassifierViewSet(viewsets.ReadOnlyModelViewSet):
         return ClassifierListSerializer
 
     def get_queryset(self):
-        queryset = super().get_queryset()  # base queryset
-        if self.action == 'list':
-            return queryset.defer('serialized')  # only as it consumes memory
-        return queryset
+        # the pickle is never needed, it only consumes memory
+        return super().get_queryset().defer('serialized')
 
 
-class JobViewSet(mixins.ListModelMixin,
+class JobViewSet(CachedRetrieveMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  mixins.CreateModelMixin,
                  viewsets.GenericViewSet):
@@ -50,38 +89,72 @@ class JobViewSet(mixins.ListModelMixin,
     Allows viewing an overview of all, completed, failed and pending jobs.
     Detail view returns the classified page and the corresponding labels.
 
-    New jobs can be posted to this endpoint as well.
+    New jobs can be posted to this endpoint as well, and cancelled.
+    Submissions are throttled and capped per client.
+    The details of done jobs are cached.
     """
     queryset = Classifier.objects.all()
+    pagination_class = DateStartedCursorPagination
+    throttle_classes = (SubmissionThrottle,)
+    detail_cache_name = 'job'
+
+    def is_immutable(self, instance):
+        # failed jobs may still complete, e.g. timed out by the sweeper while running
+        return instance.state == ClassificationJob.DONE
 
     def get_serializer_class(self):
         """Conditional serializer class"""
         if self.action == 'retrieve':
             return JobDetailSerializer
+        if self.action == 'batch':
+            return JobBatchSerializer
+        if self.action == 'export':
+            return JobExportSerializer
         return JobListSerializer
 
     def get_queryset(self):
         # return in the descending order
-        queryset = ClassificationJob.objects.all().order_by('-date_started')
+        # the pages are joined without their content
+        queryset = ClassificationJob.objects.all().order_by('-date_started') \
+            .select_related('classified_page').defer('classified_page__content')
+        if self.action == 'retrieve':
+            # the packed results are read along with the job, and with
+            # the job it reuses if any. Only jobs whose results are
+            # stored as rows need another query
+            queryset = queryset.select_related('reused_from')
+        else:
+            queryset = queryset.defer('packed_results')
 
         # conditional filtering based on the action
+        # all of them are range scans on the (state, date_started) index
+        timeout_date = timezone.now() - CLASSIFY_TIMEOUT
         if self.action == 'failed':
-            # show only the failed ones
-            queryset = queryset.annotate(elapsed_time=ExpressionWrapper(timezone.now() - F('date_started'),
-                                                                        output_field=DurationField()))
-            queryset = queryset.filter(Q(is_failed=True) | Q(date_ended__isnull=True,
-                                                             elapsed_time__gt=CLASSIFY_TIMEOUT))
+            # show only the failed ones, including the ones that exceeded the timeout
+            queryset = queryset.filter(Q(state__in=ClassificationJob.FAILED_STATES) | Q(
+                state__in=ClassificationJob.ACTIVE_STATES, date_started__lt=timeout_date))
         if self.action == 'pending':
             # show only the pending ones
-            queryset = queryset.annotate(elapsed_time=ExpressionWrapper(timezone.now() - F('date_started'),
-                                                                        output_field=DurationField()))
-            queryset = queryset.filter(is_failed=False, date_ended__isnull=True, elapsed_time__lte=CLASSIFY_TIMEOUT)
+            queryset = queryset.filter(state__in=ClassificationJob.ACTIVE_STATES,
+                                       date_started__gte=timeout_date)
         if self.action == 'done':
             # just the finished ones
-            queryset = queryset.filter(is_failed=False, date_ended__isnull=False)
+            queryset = queryset.filter(state=ClassificationJob.DONE)
 
         return queryset
 
+    def create(self, request, *args, **kwargs):
+        """Identical submissions share the same job, returned with 200 instead of 201"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        response_status = status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK
+        data = serializer.data
+        return Response(data, status=response_status, headers=self.get_success_headers(data))
+
+    def perform_create(self, serializer):
+        # the active jobs of the client are checked only if a job is created
+        serializer.save(client=get_client(self.request))
+
     @action(detail=False)
     def failed(self, request, *args, **kwargs):
         # pass it down to list, get_queryset takes
@@ -97,3 +170,108 @@ class JobViewSet(mixins.ListModelMixin,
     def done(self, request, *args, **kwargs):
         # again
         return self.list(request, *args, **kwargs)
+
+    @action(detail=False)
+    def export(self, request, *args, **kwargs):
+        """Stream all the finished jobs with their results as newline
+        delimited JSON, oldest first. Filtered by `classifier` and by the
+        end date with `since` and `until`."""
+        params = self.get_serializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = params.validated_data
+
+        queryset = ClassificationJob.objects.filter(state=ClassificationJob.DONE) \
+            .select_related('classified_page', 'reused_from') \
+            .only('id', 'classifier_used', 'date_ended', 'packed_results', 'reused_from',
+                  'classified_page__url', 'reused_from__packed_results') \
+            .order_by('date_ended', 'id')
+        if 'classifier' in filters:
+            queryset = queryset.filter(classifier_used_id=filters['classifier'])
+        if 'since' in filters:
+            queryset = queryset.filter(date_ended__gte=filters['since'])
+        if 'until' in filters:
+            queryset = queryset.filter(date_ended__lt=filters['until'])
+
+        date_field = serializers.DateTimeField()
+        rows = ({'id': job.id, 'url': job.classified_page.url, 'classifier_used': job.classifier_used_id,
+                 'date_ended': date_field.to_representation(job.date_ended), 'results': results}
+                for job, results in iter_job_results(queryset))
+        return StreamingHttpResponse(stream_ndjson(rows), content_type='application/x-ndjson')
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request, *args, **kwargs):
+        """Create jobs for a list of urls with the same classifier.
+        Returns the ids of the jobs in the order of the urls."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        client = get_client(request)
+        check_active_jobs(client, len(serializer.validated_data['urls']))
+        serializer.save(client=client)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        """Cancel a pending or running job. Queued jobs are removed from the
+        queue, running ones stop at their next stage. Ended jobs can't be cancelled."""
+        instance = self.get_object()
+        if not submission.cancel_jobs([instance]):
+            return Response({'detail': 'The job already ended.'}, status=status.HTTP_409_CONFLICT)
+        instance.refresh_from_db()
+        return Response(self.get_serializer(instance).data)
+
+
+class ClassifyView(generics.GenericAPIView):
+    """Classify small html documents in the web process and return the
+    positive xpaths right away, without a job to poll. The classifiers are
+    cached by the process. Larger or slower documents must be submitted as
+    jobs. The classification is optionally saved as a job afterwards."""
+    serializer_class = ClassifySerializer
+    throttle_classes = (ScopedRateThrottle,)
+    throttle_scope = 'classify'
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        classifier = data['classifier_used']
+
+        timer = StageTimer()
+        # outside the time budget, a cold process must be able to load the model once
+        with timer.stage('load'):
+            model = load_classifier(classifier)
+        try:
+            with deadline('classification', settings.CLASSIFY_SYNC_DEADLINE):
+                paths = tasks.classify_html(model, data['html'], timer)
+        except DeadlineExceeded:
+            return Response({'detail': 'The classification exceeded its time budget, submit a job instead.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except (ValueError, etree.LxmlError) as exce:
+            # the html couldn't be parsed, other failures are server errors
+            logger.info('Synchronous classification failed: %s', exce)
+            return Response({'detail': '{}: {}'.format(type(exce).__name__, exce)},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        if data['persist']:
+            django_rq.get_queue(ClassificationJob.INTERACTIVE).enqueue(
+                tasks.do_save_classification, data['url'], classifier.id, data['html'], paths, timer.timings,
+                client=get_client(request))
+        return Response({'classifier_used': classifier.id, 'results': paths, 'timings': timer.timings})
+
+
+def metrics(request):
+    """Job, stage timing and queue metrics in the Prometheus text format"""
+    connection = get_connection()
+    job_counts, histograms = read_metrics(connection)
+
+    queues = [django_rq.get_queue(name) for name in settings.RQ_QUEUES]
+    pending_batches = sum(connection.zcard(submission.PENDING_KEY.format(*member.decode('ascii').split(':')))
+                          for member in connection.smembers(submission.PENDING_CLASSIFIERS_KEY))
+    gauges = {
+        'learnhtml_queue_depth': ('Tasks waiting in the queues',
+                                  [({'queue': queue.name}, len(queue)) for queue in queues]),
+        'learnhtml_batching_depth': ('Jobs waiting to be coalesced in batches', [({}, pending_batches)]),
+        'learnhtml_download_depth': ('Pages waiting for the download stage',
+                                     [({}, connection.llen(submission.DOWNLOADS_KEY))]),
+    }
+    return HttpResponse(render_metrics(job_counts, histograms, gauges),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,74 @@
+"""Long lived rq workers. Jobs are executed inside the worker process
+itself instead of a forked work horse, so imports and cached classifiers
+stay warm between jobs. Processes are recycled after a number of jobs,
+when their memory grows past a ceiling or when a job left threads running. Workers listening on several
+queues drain them by weight, so lower priorities are never starved."""
+import logging
+import random
+import resource
+
+from rq import SimpleWorker
+
+logger = logging.getLogger(__name__)
+
+_recycle_reason = None
+
+
+def request_recycle(reason):
+    """Recycle the worker once the current job ended, e.g. because the job
+    left threads behind that it couldn't stop"""
+    global _recycle_reason
+    _recycle_reason = reason
+
+
+def get_max_rss():
+    """Peak resident memory of the current process in megabytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kilobytes on linux
+
+
+def weighted_order(queues, weights):
+    """Random order of the queues where each queue comes before the others
+    with a probability proportional to its weight, 1 if missing. Queues
+    weighted 0 come last."""
+    def key(queue):
+        weight = weights.get(queue.name, 1)
+        return random.random() ** (1.0 / weight) if weight > 0 else -1
+
+    return sorted(queues, key=key, reverse=True)
+
+
+class RecyclingWorker(SimpleWorker):
+    """Worker executing jobs in process that stops gracefully after
+    `max_jobs` jobs or once its peak memory exceeds `max_memory` megabytes.
+    A supervisor is expected to replace it when it exits. With `weights`,
+    a dict of queue name -> weight, the queues are polled in a weighted
+    random order for every job instead of always in the same order."""
+
+    def __init__(self, *args, max_jobs=None, max_memory=None, weights=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.weights = weights
+        self.jobs_done = 0
+
+    def dequeue_job_and_maintain_ttl(self, timeout):
+        """Reorder the queues before waiting for the next job, the first
+        non empty queue in the order is dequeued from"""
+        if self.weights:
+            self.queues = weighted_order(self.queues, self.weights)
+        return super().dequeue_job_and_maintain_ttl(timeout)
+
+    def execute_job(self, job, queue):
+        """Run the job then check whether the process should be recycled"""
+        super().execute_job(job, queue)
+        self.jobs_done += 1
+
+        if self.max_jobs is not None and self.jobs_done >= self.max_jobs:
+            logger.info('Worker %s recycling after %d jobs', self.name, self.jobs_done)
+            self._stop_requested = True
+        elif self.max_memory is not None and get_max_rss() > self.max_memory:
+            logger.info('Worker %s recycling at %d MB', self.name, get_max_rss())
+            self._stop_requested = True
+        elif _recycle_reason is not None:
+            logger.info('Worker %s recycling: %s', self.name, _recycle_reason)
+            self._stop_requested = True
@@ -1,10 +1,13 @@
 import os
+import tempfile
 from distutils.util import strtobool
 from os.path import join
 
 import dj_database_url
 from configurations import Configuration, values
 
+from learnhtml_backend.consts import JOB_QUEUES
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
@@ -194,17 +197,120 @@ class Common(Configuration):
         ],
         'DEFAULT_AUTHENTICATION_CLASSES': (
         ),
-
+        # proxies in front of the app, clients are identified by the address before them
+        # in X-Forwarded-For, 0 uses the remote address
+        'NUM_PROXIES': int(os.getenv('DJANGO_NUM_PROXIES', 0)),
+        # submissions per client, see JobViewSet, counted in the default cache
+        'DEFAULT_THROTTLE_RATES': {
+            'jobs': os.getenv('JOB_SUBMISSION_RATE', '120/min'),
+            'job_batches': os.getenv('JOB_BATCH_SUBMISSION_RATE', '10/min'),
+            'classify': os.getenv('CLASSIFY_SYNC_RATE', '60/min'),
+        },
     }
 
-    # Redis queue
+    # Redis queues, the default one for the maintenance tasks and one per job priority
+    # they must all be in the same redis
     RQ_QUEUES = {
-        'default': {
+        name: {
             'DEFAULT_TIMEOUT': 360,
             'URL': os.getenv('DJANGO_REDIS_QUEUE_URL',
                              'redis://:password@localhost:6379/0')  # in case you're on Heroku
+        } for name in ('default',) + JOB_QUEUES
+    }
+
+    # A worker takes its next job from a queue picked with these weights, the other queues
+    # are tried in turn if it is empty, so interactive jobs mostly go first without starving the bulk ones
+    CLASSIFY_QUEUE_WEIGHTS = {
+        'interactive': int(os.getenv('CLASSIFY_WEIGHT_INTERACTIVE', 8)),
+        'refresh': int(os.getenv('CLASSIFY_WEIGHT_REFRESH', 2)),
+        'bulk': int(os.getenv('CLASSIFY_WEIGHT_BULK', 1)),
+    }
+
+    # Active jobs a client may have at once (0 for no limit), on top of the submission rates
+    JOB_CLIENT_MAX_ACTIVE = int(os.getenv('JOB_CLIENT_MAX_ACTIVE', 10000))
+
+    # Deadlines of the stages of a classification task, in seconds
+    JOB_DOWNLOAD_DEADLINE = int(os.getenv('JOB_DOWNLOAD_DEADLINE', 60))
+    JOB_CLASSIFY_DEADLINE = int(os.getenv('JOB_CLASSIFY_DEADLINE', 120))
+
+    # Periodic sweep of the jobs, active jobs past the timeout are timed out and the ones
+    # missing from redis for JOB_SWEEP_LOST_AFTER seconds are enqueued again
+    JOB_SWEEP_INTERVAL = int(os.getenv('JOB_SWEEP_INTERVAL', 60))  # seconds
+    JOB_SWEEP_BATCH_SIZE = int(os.getenv('JOB_SWEEP_BATCH_SIZE', 1000))
+    JOB_SWEEP_MAX_BATCHES = int(os.getenv('JOB_SWEEP_MAX_BATCHES', 10))
+    JOB_SWEEP_LOST_AFTER = int(os.getenv('JOB_SWEEP_LOST_AFTER', 120))
+
+    # Cache of the immutable detail responses (done jobs, classifiers) and of the throttling
+    # history, kept in memory per process or shared in redis if an url is given. The detail
+    # responses are only cached once it is shared, the workers must be able to invalidate them,
+    # and the submission rates are only enforced per process until then
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         }
     }
+    if os.getenv('DJANGO_REDIS_CACHE_URL'):
+        CACHES['default'] = {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('DJANGO_REDIS_CACHE_URL'),
+        }
+    DETAIL_CACHE_TIMEOUT = int(os.getenv('DETAIL_CACHE_TIMEOUT', 24 * 60 * 60))  # seconds
+
+    # Downloaded pages are fetched again, conditionally, once older than this (0 keeps them forever)
+    PAGE_MAX_AGE = int(os.getenv('PAGE_MAX_AGE', 7 * 24 * 60 * 60))  # seconds
+
+    # zlib level of the stored html of the pages
+    PAGE_CONTENT_COMPRESSION_LEVEL = int(os.getenv('PAGE_CONTENT_COMPRESSION_LEVEL', 6))
+
+    # Maximum number of urls accepted by /api/v1/jobs/batch/
+    JOB_BATCH_MAX_SIZE = int(os.getenv('JOB_BATCH_MAX_SIZE', 1000))
+
+    # /api/v1/classify/ classifies html in the web process, up to this size and within this
+    # time budget (only enforced by processes serving requests in their main thread)
+    CLASSIFY_SYNC_MAX_SIZE = int(os.getenv('CLASSIFY_SYNC_MAX_SIZE', 256 * 1024))  # bytes
+    CLASSIFY_SYNC_DEADLINE = float(os.getenv('CLASSIFY_SYNC_DEADLINE', 2))  # seconds
+
+    # A job submitted for the same page and classifier as a pending job, or as a job that
+    # finished less than JOB_FRESHNESS_WINDOW seconds ago, returns that job (0 disables the latter)
+    JOB_FRESHNESS_WINDOW = int(os.getenv('JOB_FRESHNESS_WINDOW', 3600))
+
+    # Jobs of the same classifier are coalesced into batches of this size (1 disables batching)
+    # a partial batch is enqueued once its oldest job waited CLASSIFY_BATCH_WINDOW seconds
+    # batching needs the coalescer process running (manage.py coalescejobs, see the Procfile)
+    CLASSIFY_BATCH_SIZE = int(os.getenv('CLASSIFY_BATCH_SIZE', 1))
+    CLASSIFY_BATCH_WINDOW = float(os.getenv('CLASSIFY_BATCH_WINDOW', 2))
+
+    # Download stage (manage.py downloadpages), pages are fetched before their jobs are enqueued
+    DOWNLOAD_STAGE = strtobool(os.getenv('DOWNLOAD_STAGE', 'no'))
+    DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', 50))
+    DOWNLOAD_PER_HOST = int(os.getenv('DOWNLOAD_PER_HOST', 4))
+    DOWNLOAD_TIMEOUT = float(os.getenv('DOWNLOAD_TIMEOUT', 30))  # seconds
+    DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', 2))
+    DOWNLOAD_INLINE_THREADS = int(os.getenv('DOWNLOAD_INLINE_THREADS', 8))
+
+    # Assets inlined in the pages are cached on disk, shared by all the processes, and the least
+    # recently used are evicted past the size. DOWNLOAD_SKIP_ASSETS lists the types never inlined
+    # (images, fonts), their urls are kept instead
+    DOWNLOAD_ASSET_CACHE_DIR = os.getenv('DOWNLOAD_ASSET_CACHE_DIR',
+                                         join(tempfile.gettempdir(), 'learnhtml-assets'))
+    DOWNLOAD_ASSET_CACHE_SIZE = int(os.getenv('DOWNLOAD_ASSET_CACHE_SIZE', 1024 * 1024 * 1024))  # bytes
+    DOWNLOAD_SKIP_ASSETS = os.getenv('DOWNLOAD_SKIP_ASSETS', '')
+
+    # Deserialized classifiers kept in memory by each worker process
+    CLASSIFIER_CACHE_MAX_ENTRIES = int(os.getenv('CLASSIFIER_CACHE_MAX_ENTRIES', 8))
+    CLASSIFIER_CACHE_MAX_BYTES = int(os.getenv('CLASSIFIER_CACHE_MAX_BYTES',
+                                               512 * 1024 * 1024))
+
+    # Local copies of the classifier artifacts, when the storage is remote
+    CLASSIFIER_ARTIFACT_DIR = os.getenv('CLASSIFIER_ARTIFACT_DIR',
+                                        join(os.path.dirname(BASE_DIR), 'artifacts'))
+
+    # Preforking classification worker (manage.py classifyworker)
+    CLASSIFY_WORKER_CONCURRENCY = float(os.getenv('CLASSIFY_WORKER_CONCURRENCY', 1))  # processes per core
+    CLASSIFY_WORKER_MAX_JOBS = int(os.getenv('CLASSIFY_WORKER_MAX_JOBS', 1000))
+    CLASSIFY_WORKER_MAX_MEMORY = int(os.getenv('CLASSIFY_WORKER_MAX_MEMORY', 1024))  # megabytes
+    # classifiers loaded before forking
+    CLASSIFY_WORKER_PRELOAD = int(os.getenv('CLASSIFY_WORKER_PRELOAD', 2))
 
     # CORS
     CORS_ORIGIN_WHITELIST = (
@@ -3,6 +3,7 @@ import os
 from configurations import values
 
 from learnhtml_backend.config.common import Common
+from learnhtml_backend.consts import JOB_QUEUES
 
 
 class Heroku(Common):
@@ -14,10 +15,22 @@ class Heroku(Common):
     INSTALLED_APPS += ("gunicorn",)
 
     RQ_QUEUES = {
-        'default': {
+        name: {
             'URL': os.getenv('REDIS_URL', 'redis://localhost:6379/0'),  # If you're on Heroku
             'DEFAULT_TIMEOUT': 600,
-        },
+        } for name in ('default',) + JOB_QUEUES
+    }
+
+    # behind the Heroku router
+    REST_FRAMEWORK = dict(Common.REST_FRAMEWORK, NUM_PROXIES=1)
+
+    # the throttling history must be shared by the web processes
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('DJANGO_REDIS_CACHE_URL',
+                                  os.getenv('REDIS_URL', 'redis://localhost:6379/0')),
+        }
     }
 
     CORS_ORIGIN_ALLOW_ALL = values.BooleanValue(False, environ_name='CORS_ORIGIN_ALLOW_ALL')
@@ -1,5 +1,6 @@
 import os
 
+from learnhtml_backend.consts import JOB_QUEUES
 from .common import Common
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -27,13 +28,13 @@ class Local(Common):
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
     RQ_QUEUES = {
-        'default': {
+        name: {
             'HOST': 'localhost',
             'PORT': 6379,
             'DB': 0,
             'PASSWORD': 'password',
             'DEFAULT_TIMEOUT': 360,
-        }
+        } for name in ('default',) + JOB_QUEUES
     }
 
     SECRET_KEY = 'secreeeet'
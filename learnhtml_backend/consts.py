@@ -1,3 +1,6 @@
 from datetime import timedelta
 
-CLASSIFY_TIMEOUT = timedelta(minutes=10)
\ No newline at end of file
+CLASSIFY_TIMEOUT = timedelta(minutes=10)
+
+# queues of the classification jobs, named after the priority of the jobs
+JOB_QUEUES = ('interactive', 'refresh', 'bulk')
@@ -6,7 +6,8 @@ from django.views.generic.base import RedirectView
 from rest_framework.authtoken import views
 from rest_framework.routers import DefaultRouter
 
-from learnhtml_backend.classification.views import PageViewSet, ClassifierViewSet, JobViewSet
+from learnhtml_backend.classification.views import PageViewSet, ClassifierViewSet, JobViewSet, ClassifyView, \
+    metrics
 
 router = DefaultRouter()
 router.register('pages', viewset=PageViewSet)
@@ -16,9 +17,11 @@ router.register('classifiers', viewset=ClassifierViewSet, base_name='classifiers
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include(router.urls)),
+    path('api/v1/classify/', ClassifyView.as_view(), name='classify'),
     path('api-token-auth/', views.obtain_auth_token),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('django-rq/', include('django_rq.urls')),
+    path('metrics', metrics, name='metrics'),
 
     # the 'api-root' from django rest-frameworks default router
     # http://www.django-rest-framework.org/api-guide/routers/#defaultrouter